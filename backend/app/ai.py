@@ -3,9 +3,13 @@ import os
 import json
 import logging
 import re
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from datetime import datetime
 
+from app.cache import build_cache, data_dir, make_key
+from app import digest, retrieval, tokens
+
 load_dotenv()
 
 # -----------------------
@@ -23,6 +27,21 @@ AZURE_OPENAI_DEPLOYMENT = os.getenv("AZURE_OPENAI_DEPLOYMENT")
 AZURE_API_VERSION = os.getenv("AZURE_API_VERSION", "2023-09-01-preview")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
+# Max number of page/section LLM calls in flight per document (1 = sequential)
+AI_MAX_CONCURRENCY = int(os.getenv("AI_MAX_CONCURRENCY", "4"))
+
+# LLM response cache: memory | disk | mongo | none
+AI_CACHE_BACKEND = os.getenv("AI_CACHE_BACKEND", "memory")
+AI_CACHE_TTL_SECONDS = int(os.getenv("AI_CACHE_TTL_SECONDS", "86400"))
+AI_CACHE_MAX_ENTRIES = int(os.getenv("AI_CACHE_MAX_ENTRIES", "1024"))
+AI_CACHE_DIR = os.getenv("AI_CACHE_DIR") or data_dir("cache", "ai")
+
+# What to do when raw_text does not fit the deployment's context budget (see app/tokens.py):
+# head_tail | rank (retrieval chunks) | map_reduce (summarise chunks, then use the summaries)
+AI_COMPACTION_STRATEGY = os.getenv("AI_COMPACTION_STRATEGY", "rank").strip().lower()
+# Chunk size for the map step of map_reduce
+AI_MAP_CHUNK_TOKENS = int(os.getenv("AI_MAP_CHUNK_TOKENS", "8000"))
+
 # -----------------------
 # Client Initialization
 # -----------------------
@@ -47,6 +66,17 @@ try:
 except Exception as e:
     logger.warning("[AI] Failed to import OpenAI SDK: %s", e)
 
+# -----------------------
+# Response Cache
+# -----------------------
+response_cache = build_cache(
+    AI_CACHE_BACKEND,
+    max_entries=AI_CACHE_MAX_ENTRIES,
+    ttl=AI_CACHE_TTL_SECONDS,
+    directory=AI_CACHE_DIR,
+    collection="ai_cache",
+)
+
 
 # =====================================================
 # ROLE INFERENCE (legacy, kept for fallback)
@@ -355,209 +385,503 @@ def _sanitize_and_fill(content, template, pages_override, sections_override):
         )
 
 
+# =====================================================
+# REQUEST / RESPONSE SHAPES
+# (shared by the sync functions below and app/ai_async.py)
+# =====================================================
+def _model_name() -> str:
+    return AZURE_OPENAI_DEPLOYMENT if use_azure else "gpt-4o-mini"
+
+
+def _item_request(role, item_name, prompt_text, raw_text_context) -> dict:
+    """Keyword arguments for a single page/section chat completion."""
+    system_msg = "You are a page generator. Return only the page content." if role == "page" else \
+                 "You are a section generator. Return only the section content."
+    return {
+        "model": _model_name(),
+        "messages": [
+            {"role": "system", "content": system_msg},
+            {"role": "user", "content": json.dumps({"name": item_name, "prompt": prompt_text, "raw_text": raw_text_context}, ensure_ascii=False)},
+        ],
+        "temperature": 0.25,
+    }
+
+
+def _cache_key(request: dict, user_instruction=None) -> str:
+    """
+    Key = hash(deployment, system message, user payload, temperature, user_instruction).
+    The user payload is the JSON carrying the prompt and raw_text (plus existing_content
+    for regenerations), so any change to those produces a new key.
+    """
+    messages = request["messages"]
+    return make_key(
+        request["model"],
+        messages[0]["content"],
+        messages[1]["content"],
+        request["temperature"],
+        user_instruction,
+    )
+
+
+def _complete(request: dict, user_instruction=None, use_cache: bool = True, usage: dict = None) -> str:
+    """
+    Run a chat completion through the response cache and return the message content.
+    `use_cache=False` skips the lookup but still stores the fresh answer.
+    Errors propagate and are never cached. If `usage` is given, completion token counts are added to it.
+    """
+    key = _cache_key(request, user_instruction)
+    if use_cache:
+        cached = response_cache.get(key)
+        if cached is not None:
+            _record_completion(usage, cached, cached=True)
+            return cached
+    resp = client.chat.completions.create(**request)
+    content = resp.choices[0].message.content
+    response_cache.set(key, content)
+    _record_completion(usage, content, reported=getattr(resp, "usage", None))
+    return content
+
+
+def _record_completion(usage: dict, content: str, cached: bool = False, reported=None):
+    if usage is None:
+        return
+    usage["cached"] = cached
+    completion = getattr(reported, "completion_tokens", None)
+    usage["completion_tokens"] = completion if isinstance(completion, int) else tokens.count_tokens(content or "", _model_name())
+    prompt = getattr(reported, "prompt_tokens", None)
+    if isinstance(prompt, int):
+        usage["prompt_tokens_reported"] = prompt
+
+
+# -----------------------
+# Token budgeting
+# -----------------------
+_SUMMARY_SYSTEM = (
+    "You condense source material for a document writer.\n"
+    "Summarise the excerpt below. Keep every fact, figure, name, date and defined term; "
+    "drop repetition and boilerplate. Return plain text only."
+)
+
+
+def _summarise_chunk(chunk: str, use_cache: bool = True) -> str:
+    request = {
+        "model": _model_name(),
+        "messages": [
+            {"role": "system", "content": _SUMMARY_SYSTEM},
+            {"role": "user", "content": chunk},
+        ],
+        "temperature": 0,
+    }
+    try:
+        return (_complete(request, use_cache=use_cache) or "").strip()
+    except Exception as e:
+        logger.warning("[AI] chunk summary failed, keeping truncated chunk: %s", e)
+        return tokens.truncate_to_tokens(chunk, max(1, tokens.count_tokens(chunk) // 4), _model_name())
+
+
+def _map_reduce(raw_text: str, max_tokens: int, use_cache: bool = True, depth: int = 0) -> str:
+    """Summarise chunks in parallel (map), join the summaries (reduce); repeat while still too big."""
+    model = _model_name()
+    chunk_tokens = max(256, min(AI_MAP_CHUNK_TOKENS, tokens.context_budget(model) // 2))
+    chunks = retrieval.chunk_text(raw_text, chunk_tokens, 0)
+    workers = max(1, min(AI_MAX_CONCURRENCY, len(chunks)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ai-map") as pool:
+        summaries = list(pool.map(lambda c: _summarise_chunk(c, use_cache), chunks))
+    combined = "\n\n".join(x for x in summaries if x)
+
+    if tokens.count_tokens(combined, model) > max_tokens and depth < 2 and len(combined) < len(raw_text):
+        return _map_reduce(combined, max_tokens, use_cache, depth + 1)
+    return tokens.head_tail(combined, max_tokens, model)
+
+
+def _compact_raw_text(raw_text: str, max_tokens: int, query: str = "", strategy: str = None, use_cache: bool = True) -> str:
+    """Shrink raw_text to at most `max_tokens` with the given strategy."""
+    model = _model_name()
+    strategy = strategy or AI_COMPACTION_STRATEGY
+    if strategy == "map_reduce" and client:
+        return _map_reduce(raw_text, max_tokens, use_cache)
+    if strategy == "rank":
+        raw_text = retrieval.select_context(raw_text, query, token_budget=max_tokens)
+    # head_tail, and the hard guarantee for "rank" (whose chunk sizes are estimates)
+    return tokens.head_tail(raw_text, max_tokens, model)
+
+
+def _fit_request(build, raw_text: str, query: str = "", use_cache: bool = True):
+    """
+    Build a request whose prompt + raw_text fits the deployment's context budget.
+    `build(text)` returns the request for a given raw_text. Returns (request, token_usage).
+    """
+    model = _model_name()
+    budget = tokens.context_budget(model)
+    overhead = tokens.count_messages(build("")["messages"], model)
+    # JSON-escaping inside the user message adds a little; keep 5% headroom
+    available = max(0, int((budget - overhead) * 0.95))
+    original = tokens.count_tokens(raw_text or "", model)
+
+    strategy = None
+    if original > available:
+        strategy = AI_COMPACTION_STRATEGY
+        logger.info("[AI] raw_text %d tokens > %d available; compacting with %s", original, available, strategy)
+        raw_text = _compact_raw_text(raw_text, available, query, strategy, use_cache)
+
+    request = build(raw_text)
+    usage = {
+        "prompt_tokens": tokens.count_messages(request["messages"], model),
+        "raw_text_tokens": tokens.count_tokens(raw_text or "", model) if strategy else original,
+        "raw_text_tokens_original": original,
+        "context_budget": budget,
+        "compaction": strategy,
+    }
+    return request, usage
+
+
+def _with_token_usage(result_json: str, key: str, usage: dict) -> str:
+    """Attach token_usage to the first item of a regenerate result ({"sections"|"pages": [...]})."""
+    try:
+        data = json.loads(result_json)
+        data[key][0]["token_usage"] = usage
+        return json.dumps(data, ensure_ascii=False)
+    except Exception:
+        return result_json
+
+
+def _item_placeholder(item_name, prompt_text, raw_text_context) -> dict:
+    snippet = (raw_text_context or "")[:120].replace("\n", " ")
+    return {"name": item_name, "content": f"⚠️ Placeholder for {item_name}: {snippet}", "generated_prompt": prompt_text, "prompt_used": prompt_text}
+
+
+def _item_failure(item_name, prompt_text) -> dict:
+    return {"name": item_name, "content": f"⚠️ AI generation failed for {item_name}", "generated_prompt": prompt_text, "prompt_used": prompt_text}
+
+
+def _item_result(item_name, prompt_text, content) -> dict:
+    """Unwrap {"content": ...} JSON replies, otherwise keep the raw model output."""
+    try:
+        parsed = json.loads(content)
+        if isinstance(parsed, dict) and "content" in parsed:
+            return {"name": item_name, "content": parsed["content"], "generated_prompt": prompt_text, "prompt_used": prompt_text}
+    except Exception:
+        pass
+    return {"name": item_name, "content": content, "generated_prompt": prompt_text, "prompt_used": prompt_text}
+
+
+_REGENERATE_SYSTEM = {
+    "sections": (
+        "You are an assistant that rewrites document SECTIONS.\n"
+        "Rewrite ONLY the provided existing_content using raw_text as context.\n"
+        "Strictly apply the user_instruction.\n"
+        "Return valid JSON with a top-level key 'sections'.\n"
+        "Each section must include: name, content, prompt_used, generated_prompt."
+    ),
+    "pages": (
+        "You are an assistant that rewrites document PAGES.\n"
+        "Rewrite ONLY the provided existing_content using raw_text as context.\n"
+        "Strictly apply the user_instruction.\n"
+        "Return valid JSON with a top-level key 'pages'.\n"
+        "Each page must include: name, content, prompt_used, generated_prompt."
+    ),
+}
+
+
+def _regenerate_request(key: str, raw_text, existing_content, user_instruction, base_prompt) -> dict:
+    """Keyword arguments for a regenerate call; `key` is "sections" or "pages"."""
+    return {
+        "model": _model_name(),
+        "messages": [
+            {"role": "system", "content": _REGENERATE_SYSTEM[key]},
+            {
+                "role": "user",
+                "content": json.dumps({
+                    "raw_text": raw_text,
+                    "existing_content": existing_content,
+                    "user_instruction": user_instruction,
+                    "base_prompt": base_prompt
+                }, ensure_ascii=False),
+            },
+        ],
+        "temperature": 0.3,
+    }
+
+
+def _regenerated_section_offline(existing_content, user_instruction, base_prompt) -> str:
+    clean = _strip_leading_heading(existing_content or "")
+    return json.dumps({"sections": [{
+        "name": "Regenerated Section",
+        "content": f"{clean} (modified with {user_instruction})",
+        "prompt_used": f"{base_prompt} + {user_instruction}",
+        "generated_prompt": base_prompt,
+    }]}, ensure_ascii=False)
+
+
+def _regenerated_section_result(ai_out, existing_content, user_instruction, base_prompt) -> str:
+    logger.info("[AI][regenerate_section] raw output: %s", ai_out)
+
+    parsed = _safe_json_loads(ai_out)
+    if parsed and "sections" in parsed and parsed["sections"]:
+        # clean content
+        parsed["sections"][0]["content"] = _strip_leading_heading(
+            parsed["sections"][0].get("content", ""), force=False
+        ).strip() or existing_content
+
+
+    # fallback if plain text
+    return json.dumps({"sections": [{
+        "name": "Regenerated Section",
+        "content": _strip_leading_heading(ai_out or existing_content or "⚠️ No content"),
+        "prompt_used": f"{base_prompt} + {user_instruction}",
+        "generated_prompt": base_prompt,
+    }]}, ensure_ascii=False)
+
+
+def _regenerated_section_failure(existing_content, user_instruction, base_prompt) -> str:
+    return json.dumps({"sections": [{
+        "name": "Regenerated Section",
+        "content": f"{existing_content or '⚠️ AI error'} (modified with {user_instruction})",
+        "prompt_used": f"{base_prompt} + {user_instruction}",
+        "generated_prompt": base_prompt,
+    }]}, ensure_ascii=False)
+
+
+def _regenerated_page_offline(existing_content, user_instruction, base_prompt) -> str:
+    return json.dumps({"pages": [{
+        "name": "Regenerated Page",
+        "content": f"{existing_content} (modified with {user_instruction})",
+        "prompt_used": f"{base_prompt} + {user_instruction}",
+        "generated_prompt": base_prompt,
+    }]}, ensure_ascii=False)
+
+
+def _regenerated_page_result(ai_out, existing_content, user_instruction, base_prompt) -> str:
+    logger.info("[AI][regenerate_page] raw output: %s", ai_out)
+
+    parsed = _safe_json_loads(ai_out)
+    if parsed and "pages" in parsed and parsed["pages"]:
+        parsed["pages"][0]["content"] = parsed["pages"][0].get("content", "").strip() or existing_content
+        return json.dumps(parsed, ensure_ascii=False)
+
+    # fallback if plain text
+    return json.dumps({"pages": [{
+        "name": "Regenerated Page",
+        "content": ai_out or existing_content or "⚠️ No content",
+        "prompt_used": f"{base_prompt} + {user_instruction}",
+        "generated_prompt": base_prompt,
+    }]}, ensure_ascii=False)
+
+
+def _regenerated_page_failure(existing_content, user_instruction, base_prompt) -> str:
+    return json.dumps({"pages": [{
+        "name": "Regenerated Page",
+        "content": f"{existing_content or '⚠️ AI error'} (modified with {user_instruction})",
+        "prompt_used": f"{base_prompt} + {user_instruction}",
+        "generated_prompt": base_prompt,
+    }]}, ensure_ascii=False)
+
+
 # =====================================================
 # MAIN GENERATION
 # =====================================================
-def generate_document_from_template(template: dict, raw_text: str, pages_override: list = None, sections_override: list = None) -> str:
-    """Generate a document by sequentially building each page/section."""
-    logger.info("[AI] generate_document_from_template called; raw_text length=%d", len(raw_text or ""))
-    pages_override = pages_override or []
-    sections_override = sections_override or []
+def _call_ai_for_item(role, item_name, prompt_text, raw_text_context, use_cache: bool = True, raise_errors: bool = False,
+                      query: str = None):
+    """
+    Generate content for a single page/section. Failures become placeholder content,
+    unless raise_errors=True (background jobs use that to track failed items).
+    `query` (retrieval.item_query of the item) ranks chunks if raw_text still needs compacting.
+    """
+    if not client:
+        return _item_placeholder(item_name, prompt_text, raw_text_context)
+
+    try:
+        request, usage = _fit_request(
+            lambda text: _item_request(role, item_name, prompt_text, text), raw_text_context, query or item_name, use_cache
+        )
+        content = _complete(request, use_cache=use_cache, usage=usage)
+        return {**_item_result(item_name, prompt_text, content), "token_usage": usage}
+    except Exception as e:
+        logger.exception("[AI] single-item generation failed for %s '%s': %s", role, item_name, e)
+        if raise_errors:
+            raise
+        return _item_failure(item_name, prompt_text)
 
-    pages_out, sections_out = [], []
 
-    def _call_ai_for_item(role, item_name, prompt_text, raw_text_context):
-        if not client:
-            snippet = (raw_text_context or "")[:120].replace("\n", " ")
-            return {"name": item_name, "content": f"⚠️ Placeholder for {item_name}: {snippet}", "generated_prompt": prompt_text, "prompt_used": prompt_text}
+def _stream_ai_for_item(role, item_name, prompt_text, raw_text_context, on_delta, use_cache: bool = True, raise_errors: bool = False,
+                        query: str = None):
+    """
+    Like _call_ai_for_item, but requests the completion with stream=True and calls
+    on_delta(text) for every token chunk as it arrives. A cache hit is delivered as one chunk.
+    The returned dict is final (JSON replies are unwrapped); deltas are the raw model output.
+    """
+    if not client:
+        out = _item_placeholder(item_name, prompt_text, raw_text_context)
+        on_delta(out["content"])
+        return out
 
-        system_msg = "You are a page generator. Return only the page content." if role == "page" else \
-                     "You are a section generator. Return only the section content."
+    try:
+        request, usage = _fit_request(
+            lambda text: _item_request(role, item_name, prompt_text, text), raw_text_context, query or item_name, use_cache
+        )
+        key = _cache_key(request)
+        content = response_cache.get(key) if use_cache else None
+        if content is not None:
+            on_delta(content)
+            _record_completion(usage, content, cached=True)
+        else:
+            parts = []
+            for chunk in client.chat.completions.create(**request, stream=True):
+                # Azure sends a leading chunk with no choices (content filter results)
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    parts.append(delta)
+                    on_delta(delta)
+            content = "".join(parts)
+            response_cache.set(key, content)
+            _record_completion(usage, content)
+        return {**_item_result(item_name, prompt_text, content), "token_usage": usage}
+    except Exception as e:
+        logger.exception("[AI] streamed generation failed for %s '%s': %s", role, item_name, e)
+        if raise_errors:
+            raise
+        return _item_failure(item_name, prompt_text)
 
-        try:
-            resp = client.chat.completions.create(
-                model=AZURE_OPENAI_DEPLOYMENT if use_azure else "gpt-4o-mini",
-                messages=[
-                    {"role": "system", "content": system_msg},
-                    {"role": "user", "content": json.dumps({"name": item_name, "prompt": prompt_text, "raw_text": raw_text_context}, ensure_ascii=False)},
-                ],
-                temperature=0.25,
-            )
-            content = resp.choices[0].message.content
-            try:
-                parsed = json.loads(content)
-                if isinstance(parsed, dict) and "content" in parsed:
-                    return {"name": item_name, "content": parsed["content"], "generated_prompt": prompt_text, "prompt_used": prompt_text}
-                return {"name": item_name, "content": content, "generated_prompt": prompt_text, "prompt_used": prompt_text}
-            except Exception:
-                return {"name": item_name, "content": content, "generated_prompt": prompt_text, "prompt_used": prompt_text}
-        except Exception as e:
-            logger.exception("[AI] single-item generation failed for %s '%s': %s", role, item_name, e)
-            return {"name": item_name, "content": f"⚠️ AI generation failed for {item_name}", "generated_prompt": prompt_text, "prompt_used": prompt_text}
 
+def _context_for(item: dict, raw_text: str, extra_query: str = "") -> str:
+    """
+    raw_text to send for one page/section: the document digest when one applies (see
+    app/digest.py) - whole, every item generates from all of it - else raw_text whole
+    if small, else its top-ranked chunks. Only _fit_request trims either further, to
+    the model's context budget.
+    """
+    built = digest.ensure_digest(raw_text)
+    if built:
+        return built["content"]
+    query = " ".join(q for q in (retrieval.item_query(item), extra_query) if q)
+    return retrieval.select_context(raw_text, query)
+
+
+def _page_prompt_for(p: dict) -> str:
     # Pages: prefer latest editable/generated prompt
-    for p in pages_override:
-        prompt_to_use = p.get("editable_prompt") or p.get("generated_prompt") or _build_page_prompt(p)
-        out = _call_ai_for_item("page", p.get("name"), prompt_to_use, raw_text)
-        out.setdefault("sequence", p.get("sequence", 0))
-        out["prompt_last_updated_at"] = datetime.utcnow().isoformat()
-        pages_out.append({**p, **out})
+    return p.get("editable_prompt") or p.get("generated_prompt") or _build_page_prompt(p)
 
+
+def _section_prompt_for(s: dict) -> str:
     # Sections: prefer latest editable/generated prompt
-    for s in sections_override:
-        prompt_to_use = s.get("editable_prompt") or s.get("generated_prompt") or _build_section_prompt(s)
-        out = _call_ai_for_item("section", s.get("name"), prompt_to_use, raw_text)
-        if isinstance(out.get("content"), str):
-    # ✅ Preserve headings, just trim whitespace
-            out["content"] = _strip_leading_heading(out["content"], force=False).strip()
+    return s.get("editable_prompt") or s.get("generated_prompt") or _build_section_prompt(s)
+
+
+def _finish_page_item(p: dict, out: dict) -> dict:
+    out.setdefault("sequence", p.get("sequence", 0))
+    out["prompt_last_updated_at"] = datetime.utcnow().isoformat()
+    return {**p, **out}
 
 
-        out.setdefault("sequence", s.get("sequence", 0))
-        out["prompt_last_updated_at"] = datetime.utcnow().isoformat()
-        sections_out.append({**s, **out})
+def _finish_section_item(s: dict, out: dict) -> dict:
+    if isinstance(out.get("content"), str):
+        # ✅ Preserve headings, just trim whitespace
+        out["content"] = _strip_leading_heading(out["content"], force=False).strip()
+    out.setdefault("sequence", s.get("sequence", 0))
+    out["prompt_last_updated_at"] = datetime.utcnow().isoformat()
+    return {**s, **out}
 
+
+def _generate_page_item(p: dict, raw_text: str, use_cache: bool = True, on_delta=None, raise_errors: bool = False) -> dict:
+    raw_text = _context_for(p, raw_text)
+    query = retrieval.item_query(p)
+    if on_delta:
+        out = _stream_ai_for_item("page", p.get("name"), _page_prompt_for(p), raw_text, on_delta, use_cache, raise_errors, query)
+    else:
+        out = _call_ai_for_item("page", p.get("name"), _page_prompt_for(p), raw_text, use_cache, raise_errors, query)
+    return _finish_page_item(p, out)
+
+
+def _generate_section_item(s: dict, raw_text: str, use_cache: bool = True, on_delta=None, raise_errors: bool = False) -> dict:
+    raw_text = _context_for(s, raw_text)
+    query = retrieval.item_query(s)
+    if on_delta:
+        out = _stream_ai_for_item("section", s.get("name"), _section_prompt_for(s), raw_text, on_delta, use_cache, raise_errors, query)
+    else:
+        out = _call_ai_for_item("section", s.get("name"), _section_prompt_for(s), raw_text, use_cache, raise_errors, query)
+    return _finish_section_item(s, out)
+
+
+def _assemble_document(template, pages_out, sections_out, pages_override, sections_override) -> str:
     doc_obj = {
         "title": template.get("title") if isinstance(template, dict) else "Generated Document",
         "pages": pages_out,
         "sections": sections_out,
     }
-
     return _sanitize_and_fill(json.dumps(doc_obj, ensure_ascii=False), template, pages_override, sections_override)
 
+
+def generate_document_from_template(template: dict, raw_text: str, pages_override: list = None, sections_override: list = None, max_concurrency: int = None, use_cache: bool = True) -> str:
+    """
+    Generate a document by building each page/section with its own LLM call.
+
+    Calls run on a bounded thread pool (`max_concurrency`, default AI_MAX_CONCURRENCY);
+    results are collected back in config order (pages first, then sections).
+    `use_cache=False` bypasses the response cache for this request.
+    """
+    logger.info("[AI] generate_document_from_template called; raw_text length=%d", len(raw_text or ""))
+    pages_override = pages_override or []
+    sections_override = sections_override or []
+
+    jobs = [(_generate_page_item, p) for p in pages_override] + \
+           [(_generate_section_item, s) for s in sections_override]
+    workers = min(max_concurrency or AI_MAX_CONCURRENCY, len(jobs))
+
+    if workers <= 1:
+        results = [fn(item, raw_text, use_cache) for fn, item in jobs]
+    else:
+        # executor.map keeps input order regardless of completion order
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ai-gen") as pool:
+            results = list(pool.map(lambda job: job[0](job[1], raw_text, use_cache), jobs))
+
+    pages_out = results[:len(pages_override)]
+    sections_out = results[len(pages_override):]
+    return _assemble_document(template, pages_out, sections_out, pages_override, sections_override)
+
 # =====================================================
 # REGENERATORS
 # =====================================================
-def regenerate_section(raw_text: str, existing_content: str, user_instruction: str, base_prompt: str) -> str:
+def regenerate_section(raw_text: str, existing_content: str, user_instruction: str, base_prompt: str, use_cache: bool = True) -> str:
     """
     Regenerate a document section based on existing content, raw_text context, and user instruction.
     Always returns valid JSON with a "sections" key.
     """
     if not client:
-        clean = _strip_leading_heading(existing_content or "")
-        return json.dumps({"sections": [{
-            "name": "Regenerated Section",
-            "content": f"{clean} (modified with {user_instruction})",
-            "prompt_used": f"{base_prompt} + {user_instruction}",
-            "generated_prompt": base_prompt,
-        }]}, ensure_ascii=False)
+        return _regenerated_section_offline(existing_content, user_instruction, base_prompt)
 
     try:
-        resp = client.chat.completions.create(
-            model=AZURE_OPENAI_DEPLOYMENT if use_azure else "gpt-4o-mini",
-            messages=[
-                {
-                    "role": "system",
-                    "content": (
-                        "You are an assistant that rewrites document SECTIONS.\n"
-                        "Rewrite ONLY the provided existing_content using raw_text as context.\n"
-                        "Strictly apply the user_instruction.\n"
-                        "Return valid JSON with a top-level key 'sections'.\n"
-                        "Each section must include: name, content, prompt_used, generated_prompt."
-                    )
-                },
-                {
-                    "role": "user",
-                    "content": json.dumps({
-                        "raw_text": raw_text,
-                        "existing_content": existing_content,
-                        "user_instruction": user_instruction,
-                        "base_prompt": base_prompt
-                    }, ensure_ascii=False),
-                },
-            ],
-            temperature=0.3,
+        request, usage = _fit_request(
+            lambda text: _regenerate_request("sections", text, existing_content, user_instruction, base_prompt),
+            raw_text, user_instruction or "", use_cache,
+        )
+        ai_out = _complete(request, user_instruction=user_instruction, use_cache=use_cache, usage=usage).strip()
+        return _with_token_usage(
+            _regenerated_section_result(ai_out, existing_content, user_instruction, base_prompt), "sections", usage
         )
-
-        ai_out = resp.choices[0].message.content.strip()
-        logger.info("[AI][regenerate_section] raw output: %s", ai_out)
-
-        parsed = _safe_json_loads(ai_out)
-        if parsed and "sections" in parsed and parsed["sections"]:
-            # clean content
-            parsed["sections"][0]["content"] = _strip_leading_heading(
-                parsed["sections"][0].get("content", ""), force=False
-            ).strip() or existing_content
-
-
-        # fallback if plain text
-        return json.dumps({"sections": [{
-            "name": "Regenerated Section",
-            "content": _strip_leading_heading(ai_out or existing_content or "⚠️ No content"),
-            "prompt_used": f"{base_prompt} + {user_instruction}",
-            "generated_prompt": base_prompt,
-        }]}, ensure_ascii=False)
 
     except Exception as e:
         logger.exception("[AI] regenerate_section failed: %s", e)
-        return json.dumps({"sections": [{
-            "name": "Regenerated Section",
-            "content": f"{existing_content or '⚠️ AI error'} (modified with {user_instruction})",
-            "prompt_used": f"{base_prompt} + {user_instruction}",
-            "generated_prompt": base_prompt,
-        }]}, ensure_ascii=False)
+        return _regenerated_section_failure(existing_content, user_instruction, base_prompt)
 
 
-def regenerate_page(raw_text: str, existing_content: str, user_instruction: str, base_prompt: str) -> str:
+def regenerate_page(raw_text: str, existing_content: str, user_instruction: str, base_prompt: str, use_cache: bool = True) -> str:
     """
     Regenerate a document page based on existing content, raw_text context, and user instruction.
     Always returns valid JSON with a "pages" key.
     """
     if not client:
-        return json.dumps({"pages": [{
-            "name": "Regenerated Page",
-            "content": f"{existing_content} (modified with {user_instruction})",
-            "prompt_used": f"{base_prompt} + {user_instruction}",
-            "generated_prompt": base_prompt,
-        }]}, ensure_ascii=False)
+        return _regenerated_page_offline(existing_content, user_instruction, base_prompt)
 
     try:
-        resp = client.chat.completions.create(
-            model=AZURE_OPENAI_DEPLOYMENT if use_azure else "gpt-4o-mini",
-            messages=[
-                {
-                    "role": "system",
-                    "content": (
-                        "You are an assistant that rewrites document PAGES.\n"
-                        "Rewrite ONLY the provided existing_content using raw_text as context.\n"
-                        "Strictly apply the user_instruction.\n"
-                        "Return valid JSON with a top-level key 'pages'.\n"
-                        "Each page must include: name, content, prompt_used, generated_prompt."
-                    )
-                },
-                {
-                    "role": "user",
-                    "content": json.dumps({
-                        "raw_text": raw_text,
-                        "existing_content": existing_content,
-                        "user_instruction": user_instruction,
-                        "base_prompt": base_prompt
-                    }, ensure_ascii=False),
-                },
-            ],
-            temperature=0.3,
+        request, usage = _fit_request(
+            lambda text: _regenerate_request("pages", text, existing_content, user_instruction, base_prompt),
+            raw_text, user_instruction or "", use_cache,
+        )
+        ai_out = _complete(request, user_instruction=user_instruction, use_cache=use_cache, usage=usage).strip()
+        return _with_token_usage(
+            _regenerated_page_result(ai_out, existing_content, user_instruction, base_prompt), "pages", usage
         )
-
-        ai_out = resp.choices[0].message.content.strip()
-        logger.info("[AI][regenerate_page] raw output: %s", ai_out)
-
-        parsed = _safe_json_loads(ai_out)
-        if parsed and "pages" in parsed and parsed["pages"]:
-            parsed["pages"][0]["content"] = parsed["pages"][0].get("content", "").strip() or existing_content
-            return json.dumps(parsed, ensure_ascii=False)
-
-        # fallback if plain text
-        return json.dumps({"pages": [{
-            "name": "Regenerated Page",
-            "content": ai_out or existing_content or "⚠️ No content",
-            "prompt_used": f"{base_prompt} + {user_instruction}",
-            "generated_prompt": base_prompt,
-        }]}, ensure_ascii=False)
 
     except Exception as e:
         logger.exception("[AI] regenerate_page failed: %s", e)
-        return json.dumps({"pages": [{
-            "name": "Regenerated Page",
-            "content": f"{existing_content or '⚠️ AI error'} (modified with {user_instruction})",
-            "prompt_used": f"{base_prompt} + {user_instruction}",
-            "generated_prompt": base_prompt,
-        }]}, ensure_ascii=False)
+        return _regenerated_page_failure(existing_content, user_instruction, base_prompt)
@@ -0,0 +1,173 @@
+# backend/app/ai_async.py
+"""
+asyncio counterparts of the generators in app/ai.py.
+
+Prompt building, request payloads and response parsing are shared with
+app/ai.py; only the transport differs (AsyncAzureOpenAI / AsyncOpenAI), so
+`async def` routes can await LLM calls without blocking the event loop.
+"""
+import asyncio
+import logging
+
+from app import ai, digest, retrieval
+from app.ai import (
+    AZURE_OPENAI_API_KEY,
+    AZURE_OPENAI_ENDPOINT,
+    AZURE_OPENAI_DEPLOYMENT,
+    AZURE_API_VERSION,
+    OPENAI_API_KEY,
+)
+
+logger = logging.getLogger(__name__)
+
+# -----------------------
+# Client Initialization
+# -----------------------
+client = None
+try:
+    from openai import AsyncAzureOpenAI, AsyncOpenAI
+
+    if AZURE_OPENAI_API_KEY and AZURE_OPENAI_ENDPOINT and AZURE_OPENAI_DEPLOYMENT:
+        client = AsyncAzureOpenAI(
+            api_key=AZURE_OPENAI_API_KEY,
+            azure_endpoint=AZURE_OPENAI_ENDPOINT,
+            api_version=AZURE_API_VERSION,
+        )
+    elif OPENAI_API_KEY:
+        client = AsyncOpenAI(api_key=OPENAI_API_KEY)
+except Exception as e:
+    logger.warning("[AI][async] Failed to import OpenAI SDK: %s", e)
+
+
+# =====================================================
+# RESPONSE CACHE (shared with app/ai.py)
+# =====================================================
+async def _cache_call(fn, *args):
+    if ai.response_cache.blocking:
+        return await asyncio.to_thread(fn, *args)
+    return fn(*args)
+
+
+async def _complete(request: dict, user_instruction=None, use_cache: bool = True, usage: dict = None) -> str:
+    """Async twin of ai._complete."""
+    key = ai._cache_key(request, user_instruction)
+    if use_cache:
+        cached = await _cache_call(ai.response_cache.get, key)
+        if cached is not None:
+            ai._record_completion(usage, cached, cached=True)
+            return cached
+    resp = await client.chat.completions.create(**request)
+    content = resp.choices[0].message.content
+    await _cache_call(ai.response_cache.set, key, content)
+    ai._record_completion(usage, content, reported=getattr(resp, "usage", None))
+    return content
+
+
+async def _fit_request(build, raw_text: str, query: str = "", use_cache: bool = True):
+    # token counting (and map_reduce compaction) is blocking work
+    return await asyncio.to_thread(ai._fit_request, build, raw_text, query, use_cache)
+
+
+# =====================================================
+# MAIN GENERATION
+# =====================================================
+async def _call_ai_for_item(role, item_name, prompt_text, raw_text_context, use_cache: bool = True, query: str = None):
+    """Async twin of ai._call_ai_for_item. Never raises."""
+    if not client:
+        return ai._item_placeholder(item_name, prompt_text, raw_text_context)
+
+    try:
+        request, usage = await _fit_request(
+            lambda text: ai._item_request(role, item_name, prompt_text, text), raw_text_context, query or item_name, use_cache
+        )
+        content = await _complete(request, use_cache=use_cache, usage=usage)
+        return {**ai._item_result(item_name, prompt_text, content), "token_usage": usage}
+    except Exception as e:
+        logger.exception("[AI][async] single-item generation failed for %s '%s': %s", role, item_name, e)
+        return ai._item_failure(item_name, prompt_text)
+
+
+async def _context_for(item: dict, raw_text: str) -> str:
+    # digest lookup / chunk ranking (possibly building the BM25 index) is blocking work
+    return await asyncio.to_thread(ai._context_for, item, raw_text)
+
+
+async def _generate_page_item(p: dict, raw_text: str, use_cache: bool = True) -> dict:
+    out = await _call_ai_for_item("page", p.get("name"), ai._page_prompt_for(p), await _context_for(p, raw_text), use_cache,
+                                  retrieval.item_query(p))
+    return ai._finish_page_item(p, out)
+
+
+async def _generate_section_item(s: dict, raw_text: str, use_cache: bool = True) -> dict:
+    out = await _call_ai_for_item("section", s.get("name"), ai._section_prompt_for(s), await _context_for(s, raw_text), use_cache,
+                                  retrieval.item_query(s))
+    return ai._finish_section_item(s, out)
+
+
+async def generate_document_from_template(template: dict, raw_text: str, pages_override: list = None, sections_override: list = None, max_concurrency: int = None, use_cache: bool = True) -> str:
+    """
+    Async version of ai.generate_document_from_template.
+    At most `max_concurrency` (default AI_MAX_CONCURRENCY) calls are in flight; output keeps config order.
+    """
+    logger.info("[AI][async] generate_document_from_template called; raw_text length=%d", len(raw_text or ""))
+    pages_override = pages_override or []
+    sections_override = sections_override or []
+
+    # build the digest (if any) once, off the event loop, before the items need it
+    await asyncio.to_thread(digest.ensure_digest, raw_text, None, use_cache)
+    limit = asyncio.Semaphore(max(1, max_concurrency or ai.AI_MAX_CONCURRENCY))
+
+    async def _bounded(coro_fn, item):
+        async with limit:
+            return await coro_fn(item, raw_text, use_cache)
+
+    # gather() returns results in argument order
+    results = await asyncio.gather(
+        *[_bounded(_generate_page_item, p) for p in pages_override],
+        *[_bounded(_generate_section_item, s) for s in sections_override],
+    )
+
+    pages_out = list(results[:len(pages_override)])
+    sections_out = list(results[len(pages_override):])
+    return ai._assemble_document(template, pages_out, sections_out, pages_override, sections_override)
+
+
+# =====================================================
+# REGENERATORS
+# =====================================================
+async def regenerate_section(raw_text: str, existing_content: str, user_instruction: str, base_prompt: str, use_cache: bool = True) -> str:
+    """Async version of ai.regenerate_section. Always returns JSON with a "sections" key."""
+    if not client:
+        return ai._regenerated_section_offline(existing_content, user_instruction, base_prompt)
+
+    try:
+        request, usage = await _fit_request(
+            lambda text: ai._regenerate_request("sections", text, existing_content, user_instruction, base_prompt),
+            raw_text, user_instruction or "", use_cache,
+        )
+        ai_out = (await _complete(request, user_instruction=user_instruction, use_cache=use_cache, usage=usage)).strip()
+        return ai._with_token_usage(
+            ai._regenerated_section_result(ai_out, existing_content, user_instruction, base_prompt), "sections", usage
+        )
+    except Exception as e:
+        logger.exception("[AI][async] regenerate_section failed: %s", e)
+        return ai._regenerated_section_failure(existing_content, user_instruction, base_prompt)
+
+
+async def regenerate_page(raw_text: str, existing_content: str, user_instruction: str, base_prompt: str, use_cache: bool = True) -> str:
+    """Async version of ai.regenerate_page. Always returns JSON with a "pages" key."""
+    if not client:
+        return ai._regenerated_page_offline(existing_content, user_instruction, base_prompt)
+
+    try:
+        request, usage = await _fit_request(
+            lambda text: ai._regenerate_request("pages", text, existing_content, user_instruction, base_prompt),
+            raw_text, user_instruction or "", use_cache,
+        )
+        ai_out = (await _complete(request, user_instruction=user_instruction, use_cache=use_cache, usage=usage)).strip()
+        return ai._with_token_usage(
+            ai._regenerated_page_result(ai_out, existing_content, user_instruction, base_prompt), "pages", usage
+        )
+    except Exception as e:
+        logger.exception("[AI][async] regenerate_page failed: %s", e)
+        return ai._regenerated_page_failure(existing_content, user_instruction, base_prompt)
@@ -7,7 +7,7 @@ import jwt
 from fastapi import HTTPException, Header, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 
-from app.database import find_by_id  # ensure this path matches your project layout
+from app import lookups
 
 # Settings (env fallbacks)
 JWT_SECRET = os.getenv("JWT_SECRET", "dev-secret-change-me")
@@ -73,7 +73,8 @@ def get_current_user(credentials: Optional[HTTPAuthorizationCredentials] = Depen
         _raise_401("Token missing subject (sub/user_id)")
 
     # Load user from DB (assuming find_by_id returns None if not found)
-    user = find_by_id("users", str(user_id))
+    # cached per request and for AUTH_CACHE_TTL_SECONDS (app/lookups.py)
+    user = lookups.get_user(str(user_id))
     if not user:
         _raise_401("User not found for token subject")
 
@@ -0,0 +1,286 @@
+# backend/app/cache.py
+"""
+Small key/value caches with a common interface.
+
+Backends:
+  - MemoryCache: in-process LRU with TTL (per worker)
+  - DiskCache:   one JSON file per key under a directory (shared by workers on one host)
+  - MongoCache:  a collection from app.database.COLLECTIONS (shared by all instances)
+  - NullCache:   caching disabled
+  - TieredCache: several of the above, checked in order (e.g. disk in front of mongo)
+
+Every backend stores JSON-serialisable values, expires entries after `ttl`
+seconds (0 = never) and counts hits/misses.
+
+Local on-disk state (disk caches, the disk source store) defaults to a directory
+under DOCGEN_DATA_DIR - the system temp directory unless set, never the package
+tree, which is read-only (or replaced on every deploy) on zip-deployed hosts.
+Point it at persistent storage (e.g. /home/docgen on Azure App Service) to keep
+that state across restarts.
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Any, Optional
+
+logger = logging.getLogger(__name__)
+
+DOCGEN_DATA_DIR = os.getenv("DOCGEN_DATA_DIR") or os.path.join(tempfile.gettempdir(), "docgen")
+
+
+def data_dir(*parts: str) -> str:
+    """Default location for a piece of local on-disk state, e.g. data_dir("cache", "ai")."""
+    return os.path.join(DOCGEN_DATA_DIR, *parts)
+
+
+def make_key(*parts: Any) -> str:
+    """Content-addressed key: SHA-256 over the JSON encoding of `parts`."""
+    payload = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class BaseCache:
+    """Hit/miss bookkeeping shared by all backends. Subclasses implement _get/_set/_delete."""
+    name = "base"
+    # True when get/set do I/O (async callers should push them to a thread)
+    blocking = False
+
+    def __init__(self, ttl: int = 0):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+
+    def _expiry(self) -> float:
+        return time.time() + self.ttl if self.ttl else 0
+
+    def get(self, key: str) -> Optional[Any]:
+        try:
+            value = self._get(key)
+        except Exception:
+            logger.exception("[cache:%s] get failed for key=%s", self.name, key)
+            value = None
+        with self._stats_lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key: str, value: Any) -> None:
+        if value is None:
+            return
+        try:
+            self._set(key, value)
+        except Exception:
+            logger.exception("[cache:%s] set failed for key=%s", self.name, key)
+
+    def delete(self, key: str) -> None:
+        try:
+            self._delete(key)
+        except Exception:
+            logger.exception("[cache:%s] delete failed for key=%s", self.name, key)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "backend": self.name,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "ttl_seconds": self.ttl,
+        }
+
+    def _get(self, key: str) -> Optional[Any]:
+        raise NotImplementedError
+
+    def _set(self, key: str, value: Any) -> None:
+        raise NotImplementedError
+
+    def _delete(self, key: str) -> None:
+        raise NotImplementedError
+
+
+class NullCache(BaseCache):
+    name = "none"
+
+    def _get(self, key):
+        return None
+
+    def _set(self, key, value):
+        pass
+
+    def _delete(self, key):
+        pass
+
+
+class MemoryCache(BaseCache):
+    """Thread-safe LRU bounded by `max_entries`."""
+    name = "memory"
+
+    def __init__(self, max_entries: int = 1024, ttl: int = 0):
+        super().__init__(ttl)
+        self.max_entries = max(1, max_entries)
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at and expires_at < time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def _set(self, key, value):
+        with self._lock:
+            self._data[key] = (self._expiry(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def _delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        out = super().stats()
+        out.update({"entries": len(self._data), "max_entries": self.max_entries})
+        return out
+
+
+class DiskCache(BaseCache):
+    """One JSON file per key, sharded into sub-directories by key prefix."""
+    name = "disk"
+    blocking = True
+
+    def __init__(self, directory: str, ttl: int = 0):
+        super().__init__(ttl)
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def _get(self, key):
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            entry = json.load(f)
+        if entry.get("expires_at") and entry["expires_at"] < time.time():
+            self._delete(key)
+            return None
+        return entry.get("value")
+
+    def _set(self, key, value):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"expires_at": self._expiry(), "value": value}, f, ensure_ascii=False)
+        os.replace(tmp, path)  # atomic, so readers never see half a file
+
+    def _delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+
+class MongoCache(BaseCache):
+    """Entries live in `COLLECTIONS[collection]` as {id, value, expires_at}."""
+    name = "mongo"
+    blocking = True
+
+    def __init__(self, collection: str, ttl: int = 0):
+        super().__init__(ttl)
+        self.collection = collection
+
+    def _coll(self):
+        # imported lazily: app.database connects to Mongo at import time
+        from app.database import COLLECTIONS
+        return COLLECTIONS[self.collection]
+
+    def _get(self, key):
+        entry = self._coll().find_one({"id": key}, {"_id": 0})
+        if not entry:
+            return None
+        if entry.get("expires_at") and entry["expires_at"] < time.time():
+            self._delete(key)
+            return None
+        return entry.get("value")
+
+    def _set(self, key, value):
+        self._coll().replace_one(
+            {"id": key},
+            {"id": key, "value": value, "expires_at": self._expiry(), "created_at": time.time()},
+            upsert=True,
+        )
+
+    def _delete(self, key):
+        self._coll().delete_one({"id": key})
+
+
+class TieredCache(BaseCache):
+    """Reads try each tier in order and back-fill the faster tiers on a hit; writes go to every tier."""
+    name = "tiered"
+
+    def __init__(self, *tiers: BaseCache):
+        super().__init__(ttl=max((t.ttl for t in tiers), default=0))
+        self.tiers = [t for t in tiers if not isinstance(t, NullCache)]
+        self.blocking = any(t.blocking for t in self.tiers)
+
+    def _get(self, key):
+        for i, tier in enumerate(self.tiers):
+            value = tier.get(key)
+            if value is not None:
+                for faster in self.tiers[:i]:
+                    faster.set(key, value)
+                return value
+        return None
+
+    def _set(self, key, value):
+        for tier in self.tiers:
+            tier.set(key, value)
+
+    def _delete(self, key):
+        for tier in self.tiers:
+            tier.delete(key)
+
+    def stats(self) -> dict:
+        out = super().stats()
+        out["tiers"] = [t.stats() for t in self.tiers]
+        return out
+
+
+def build_cache(backend: str, *, max_entries: int = 1024, ttl: int = 0,
+                directory: Optional[str] = None, collection: Optional[str] = None) -> BaseCache:
+    """Factory used by the modules that read their cache settings from env."""
+    backend = (backend or "memory").strip().lower()
+    try:
+        if backend in ("none", "off", "disabled", "0"):
+            return NullCache()
+        if backend == "disk":
+            return DiskCache(directory, ttl=ttl)
+        if backend == "mongo":
+            return MongoCache(collection, ttl=ttl)
+        if backend != "memory":
+            logger.warning("[cache] Unknown backend '%s'; using memory", backend)
+        return MemoryCache(max_entries=max_entries, ttl=ttl)
+    except Exception:
+        logger.exception("[cache] Failed to build '%s' cache; caching disabled", backend)
+        return NullCache()
@@ -1,8 +1,10 @@
 import os
+import zlib
 import uuid
-from typing import Any, List
-from pymongo import MongoClient, ASCENDING
-from pymongo.errors import DuplicateKeyError
+from datetime import datetime
+from typing import Any, List, Optional
+from pymongo import MongoClient, ASCENDING, DESCENDING, ReturnDocument, ReplaceOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -25,16 +27,294 @@ COLLECTIONS = {
     "companies": _db.get_collection("companies"),
     # New collection for storing per-user configuration
     "user_configs": _db.get_collection("user_configs"),
+    # LLM response cache entries (app/cache.py MongoCache, AI_CACHE_BACKEND=mongo)
+    "ai_cache": _db.get_collection("ai_cache"),
+    # Background generation jobs (app/jobs.py)
+    "jobs": _db.get_collection("jobs"),
+    # Extracted text keyed by file SHA-256 + extractor version (app/ocr.py)
+    "ocr_cache": _db.get_collection("ocr_cache"),
+    # Source text of documents, keyed by its SHA-256 (app/sources.py)
+    "document_sources": _db.get_collection("document_sources"),
+    # Per-version deltas / checkpoints of generated documents (app/revisions.py)
+    "document_revisions": _db.get_collection("document_revisions"),
+    # One-off data migrations already applied (run_migrations)
+    "migrations": _db.get_collection("migrations"),
 }
 
-# Ensure index on 'id' for quick lookups and uniqueness enforcement
-for name, coll in COLLECTIONS.items():
+# -----------------------
+# Index registry
+# -----------------------
+# Secondary indexes per collection, one per query pattern the routes use. Every
+# collection also gets a unique index on "id" (see _index_specs). Names are left
+# to the server defaults (e.g. "user_id_1_created_at_-1_id_-1") and indexes are
+# matched by key pattern, so re-running ensure_indexes() is a no-op.
+INDEXES = {
+    "users": [
+        # login / signup / duplicate checks (see normalize_email)
+        {"keys": [("email_normalized", ASCENDING)], "unique": True, "sparse": True},
+        # company cascade delete, company user listings
+        {"keys": [("company_id", ASCENDING)]},
+        # superadmin seed / role checks
+        {"keys": [("role", ASCENDING)]},
+    ],
+    "documents": [
+        # /my-documents: filter by user, keyset-paginate newest first
+        {"keys": [("user_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)]},
+        # admin access checks by company
+        {"keys": [("company_id", ASCENDING)]},
+        # upload dedupe by content hash
+        {"keys": [("sha256", ASCENDING)]},
+        # sources.release(): is a source text still referenced?
+        {"keys": [("raw_text_ref", ASCENDING)]},
+        # extraction heartbeats and stale-extraction recovery (app/ingest.py)
+        {"keys": [("ocr_status", ASCENDING), ("ocr_heartbeat_at", ASCENDING)]},
+    ],
+    "jobs": [
+        {"keys": [("doc_id", ASCENDING)]},
+        # heartbeats and stale-job recovery (app/jobs.py)
+        {"keys": [("status", ASCENDING), ("heartbeat_at", ASCENDING)]},
+    ],
+    "document_revisions": [
+        # history listing, and checkpoint + deltas lookups when rebuilding a version
+        {"keys": [("doc_id", ASCENDING), ("version", DESCENDING)]},
+    ],
+}
+
+
+def normalize_email(email: Any) -> str:
+    return (email or "").strip().lower() if isinstance(email, str) else ""
+
+
+def _index_specs(name: str) -> List[dict]:
+    return [{"keys": [("id", ASCENDING)], "unique": True}] + INDEXES.get(name, [])
+
+
+# -----------------------
+# One-off data migrations
+# -----------------------
+# Backfills for records written before a field existed. Each one runs until it has
+# completed once; that is recorded in the "migrations" collection and later starts
+# skip it, so request paths can rely on the field being present.
+def _backfill_email_normalized():
+    """Set users.email_normalized where it is missing (records written before it existed)."""
+    coll = COLLECTIONS["users"]
+    for u in coll.find({"email_normalized": {"$exists": False}, "email": {"$exists": True}}, {"_id": 0, "id": 1, "email": 1}):
+        norm = normalize_email(u.get("email"))
+        if not norm:
+            continue
+        try:
+            coll.update_one({"id": u["id"]}, {"$set": {"email_normalized": norm}})
+        except DuplicateKeyError:
+            # another user already has this address; the indexed lookup finds that one
+            print(f"[database] user {u['id']}: email {norm} already taken, not backfilled")
+
+
+def _backfill_document_versions():
+    """Set documents.version = 1 where it is missing, so the first $inc makes it 2 (see version_match)."""
+    COLLECTIONS["documents"].update_many({"version": {"$exists": False}}, {"$set": {"version": 1}})
+
+
+MIGRATIONS = {
+    "users.email_normalized": _backfill_email_normalized,
+    "documents.version": _backfill_document_versions,
+}
+
+
+def run_migrations() -> dict:
+    """Run every migration not yet recorded as done. Returns {name: "done" | "skipped" | error}."""
+    coll = COLLECTIONS["migrations"]
+    results = {}
+    for name, migrate in MIGRATIONS.items():
+        try:
+            if coll.find_one({"id": name}, {"_id": 0, "id": 1}):
+                results[name] = "skipped"
+                continue
+            migrate()
+            coll.replace_one({"id": name}, {"id": name, "done_at": datetime.utcnow().isoformat()}, upsert=True)
+            results[name] = "done"
+        except Exception as e:
+            print(f"[database] migration {name} failed: {e}")
+            results[name] = str(e)
+    return results
+
+
+def ensure_indexes() -> List[dict]:
+    """
+    Create every registered index (idempotent). Unique indexes that cannot be built -
+    Cosmos DB only builds them on empty collections, and existing duplicates block them
+    on MongoDB - fall back to a plain index on the same keys so queries stay indexed.
+    Runs pending migrations first. Returns one {collection, keys, status, error} entry per index.
+    """
+    run_migrations()  # before the unique email_normalized index is built
+
+    results = []
+    for name, coll in COLLECTIONS.items():
+        for spec in _index_specs(name):
+            options = {k: v for k, v in spec.items() if k != "keys"}
+            entry = {"collection": name, "keys": spec["keys"], "status": "ok", "error": None}
+            try:
+                coll.create_index(spec["keys"], **options)
+            except Exception as e:
+                entry.update({"status": "failed", "error": str(e)})
+                if options.get("unique"):
+                    try:
+                        coll.create_index(spec["keys"])
+                        entry["status"] = "degraded"  # indexed, but uniqueness not enforced
+                    except Exception:
+                        pass
+                print(f"[database] index {name}{spec['keys']} {entry['status']}: {e}")
+            results.append(entry)
+    return results
+
+
+def index_report() -> dict:
+    """Registered indexes per collection with their state: ok | missing | not_unique; plus unregistered extras."""
+    report = {}
+    for name, coll in COLLECTIONS.items():
+        try:
+            existing = coll.index_information()
+        except Exception as e:
+            report[name] = {"error": str(e)}
+            continue
+        by_keys = {tuple((k, int(d)) for k, d in info["key"]): info for info in existing.values()}
+        wanted = []
+        for spec in _index_specs(name):
+            keys = tuple((k, int(d)) for k, d in spec["keys"])
+            info = by_keys.pop(keys, None)
+            if info is None:
+                state = "missing"
+            elif spec.get("unique") and not info.get("unique"):
+                state = "not_unique"
+            else:
+                state = "ok"
+            wanted.append({"keys": list(keys), "unique": bool(spec.get("unique")), "state": state})
+        by_keys.pop((("_id", 1),), None)
+        report[name] = {
+            "indexes": wanted,
+            "missing": [w["keys"] for w in wanted if w["state"] != "ok"],
+            "unregistered": [list(k) for k in by_keys],
+        }
+    return report
+
+
+if os.getenv("DB_ENSURE_INDEXES", "true").strip().lower() in ("1", "true", "yes", "on"):
     try:
-        coll.create_index([("id", ASCENDING)], unique=True)
+        ensure_indexes()
     except Exception:
         # ignore index creation errors in restricted environments
         pass
 
+# -----------------------
+# Large-field codec
+# -----------------------
+# Designated string fields above DB_COMPRESS_MIN_BYTES are stored compressed as
+# {"_codec": "zstd"|"zlib", "_data": <binary>}; the helpers below encode them on
+# write and decode them on read, so callers only ever see plain strings. Plain
+# strings (older records, small values) are read as-is, and DB_COMPRESSION=off
+# stops compressing new writes while still reading compressed ones.
+# Paths are dotted; list elements are walked, so "pages.content" is every page's content.
+COMPRESSED_FIELDS = {
+    "documents": ("raw_text", "pages.content", "sections.content"),
+    "document_sources": ("raw_text",),
+    "document_revisions": ("data",),
+}
+DB_COMPRESSION = os.getenv("DB_COMPRESSION", "zstd").strip().lower()
+DB_COMPRESS_MIN_BYTES = int(os.getenv("DB_COMPRESS_MIN_BYTES", "4096"))
+DB_COMPRESS_LEVEL = int(os.getenv("DB_COMPRESS_LEVEL", "3"))
+
+try:
+    import zstandard as _zstd
+except ImportError:  # optional: fall back to zlib
+    _zstd = None
+
+
+def _write_codec() -> Optional[str]:
+    if DB_COMPRESSION in ("off", "none", "false", "0", ""):
+        return None
+    if DB_COMPRESSION == "zstd" and _zstd is not None:
+        return "zstd"
+    return "zlib"
+
+
+def compress_value(value: Any) -> Any:
+    """Encoded form of a designated field value (unchanged if not a large enough string)."""
+    codec = _write_codec()
+    if not codec or not isinstance(value, str):
+        return value
+    raw = value.encode("utf-8")
+    if len(raw) < DB_COMPRESS_MIN_BYTES:
+        return value
+    if codec == "zstd":
+        data = _zstd.ZstdCompressor(level=DB_COMPRESS_LEVEL).compress(raw)
+    else:
+        data = zlib.compress(raw, min(9, max(1, DB_COMPRESS_LEVEL)))
+    return {"_codec": codec, "_data": data}
+
+
+def _decompress(value: dict) -> str:
+    data = bytes(value["_data"])
+    if value["_codec"] == "zstd":
+        if _zstd is None:
+            raise RuntimeError("zstd-compressed field found but the zstandard package is not installed")
+        return _zstd.ZstdDecompressor().decompress(data).decode("utf-8")
+    return zlib.decompress(data).decode("utf-8")
+
+
+def _is_encoded(value: Any) -> bool:
+    return isinstance(value, dict) and "_codec" in value and "_data" in value
+
+
+def decode_fields(value: Any) -> Any:
+    """Decode every compressed field in a record read from Mongo (in place; returns it)."""
+    if isinstance(value, dict):
+        for k, v in value.items():
+            if _is_encoded(v):
+                value[k] = _decompress(v)
+            elif isinstance(v, (dict, list)):
+                decode_fields(v)
+    elif isinstance(value, list):
+        for i, v in enumerate(value):
+            if _is_encoded(v):
+                value[i] = _decompress(v)
+            elif isinstance(v, (dict, list)):
+                decode_fields(v)
+    return value
+
+
+def _encode_at(value: Any, parts: List[str]) -> Any:
+    """Copy of `value` with the field at `parts` compressed (containers on the path are copied, not mutated)."""
+    if not parts:
+        return compress_value(value)
+    if isinstance(value, list):
+        return [_encode_at(v, parts) for v in value]
+    if isinstance(value, dict) and parts[0] in value:
+        return {**value, parts[0]: _encode_at(value[parts[0]], parts[1:])}
+    return value
+
+
+def _field_path(key: str) -> List[str]:
+    # "pages.3.content" / "pages.$.content" -> ["pages", "content"]
+    return [p for p in key.split(".") if not p.isdigit() and not p.startswith("$")]
+
+
+def encode_fields(collection: str, fields: dict) -> dict:
+    """
+    Copy of a record - or of a {dotted.path: value} $set document - with the
+    collection's designated fields compressed.
+    """
+    designated = COMPRESSED_FIELDS.get(collection)
+    if not designated or not _write_codec():
+        return fields
+    out = dict(fields)
+    for key, value in fields.items():
+        path = _field_path(key)
+        for target in designated:
+            target = target.split(".")
+            if target[:len(path)] == path:
+                out[key] = value = _encode_at(value, target[len(path):])
+    return out
+
+
 def _ensure_id(obj: dict) -> str:
     """Ensure object has an 'id' string field and return it."""
     if not obj.get("id"):
@@ -45,36 +325,112 @@ def read_all(collection: str) -> List[dict]:
     """Return all documents in the named collection as a list of dicts."""
     if collection not in COLLECTIONS:
         raise ValueError(f"Unknown collection: {collection}")
-    return list(COLLECTIONS[collection].find({}, {"_id": 0}))
+    return [decode_fields(d) for d in COLLECTIONS[collection].find({}, {"_id": 0})]
 
-def write_all(collection: str, data: List[dict]):
-    """
-    Replace the entire collection with the provided list of dicts.
-    (Used by some code paths for simple JSON-like behavior.)
-    """
+# -----------------------
+# Bulk writes
+# -----------------------
+# Upserts go out as unordered ReplaceOne batches of DB_BULK_BATCH_SIZE; a failed
+# item does not stop the rest of its batch. With transactional=True the batches (and
+# write_all's delete) run in one multi-document transaction where the deployment
+# supports it (replica set / sharded cluster) - there a failed item aborts the whole
+# write with BulkWriteError; elsewhere they run without one and the report says so.
+DB_BULK_BATCH_SIZE = int(os.getenv("DB_BULK_BATCH_SIZE", "500"))
+
+
+def _supports_transactions() -> bool:
+    try:
+        hello = _client.admin.command("hello")
+    except Exception:
+        return False
+    return bool(hello.get("setName")) or hello.get("msg") == "isdbgrid"
+
+
+def _bulk_batches(collection: str, data: List[dict], batch_size: int, session=None) -> List[dict]:
+    coll = COLLECTIONS[collection]
+    results = []
+    for start in range(0, len(data), batch_size):
+        batch = data[start:start + batch_size]
+        ops = [ReplaceOne({"id": item["id"]}, encode_fields(collection, item), upsert=True) for item in batch]
+        entry = {"batch": len(results), "size": len(batch), "matched": 0, "modified": 0, "upserted": 0, "errors": []}
+        try:
+            res = coll.bulk_write(ops, ordered=False, session=session)
+            details = res.bulk_api_result
+        except BulkWriteError as e:
+            if session is not None:
+                raise  # abort the transaction
+            details = e.details
+            entry["errors"] = [
+                {"id": batch[err["index"]]["id"], "code": err.get("code"), "message": err.get("errmsg")}
+                for err in details.get("writeErrors", [])
+            ]
+        entry.update({
+            "matched": details.get("nMatched", 0),
+            "modified": details.get("nModified", 0),
+            "upserted": details.get("nUpserted", 0),
+        })
+        results.append(entry)
+    return results
+
+
+def _bulk_write(collection: str, data: List[dict], batch_size: Optional[int], transactional: bool,
+                prune: bool) -> dict:
     if collection not in COLLECTIONS:
         raise ValueError(f"Unknown collection: {collection}")
-    coll = COLLECTIONS[collection]
-    coll.delete_many({})
-    if not data:
-        return
     for item in data:
         _ensure_id(item)
-    try:
-        coll.insert_many(data)
-    except Exception:
-        coll.delete_many({})
-        for item in data:
-            try:
-                coll.insert_one(item)
-            except DuplicateKeyError:
-                coll.replace_one({"id": item["id"]}, item, upsert=True)
+    size = max(1, batch_size or DB_BULK_BATCH_SIZE)
+
+    def run(session=None) -> dict:
+        report = {"batches": _bulk_batches(collection, data, size, session=session)}
+        if prune:
+            # ids that failed to upsert are in `data` too, so their old records survive
+            res = COLLECTIONS[collection].delete_many({"id": {"$nin": [item["id"] for item in data]}}, session=session)
+            report["deleted"] = res.deleted_count
+        return report
+
+    used_transaction = transactional and _supports_transactions()
+    if used_transaction:
+        with _client.start_session() as session:
+            report = session.with_transaction(run)
+    else:
+        if transactional:
+            print(f"[database] bulk write on {collection} without a transaction: not supported by this deployment")
+        report = run()
+    report["transactional"] = used_transaction
+    report["errors"] = sum(len(b["errors"]) for b in report["batches"])
+    return report
+
+
+def bulk_upsert(collection: str, data: List[dict], batch_size: Optional[int] = None,
+                transactional: bool = False) -> dict:
+    """
+    Insert or replace every object in `data` by 'id' (ids are assigned where missing).
+    Returns {"transactional", "batches": [{batch, size, matched, modified, upserted, errors}],
+    "errors": total failed items}.
+    """
+    return _bulk_write(collection, data, batch_size, transactional, prune=False)
+
+
+def write_all(collection: str, data: List[dict], batch_size: Optional[int] = None,
+              transactional: bool = False) -> dict:
+    """
+    Make the collection hold exactly the provided list of dicts.
+    (Used by some code paths for simple JSON-like behavior.)
+
+    Upserts `data` in bulk batches, then deletes records whose id is not in it, so the
+    collection is never empty part-way through (with transactional=True, both steps
+    commit together). Records whose upsert failed are kept as they were.
+    Returns the bulk_upsert() report plus "deleted".
+    """
+    return _bulk_write(collection, data, batch_size, transactional, prune=True)
+
 
 def find_by_id(collection: str, _id: str) -> Any:
     """Return the document where doc['id'] == _id or None."""
     if collection not in COLLECTIONS:
         raise ValueError(f"Unknown collection: {collection}")
-    return COLLECTIONS[collection].find_one({"id": _id}, {"_id": 0})
+    return decode_fields(COLLECTIONS[collection].find_one({"id": _id}, {"_id": 0}))
 
 def upsert(collection: str, obj: dict) -> dict:
     """
@@ -85,9 +441,68 @@ def upsert(collection: str, obj: dict) -> dict:
         raise ValueError(f"Unknown collection: {collection}")
     coll = COLLECTIONS[collection]
     _ensure_id(obj)
-    coll.replace_one({"id": obj["id"]}, obj, upsert=True)
+    if collection == "users" and obj.get("email"):
+        obj["email_normalized"] = normalize_email(obj["email"])
+    coll.replace_one({"id": obj["id"]}, encode_fields(collection, obj), upsert=True)
     return find_by_id(collection, obj["id"])
 
+def version_match(expected: int) -> dict:
+    """Query clause for optimistic concurrency: the record is still at `expected` version."""
+    if int(expected) == 1:
+        # records written before versioning count as version 1
+        return {"$or": [{"version": 1}, {"version": {"$exists": False}}]}
+    return {"version": int(expected)}
+
+
+def update_fields(collection: str, _id: str, fields: dict, expected_version: Optional[int] = None) -> bool:
+    """
+    $set the given (dotted) field paths on the document with doc['id'] == _id.
+    With `expected_version`, only if the document is still at that version (compare-and-swap).
+    Returns True if a document matched.
+    """
+    if collection not in COLLECTIONS:
+        raise ValueError(f"Unknown collection: {collection}")
+    query = {"id": _id}
+    if expected_version is not None:
+        query.update(version_match(expected_version))
+    res = COLLECTIONS[collection].update_one(query, {"$set": encode_fields(collection, fields)})
+    return res.matched_count > 0
+
+def update_array_item(
+    collection: str,
+    _id: str,
+    array: str,
+    match: dict,
+    fields: dict,
+    extra: Optional[dict] = None,
+    projection: Optional[dict] = None,
+    expected_version: Optional[int] = None,
+) -> Optional[dict]:
+    """
+    Targeted update of one element of an array field, in a single round trip:
+    $set `fields` on the first element of `array` matching `match` (positional `$`),
+    $set the top-level `extra` fields, and $inc `version`.
+
+    Only the changed paths go over the wire - the rest of the document (raw_text
+    and friends) is neither re-sent nor re-read. With `expected_version` the update
+    only applies if the document is still at that version (compare-and-swap).
+    Returns the updated document with `projection` applied, or None if nothing matched.
+    """
+    if collection not in COLLECTIONS:
+        raise ValueError(f"Unknown collection: {collection}")
+    query = {"id": _id, array: {"$elemMatch": match}}
+    if expected_version is not None:
+        query.update(version_match(expected_version))
+    to_set = {f"{array}.$.{k}": v for k, v in fields.items()}
+    to_set.update(extra or {})
+    return decode_fields(COLLECTIONS[collection].find_one_and_update(
+        query,
+        {"$set": encode_fields(collection, to_set), "$inc": {"version": 1}},
+        projection={"_id": 0, **(projection or {})},
+        return_document=ReturnDocument.AFTER,
+    ))
+
+
 def delete_by_id(collection: str, _id: str) -> bool:
     """Delete a document by id. Returns True if a document was deleted."""
     if collection not in COLLECTIONS:
@@ -109,7 +524,7 @@ def _seed_superadmin_if_needed():
         return
 
     users_coll = COLLECTIONS["users"]
-    existing = users_coll.find_one({"email": email})
+    existing = users_coll.find_one({"email_normalized": normalize_email(email)}) or users_coll.find_one({"email": email})
     if existing:
         return
 
@@ -117,6 +532,7 @@ def _seed_superadmin_if_needed():
     user_obj = {
         "id": uid,
         "email": email,
+        "email_normalized": normalize_email(email),
         "password": password,  # WARNING: plain text, for dev only
         "name": "Super Admin",
         "role": "superadmin"
@@ -0,0 +1,120 @@
+# backend/app/digest.py
+"""
+Map-reduce "document digest" for uploads too large for one model call.
+
+raw_text is split into chunks that are summarised in parallel (map); the
+summaries are joined and, while still over AI_DIGEST_TOKENS, summarised
+again (reduce). The digest is a plain dict stored on the Mongo document as
+`raw_text_digest` and keyed by the hash of raw_text, so it is computed once
+per upload and only rebuilt when raw_text changes. Pages and sections then
+generate from the digest instead of the raw text.
+
+AI_DIGEST_MODE:
+  - "auto"   (default): only when raw_text does not fit the deployment's context budget
+  - "always": every non-empty raw_text
+  - "off"    : never
+"""
+import os
+import logging
+import datetime
+import threading
+from typing import Optional
+
+from app import retrieval, tokens
+from app.cache import MemoryCache
+
+logger = logging.getLogger(__name__)
+
+AI_DIGEST_MODE = os.getenv("AI_DIGEST_MODE", "auto").strip().lower()
+# Target size of the digest; it is what every page/section prompt is built from
+AI_DIGEST_TOKENS = int(os.getenv("AI_DIGEST_TOKENS", "12000"))
+
+DIGEST_VERSION = 1
+
+# Recently used digests, keyed by text hash (same pattern as retrieval._index_cache)
+_digest_cache = MemoryCache(max_entries=int(os.getenv("AI_DIGEST_CACHE_SIZE", "16")))
+# One build per text at a time: concurrent items of the same document wait for it
+_build_locks = {}
+_build_locks_guard = threading.Lock()
+
+
+def needs_digest(text: str) -> bool:
+    from app import ai
+
+    if not text or not ai.client or AI_DIGEST_MODE == "off":
+        return False
+    if AI_DIGEST_MODE == "always":
+        return True
+    model = ai._model_name()
+    return tokens.count_tokens(text, model) > tokens.context_budget(model)
+
+
+def digest_matches(digest: Optional[dict], text: str) -> bool:
+    return (
+        bool(digest)
+        and digest.get("version") == DIGEST_VERSION
+        and digest.get("text_hash") == retrieval.text_hash(text)
+    )
+
+
+def remember_digest(digest: Optional[dict]) -> None:
+    """Make a stored digest (e.g. loaded from Mongo) available to ensure_digest."""
+    if digest and digest.get("version") == DIGEST_VERSION and digest.get("text_hash"):
+        _digest_cache.set(digest["text_hash"], digest)
+
+
+def peek(text: str) -> Optional[dict]:
+    """Digest for `text` if one has already been built or remembered; never builds."""
+    if not text:
+        return None
+    return _digest_cache.get(retrieval.text_hash(text))
+
+
+def build_digest(text: str, use_cache: bool = True) -> dict:
+    """Summarise `text` down to AI_DIGEST_TOKENS. Chunk summaries go through the AI response cache."""
+    from app import ai
+
+    model = ai._model_name()
+    started = datetime.datetime.utcnow()
+    content = ai._map_reduce(text, AI_DIGEST_TOKENS, use_cache)
+    logger.info(
+        "[digest] built digest: %d -> %d tokens in %.1fs",
+        tokens.count_tokens(text, model), tokens.count_tokens(content, model),
+        (datetime.datetime.utcnow() - started).total_seconds(),
+    )
+    return {
+        "version": DIGEST_VERSION,
+        "text_hash": retrieval.text_hash(text),
+        "content": content,
+        "source_tokens": tokens.count_tokens(text, model),
+        "tokens": tokens.count_tokens(content, model),
+        "model": model,
+        "created_at": datetime.datetime.utcnow().isoformat(),
+    }
+
+
+def ensure_digest(text: str, stored: Optional[dict] = None, use_cache: bool = True) -> Optional[dict]:
+    """
+    Digest to persist alongside `text`: None when the text is used as-is, the stored
+    digest when it is still current, otherwise a cached or freshly built one.
+    """
+    if not needs_digest(text):
+        return None
+    if digest_matches(stored, text):
+        remember_digest(stored)
+        return stored
+
+    key = retrieval.text_hash(text)
+    with _build_locks_guard:
+        lock = _build_locks.setdefault(key, threading.Lock())
+    try:
+        with lock:
+            digest = _digest_cache.get(key)
+            if digest is None:
+                digest = build_digest(text, use_cache)
+                _digest_cache.set(key, digest)
+            return digest
+    finally:
+        with _build_locks_guard:
+            _build_locks.pop(key, None)
+
@@ -0,0 +1,266 @@
+# backend/app/generation.py
+"""
+Incremental document generation.
+
+The document record is created up-front with every configured page/section
+marked `generation_status: "pending"`. Each item is written back to its
+array slot the moment its LLM call returns, so a client that streams the
+result (or reconnects after an interruption) can see partial output and
+resume only the items that are still missing.
+"""
+import os
+import json
+import uuid
+import logging
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Tuple
+
+from pymongo import ReturnDocument
+
+from app import ai, digest, retrieval, revisions, sources
+from app.database import COLLECTIONS, decode_fields, encode_fields, find_by_id, update_fields, version_match
+
+logger = logging.getLogger(__name__)
+
+DOC_WRITE_RETRIES = int(os.getenv("DOC_WRITE_RETRIES", "3"))
+
+ITEM_PENDING = "pending"
+ITEM_DONE = "done"
+ITEM_FAILED = "failed"
+ITEM_CANCELLED = "cancelled"     # its background job was cancelled before it started
+
+DOC_IN_PROGRESS = "in_progress"
+DOC_COMPLETED = "completed"
+DOC_COMPLETED_WITH_ERRORS = "completed_with_errors"
+DOC_CANCELLED = "cancelled"
+
+# Keys produced by a generation run; everything else on an item is its configuration
+_OUTPUT_KEYS = {"content", "generation_status", "last_generated_at", "generation_error", "token_usage"}
+
+
+def _now() -> str:
+    return datetime.datetime.utcnow().isoformat()
+
+
+def new_document(user: dict, raw_text: str, pages_override: list, sections_override: list,
+                 title: Optional[str] = None) -> dict:
+    """Build a documents record whose pages/sections are all still pending."""
+    now = _now()
+    return {
+        "id": str(uuid.uuid4()),
+        "title": title or "Untitled Document",
+        "raw_text": raw_text,
+        "raw_text_index": retrieval.ensure_index(raw_text),
+        "raw_text_digest": digest.peek(raw_text),
+        "pages": [{**p, "content": None, "generation_status": ITEM_PENDING} for p in pages_override],
+        "sections": [{**s, "content": None, "generation_status": ITEM_PENDING} for s in sections_override],
+        "generation_status": DOC_IN_PROGRESS,
+        "created_at": now,
+        "updated_at": now,
+        "version": 1,
+        "user_id": user.get("id"),
+        "company_id": user.get("company_id"),
+        "company_name": user.get("company_name"),
+    }
+
+
+def item_config(item: dict) -> dict:
+    """Strip generated output from a stored page/section, leaving the config used to (re)generate it."""
+    return {k: v for k, v in item.items() if k not in _OUTPUT_KEYS}
+
+
+def pending_items(doc: dict) -> List[Tuple[str, int, dict]]:
+    """(kind, index, config) for every page/section not done yet (pending, failed or cancelled)."""
+    out = []
+    for kind in ("page", "section"):
+        for i, item in enumerate(doc.get(f"{kind}s") or []):
+            if item.get("generation_status", ITEM_DONE) != ITEM_DONE:
+                out.append((kind, i, item_config(item)))
+    return out
+
+
+class ItemConflict(Exception):
+    """The item was changed by someone else while it was being regenerated."""
+
+
+class VersionedItemWriter:
+    """
+    Persists the items of a regeneration that runs while the document stays editable
+    (background regenerate-document jobs). Each item is a compare-and-swap on `version`
+    that bumps it and is recorded as a revision, like a page/section save. When someone
+    else wrote in between, the write is rebased on their version unless they changed that
+    same item (or revisions cannot tell): then it is refused with ItemConflict, as is any
+    later write of an item they changed. Writes are serialized so the job's own items
+    never conflict with each other.
+    """
+
+    _PROJECTION = {"_id": 0, **{f: 0 for f in sources.TEXT_FIELDS}}
+
+    def __init__(self, doc_id: str, version: int, action: str, user_id: Optional[str] = None):
+        self.doc_id = doc_id
+        self.version = version
+        self.action = action
+        self.user_id = user_id
+        self._changed_by_others = set()
+        self._lock = threading.Lock()
+
+    def persist(self, kind: str, index: int, item: dict):
+        name = item.get("name")
+        conflict = ItemConflict(f"{kind.capitalize()} {name!r} was changed by someone else")
+        with self._lock:
+            for _ in range(DOC_WRITE_RETRIES + 1):
+                if (kind, name) in self._changed_by_others:
+                    raise conflict
+                query = {"id": self.doc_id, f"{kind}s.{index}.name": name, **version_match(self.version)}
+                updated = COLLECTIONS["documents"].find_one_and_update(
+                    query,
+                    {"$set": encode_fields("documents", {f"{kind}s.{index}": item, "updated_at": _now()}),
+                     "$inc": {"version": 1}},
+                    projection=self._PROJECTION,
+                    return_document=ReturnDocument.AFTER,
+                )
+                if updated is not None:
+                    updated = decode_fields(updated)
+                    self.version = updated.get("version") or self.version + 1
+                    revisions.record_change(updated, [(kind, name)], self.action, self.user_id)
+                    return
+                current = COLLECTIONS["documents"].find_one(
+                    {"id": self.doc_id}, {"_id": 0, "version": 1, f"{kind}s.name": 1}
+                )
+                items = (current or {}).get(f"{kind}s") or []
+                if index >= len(items) or items[index].get("name") != name:
+                    raise ItemConflict(f"{kind.capitalize()} {name!r} no longer exists")
+                current_version = current.get("version") or 1
+                changed = None
+                if current_version >= self.version:
+                    changed = revisions.changes_since(self.doc_id, self.version, current_version)
+                if changed is None:
+                    raise conflict
+                self._changed_by_others |= changed
+                self.version = current_version
+            raise ItemConflict(f"{kind.capitalize()} {name!r}: the document kept changing")
+
+
+def generate_item(doc_id: str, raw_text: str, kind: str, index: int, config: dict,
+                  use_cache: bool = True, on_delta: Optional[Callable[[str], None]] = None,
+                  raise_errors: bool = False, writer: Optional[VersionedItemWriter] = None) -> dict:
+    """
+    Generate one page/section and persist it into its slot on the document
+    (through `writer` when given, else in place without touching `version`).
+    With raise_errors=True a failed LLM call is stored as a "failed" item (same
+    placeholder content as a synchronous run) and the exception is re-raised.
+    """
+    fn = ai._generate_page_item if kind == "page" else ai._generate_section_item
+    try:
+        item = fn(config, raw_text, use_cache, on_delta, raise_errors)
+        item["generation_status"] = ITEM_DONE
+    except Exception as e:
+        if not raise_errors:
+            raise
+        prompt = ai._page_prompt_for(config) if kind == "page" else ai._section_prompt_for(config)
+        item = {**config, **ai._item_failure(config.get("name"), prompt),
+                "generation_status": ITEM_FAILED, "generation_error": str(e)}
+        _persist_item(doc_id, kind, index, item, writer)
+        raise
+    _persist_item(doc_id, kind, index, item, writer)
+    return item
+
+
+def _persist_item(doc_id: str, kind: str, index: int, item: dict, writer: Optional[VersionedItemWriter] = None):
+    item["last_generated_at"] = _now()
+    if writer is not None:
+        writer.persist(kind, index, item)
+        return
+    update_fields("documents", doc_id, {f"{kind}s.{index}": item, "updated_at": _now()})
+
+
+def cancel_item(doc_id: str, kind: str, index: int):
+    """Mark a page/section that never started as cancelled (a no-op once it has output)."""
+    COLLECTIONS["documents"].update_one(
+        {"id": doc_id, f"{kind}s.{index}.generation_status": ITEM_PENDING},
+        {"$set": {f"{kind}s.{index}.generation_status": ITEM_CANCELLED, "updated_at": _now()}},
+    )
+
+
+def submit_items(pool: ThreadPoolExecutor, doc_id: str, raw_text: str, items: List[Tuple[str, int, dict]],
+                 use_cache: bool = True, emit: Optional[Callable[[dict], None]] = None) -> list:
+    """
+    Queue generate_item for each (kind, index, config) on `pool`.
+    `emit` (called from worker threads) receives "delta" events while tokens stream
+    and then exactly one "item" (persisted) or "error" event per item. Returns the futures.
+    """
+    def _deltas(kind, index, config):
+        def on_delta(text):
+            emit({"event": "delta", "kind": kind, "index": index, "name": config.get("name"), "text": text})
+        return on_delta
+
+    def _run(kind, index, config):
+        on_delta = _deltas(kind, index, config) if emit else None
+        try:
+            item = generate_item(doc_id, raw_text, kind, index, config, use_cache, on_delta)
+        except Exception as e:
+            logger.exception("[generation] %s %d of document %s failed", kind, index, doc_id)
+            if emit:
+                emit({"event": "error", "kind": kind, "index": index, "name": config.get("name"), "detail": str(e)})
+            raise
+        if emit:
+            emit({"event": "item", "kind": kind, "index": index, "item": item})
+        return item
+
+    return [pool.submit(_run, kind, index, config) for kind, index, config in items]
+
+
+def finalize_document(doc_id: str, action: str = "generate", user_id: Optional[str] = None,
+                      writer: Optional[VersionedItemWriter] = None) -> Optional[dict]:
+    """
+    Run the usual sanitize/fill pass over the persisted items and mark the document completed
+    (completed_with_errors when some items failed, cancelled when its job was cancelled
+    before some items started). While any item is still pending the document is returned
+    unchanged so the remaining items can be resumed later.
+    The pass is a compare-and-swap on `version` (bumped, and checkpointed as `action`), so
+    an edit saved meanwhile is never replaced by the pre-edit arrays. When it lands right
+    after `writer`'s last write, `writer` moves on to the new version.
+    """
+    for _ in range(DOC_WRITE_RETRIES + 1):
+        doc = find_by_id("documents", doc_id)
+        if not doc:
+            return None
+
+        pages = doc.get("pages") or []
+        sections = doc.get("sections") or []
+        statuses = [item.get("generation_status", ITEM_DONE) for item in pages + sections]
+        if ITEM_PENDING in statuses:
+            return doc
+
+        try:
+            filled = json.loads(ai._assemble_document(
+                {}, pages, sections, [item_config(p) for p in pages], [item_config(s) for s in sections]
+            ))
+        except Exception:
+            logger.exception("[generation] Failed to sanitize document %s", doc_id)
+            filled = {"pages": pages, "sections": sections}
+
+        if ITEM_CANCELLED in statuses:
+            status = DOC_CANCELLED
+        elif ITEM_FAILED in statuses:
+            status = DOC_COMPLETED_WITH_ERRORS
+        else:
+            status = DOC_COMPLETED
+        version = doc.get("version") or 1
+        fields = {
+            "pages": filled.get("pages", pages),
+            "sections": filled.get("sections", sections),
+            "generation_status": status,
+            "version": version + 1,
+            "updated_at": _now(),
+        }
+        if update_fields("documents", doc_id, fields, expected_version=version):
+            doc.update(fields)
+            revisions.checkpoint(doc, action, user_id)
+            if writer is not None and writer.version == version:
+                writer.version = version + 1
+            return doc
+    logger.warning("[generation] Document %s kept changing; left it unfinalized", doc_id)
+    return find_by_id("documents", doc_id)
@@ -0,0 +1,229 @@
+# backend/app/ingest.py
+"""
+Text extraction for uploaded files, off the request path.
+
+Upload stores the file and a `documents` record with `ocr_status: "pending"`
+and returns at once; extraction (app/ocr.py) runs on a local worker pool and
+fills in raw_text (kept in app/sources.py, referenced by raw_text_ref) and
+`ocr_status: "completed"` (or "failed" + `ocr_error`).
+A file whose hash is already in the OCR cache completes inline.
+
+Like background jobs (app/jobs.py), a pending document is owned by the process
+extracting it (`ocr_worker`), which refreshes `ocr_heartbeat_at` while it works;
+one whose heartbeat is older than OCR_STALE_SECONDS (the process was restarted)
+is claimed and extracted again by the next process that notices - or marked
+failed once it has been abandoned OCR_MAX_RECOVERIES times (a file that keeps
+killing its worker would otherwise stay pending forever).
+
+  OCR_ASYNC               "true" (default) | "false" to extract inside the upload request
+  OCR_BACKGROUND_WORKERS  concurrent extractions per process
+  OCR_WAIT_SECONDS        how long /generate waits for a pending document before a 409
+  OCR_HEARTBEAT_SECONDS / OCR_STALE_SECONDS   ownership refresh / takeover age
+  OCR_MAX_RECOVERIES      takeovers before a pending document is marked failed
+"""
+import os
+import time
+import logging
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from app import ocr, retrieval, sources
+from app.jobs import WORKER_ID
+
+logger = logging.getLogger(__name__)
+
+OCR_ASYNC = os.getenv("OCR_ASYNC", "true").strip().lower() in ("1", "true", "yes", "on")
+OCR_BACKGROUND_WORKERS = int(os.getenv("OCR_BACKGROUND_WORKERS", "2"))
+OCR_WAIT_SECONDS = float(os.getenv("OCR_WAIT_SECONDS", "20"))
+OCR_HEARTBEAT_SECONDS = float(os.getenv("OCR_HEARTBEAT_SECONDS", "30"))
+OCR_STALE_SECONDS = float(os.getenv("OCR_STALE_SECONDS", "120"))
+OCR_MAX_RECOVERIES = int(os.getenv("OCR_MAX_RECOVERIES", "2"))
+
+OCR_PENDING = "pending"
+OCR_COMPLETED = "completed"
+OCR_FAILED = "failed"
+
+_pool = None
+_pool_lock = threading.Lock()
+_monitor = None
+_monitor_lock = threading.Lock()
+
+
+def _now() -> str:
+    return datetime.datetime.utcnow().isoformat()
+
+
+def _get_pool() -> ThreadPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=max(1, OCR_BACKGROUND_WORKERS), thread_name_prefix="ocr")
+        return _pool
+
+
+def ocr_status(doc: dict) -> str:
+    # records created before background OCR have no status: their text is final
+    return doc.get("ocr_status") or OCR_COMPLETED
+
+
+def pending_fields() -> dict:
+    """Fields for a freshly uploaded document whose text is not extracted yet (owned by this process)."""
+    start_monitor()
+    return {
+        "raw_text_ref": None,
+        "raw_text_chars": 0,
+        "raw_text_pages": [],
+        "extraction": None,
+        "ocr_status": OCR_PENDING,
+        "ocr_error": None,
+        "ocr_finished_at": None,
+        "ocr_worker": WORKER_ID,
+        "ocr_heartbeat_at": _now(),
+    }
+
+
+def _completed_fields(extracted: dict) -> dict:
+    text = extracted.get("text") or ""
+    fields = {
+        "raw_text": text,
+        # [{"page", "start", "end"}] character offsets of each source page in raw_text
+        "raw_text_pages": extracted.get("pages") or [],
+        # which extractor produced raw_text ({"format", "extractor", "ocr_pages", "duration_ms", ...})
+        "extraction": extracted.get("extraction"),
+        # chunked BM25 index, so generation can send each item only the relevant text
+        "raw_text_index": retrieval.ensure_index(text),
+        "ocr_status": OCR_COMPLETED,
+        "ocr_error": None,
+        "ocr_finished_at": _now(),
+        "updated_at": _now(),
+    }
+    if not text:
+        fields.update({"ocr_status": OCR_FAILED, "ocr_error": "No text could be extracted from the file."})
+    return fields
+
+
+def run(doc_id: str, path: str, sha256: Optional[str] = None) -> dict:
+    """Extract the file's text and store it on the document. Returns the fields written."""
+    from app.database import update_fields
+
+    try:
+        fields = _completed_fields(ocr.extract_document_cached(path, sha256=sha256))
+    except Exception as e:
+        logger.exception("[ingest] extraction failed for document %s (%s)", doc_id, path)
+        fields = {"ocr_status": OCR_FAILED, "ocr_error": str(e), "ocr_finished_at": _now(), "updated_at": _now()}
+    update_fields("documents", doc_id, sources.externalize(fields))
+    return fields
+
+
+def start(doc_id: str, path: str, sha256: Optional[str] = None) -> dict:
+    """
+    Begin extraction for an uploaded document (already stored with pending_fields()).
+    Returns the fields known now: the final ones on a cache hit or with OCR_ASYNC off,
+    otherwise just the pending status.
+    """
+    from app.database import update_fields
+
+    cached = ocr.lookup_cached(sha256) if sha256 else None
+    if cached is not None:
+        fields = _completed_fields(cached)
+        update_fields("documents", doc_id, sources.externalize(fields))
+        return fields
+    if not OCR_ASYNC:
+        return run(doc_id, path, sha256)
+
+    _get_pool().submit(run, doc_id, path, sha256)
+    return {"ocr_status": OCR_PENDING}
+
+
+def status(doc: dict) -> dict:
+    """Lightweight view for polling clients."""
+    return {
+        "id": doc.get("id"),
+        "ocr_status": ocr_status(doc),
+        "ocr_error": doc.get("ocr_error"),
+        "ocr_finished_at": doc.get("ocr_finished_at"),
+        "extraction": doc.get("extraction"),
+    }
+
+
+def wait_for(doc_id: str, timeout: float = None) -> Optional[dict]:
+    """Poll the document until it is no longer pending or `timeout` seconds pass; returns the latest record."""
+    from app.database import find_by_id
+
+    deadline = time.monotonic() + (OCR_WAIT_SECONDS if timeout is None else timeout)
+    doc = find_by_id("documents", doc_id)
+    while doc and ocr_status(doc) == OCR_PENDING and time.monotonic() < deadline:
+        time.sleep(0.5)
+        doc = find_by_id("documents", doc_id)
+    return doc
+
+
+# -----------------------
+# Recovery
+# -----------------------
+def resume_stale() -> list:
+    """
+    Claim the pending documents whose extracting process stopped heartbeating and
+    extract them again here; past OCR_MAX_RECOVERIES mark them failed instead.
+    Returns the ids claimed.
+    """
+    from app.database import COLLECTIONS
+
+    coll = COLLECTIONS["documents"]
+    cutoff = (datetime.datetime.utcnow() - datetime.timedelta(seconds=OCR_STALE_SECONDS)).isoformat()
+    stale = coll.find(
+        {"ocr_status": OCR_PENDING,
+         "$or": [{"ocr_heartbeat_at": {"$lt": cutoff}},
+                 {"ocr_heartbeat_at": {"$exists": False}, "created_at": {"$lt": cutoff}}]},
+        {"_id": 0, "id": 1, "path": 1, "sha256": 1, "ocr_worker": 1, "ocr_heartbeat_at": 1, "ocr_recoveries": 1},
+    )
+    claimed = []
+    for doc in stale:
+        recoveries = doc.get("ocr_recoveries", 0) + 1
+        fields = {"ocr_worker": WORKER_ID, "ocr_heartbeat_at": _now()}
+        if recoveries > OCR_MAX_RECOVERIES:
+            fields.update({
+                "ocr_status": OCR_FAILED,
+                "ocr_error": f"Extraction abandoned by worker {doc.get('ocr_worker')} {recoveries - 1} times",
+                "ocr_finished_at": _now(),
+                "updated_at": _now(),
+            })
+        res = coll.update_one(
+            {"id": doc["id"], "ocr_status": OCR_PENDING, "ocr_heartbeat_at": doc.get("ocr_heartbeat_at")},
+            {"$set": fields, "$inc": {"ocr_recoveries": 1}},
+        )
+        if not res.matched_count:
+            continue  # another process got there first
+        claimed.append(doc["id"])
+        if fields.get("ocr_status") == OCR_FAILED:
+            logger.warning("[ingest] Gave up on extracting document %s after %d recoveries", doc["id"], recoveries - 1)
+            continue
+        logger.warning("[ingest] Resuming extraction of document %s abandoned by worker %s", doc["id"], doc.get("ocr_worker"))
+        _get_pool().submit(run, doc["id"], doc.get("path"), doc.get("sha256"))
+    return claimed
+
+
+def _monitor_loop():
+    from app.database import COLLECTIONS
+
+    while True:
+        try:
+            COLLECTIONS["documents"].update_many(
+                {"ocr_worker": WORKER_ID, "ocr_status": OCR_PENDING},
+                {"$set": {"ocr_heartbeat_at": _now()}},
+            )
+            resume_stale()
+        except Exception:
+            logger.exception("[ingest] Heartbeat / recovery pass failed")
+        time.sleep(OCR_HEARTBEAT_SECONDS)
+
+
+def start_monitor():
+    """Start this process's heartbeat / stale-extraction recovery thread (idempotent; called at startup)."""
+    global _monitor
+    with _monitor_lock:
+        if _monitor is None:
+            _monitor = threading.Thread(target=_monitor_loop, name="docgen-ocr-monitor", daemon=True)
+            _monitor.start()
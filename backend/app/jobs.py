@@ -0,0 +1,414 @@
+# backend/app/jobs.py
+"""
+Background generation jobs.
+
+A job runs the pages/sections of one document on a local worker pool and
+records per-item progress in a job store, so long generations no longer
+depend on an HTTP request staying open.
+
+Stores (JOB_QUEUE_BACKEND):
+  - "mongo"  (default): the `jobs` collection, visible to every worker process
+  - "memory": an in-process dict, for tests and single-process dev servers
+
+Jobs only run in the process that queued them. Each process stamps `heartbeat_at`
+on the queued/running jobs it owns every JOB_HEARTBEAT_SECONDS; a job whose
+heartbeat is older than JOB_STALE_SECONDS (its process was restarted or redeployed)
+is claimed by whichever process notices first - at startup or on its next
+heartbeat - and re-queued there, or marked failed after JOB_MAX_RECOVERIES.
+"""
+import os
+import copy
+import time
+import uuid
+import socket
+import logging
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from app import ai, digest, generation, retrieval, sources
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUE_BACKEND = os.getenv("JOB_QUEUE_BACKEND", "mongo").strip().lower()
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_HEARTBEAT_SECONDS = float(os.getenv("JOB_HEARTBEAT_SECONDS", "30"))
+JOB_STALE_SECONDS = float(os.getenv("JOB_STALE_SECONDS", "120"))
+JOB_MAX_RECOVERIES = int(os.getenv("JOB_MAX_RECOVERIES", "2"))
+
+# Owner stamp for the jobs this process runs
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"            # finished, but at least one item failed (retryable)
+JOB_CANCELLED = "cancelled"
+
+ITEM_PENDING = "pending"
+ITEM_RUNNING = "running"
+ITEM_DONE = "done"
+ITEM_FAILED = "failed"
+ITEM_CANCELLED = "cancelled"
+
+
+def _now() -> str:
+    return datetime.datetime.utcnow().isoformat()
+
+
+def _ago(seconds: float) -> str:
+    return (datetime.datetime.utcnow() - datetime.timedelta(seconds=seconds)).isoformat()
+
+
+# -----------------------
+# Job stores
+# -----------------------
+class MongoJobStore:
+    def _coll(self):
+        from app.database import COLLECTIONS
+        return COLLECTIONS["jobs"]
+
+    def create(self, job: dict):
+        self._coll().insert_one(dict(job))
+
+    def get(self, job_id: str) -> Optional[dict]:
+        return self._coll().find_one({"id": job_id}, {"_id": 0})
+
+    def update(self, job_id: str, fields: dict):
+        self._coll().update_one({"id": job_id}, {"$set": fields})
+
+    def inc(self, job_id: str, fields: dict):
+        self._coll().update_one({"id": job_id}, {"$inc": fields})
+
+    def heartbeat(self, worker: str, now: str):
+        self._coll().update_many(
+            {"worker": worker, "status": {"$in": [JOB_QUEUED, JOB_RUNNING]}},
+            {"$set": {"heartbeat_at": now}},
+        )
+
+    def stale(self, cutoff: str) -> list:
+        return list(self._coll().find(
+            {"status": {"$in": [JOB_QUEUED, JOB_RUNNING]},
+             "$or": [{"heartbeat_at": {"$lt": cutoff}}, {"heartbeat_at": {"$exists": False}, "updated_at": {"$lt": cutoff}}]},
+            {"_id": 0},
+        ))
+
+    def claim(self, job: dict, fields: dict) -> bool:
+        """Apply `fields` only if nobody changed the job's status/heartbeat since it was read."""
+        query = {"id": job["id"], "status": job["status"], "heartbeat_at": job.get("heartbeat_at")}
+        return self._coll().update_one(query, {"$set": fields}).matched_count > 0
+
+
+class MemoryJobStore:
+    def __init__(self):
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _walk(doc: dict, path: str):
+        parts = path.split(".")
+        for part in parts[:-1]:
+            doc = doc[int(part)] if isinstance(doc, list) else doc.setdefault(part, {})
+        return doc, parts[-1]
+
+    def create(self, job: dict):
+        with self._lock:
+            self._jobs[job["id"]] = copy.deepcopy(job)
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return copy.deepcopy(job) if job else None
+
+    def update(self, job_id: str, fields: dict):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            for path, value in fields.items():
+                target, key = self._walk(job, path)
+                if isinstance(target, list):
+                    target[int(key)] = value
+                else:
+                    target[key] = value
+
+    def inc(self, job_id: str, fields: dict):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            for path, amount in fields.items():
+                target, key = self._walk(job, path)
+                target[key] = target.get(key, 0) + amount
+
+    # jobs never outlive the process that holds this store, so there is nothing to recover
+    def heartbeat(self, worker: str, now: str):
+        pass
+
+    def stale(self, cutoff: str) -> list:
+        return []
+
+    def claim(self, job: dict, fields: dict) -> bool:
+        return False
+
+
+store = MemoryJobStore() if JOB_QUEUE_BACKEND == "memory" else MongoJobStore()
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+_monitor = None
+_monitor_lock = threading.Lock()
+
+
+def _get_pool() -> ThreadPoolExecutor:
+    global _pool
+    # jobs queued here must be heartbeated, or another process would take them over
+    start_monitor()
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=max(1, JOB_WORKERS), thread_name_prefix="docgen-job")
+        return _pool
+
+
+def _owner_fields() -> dict:
+    return {"worker": WORKER_ID, "heartbeat_at": _now()}
+
+
+# -----------------------
+# Public API
+# -----------------------
+def enqueue(job_type: str, doc_id: str, user_id: str, items: list, use_cache: bool = True,
+            base_version: Optional[int] = None) -> dict:
+    """
+    Create a job for the given (kind, index, config) items of `doc_id` and queue it.
+    With `base_version` (the document version the caller checked), items are written
+    as versioned edits on top of it (generation.VersionedItemWriter), so saves made
+    while the job runs are kept. Returns the stored job record.
+    """
+    now = _now()
+    job = {
+        "id": str(uuid.uuid4()),
+        "type": job_type,
+        "doc_id": doc_id,
+        "user_id": user_id,
+        "status": JOB_QUEUED,
+        "use_cache": use_cache,
+        "base_version": base_version,
+        "cancel_requested": False,
+        "items": [
+            {"kind": kind, "index": index, "name": config.get("name"), "config": config,
+             "status": ITEM_PENDING, "error": None, "attempts": 0}
+            for kind, index, config in items
+        ],
+        "progress": {"total": len(items), "done": 0, "failed": 0},
+        "created_at": now,
+        "updated_at": now,
+        "started_at": None,
+        "finished_at": None,
+        **_owner_fields(),
+    }
+    store.create(job)
+    _get_pool().submit(_run_job, job["id"])
+    return public_view(job)
+
+
+def get_job(job_id: str) -> Optional[dict]:
+    return store.get(job_id)
+
+
+def public_view(job: dict) -> dict:
+    """Job record without the per-item configs (prompts can be large)."""
+    out = {k: v for k, v in job.items() if k != "items"}
+    out["items"] = [{k: v for k, v in item.items() if k != "config"} for item in job.get("items", [])]
+    return out
+
+
+def cancel(job_id: str) -> Optional[dict]:
+    """
+    Ask a job to stop. Items already running finish; items not yet started are cancelled.
+    A generate job's document marks those items cancelled too and finishes with
+    generation_status "cancelled" (they can be resumed like failed ones).
+    """
+    job = store.get(job_id)
+    if not job:
+        return None
+    if job["status"] in (JOB_QUEUED, JOB_RUNNING):
+        store.update(job_id, {"cancel_requested": True, "updated_at": _now()})
+    return store.get(job_id)
+
+
+def retry_failed(job_id: str) -> Optional[dict]:
+    """Re-queue only the items that failed; finished items are left untouched."""
+    job = store.get(job_id)
+    if not job:
+        return None
+    if job["status"] in (JOB_QUEUED, JOB_RUNNING):
+        raise ValueError("Job is still running")
+
+    failed = [i for i, item in enumerate(job["items"]) if item["status"] == ITEM_FAILED]
+    if not failed:
+        raise ValueError("Job has no failed items to retry")
+
+    fields = {f"items.{i}.status": ITEM_PENDING for i in failed}
+    fields.update({f"items.{i}.error": None for i in failed})
+    fields.update({
+        "status": JOB_QUEUED,
+        "cancel_requested": False,
+        "progress.failed": job["progress"]["failed"] - len(failed),
+        "finished_at": None,
+        "updated_at": _now(),
+        **_owner_fields(),
+    })
+    store.update(job_id, fields)
+    _get_pool().submit(_run_job, job_id)
+    return store.get(job_id)
+
+
+# -----------------------
+# Recovery
+# -----------------------
+def recover_stale() -> list:
+    """
+    Re-queue (here) the jobs whose owning process stopped heartbeating: items it left
+    running go back to pending. Past JOB_MAX_RECOVERIES the job is marked failed
+    instead, with those items failed, so retry_failed() can pick it up.
+    Returns the ids of the jobs this process claimed.
+    """
+    claimed = []
+    for job in store.stale(_ago(JOB_STALE_SECONDS)):
+        running = [i for i, item in enumerate(job.get("items", [])) if item["status"] == ITEM_RUNNING]
+        recoveries = job.get("recoveries", 0) + 1
+        fields = {"recoveries": recoveries, "updated_at": _now(), **_owner_fields()}
+        if recoveries > JOB_MAX_RECOVERIES:
+            error = f"Worker {job.get('worker')} stopped while running this item"
+            fields.update({f"items.{i}.status": ITEM_FAILED for i in running})
+            fields.update({f"items.{i}.error": error for i in running})
+            fields.update({
+                "status": JOB_FAILED,
+                "error": f"Job abandoned by worker {job.get('worker')} {recoveries - 1} times",
+                "progress.failed": job["progress"]["failed"] + len(running),
+                "finished_at": _now(),
+            })
+        else:
+            fields.update({f"items.{i}.status": ITEM_PENDING for i in running})
+            fields["status"] = JOB_QUEUED
+        if not store.claim(job, fields):
+            continue  # another process got there first
+        claimed.append(job["id"])
+        if fields["status"] == JOB_QUEUED:
+            logger.warning("[jobs] Re-queued job %s abandoned by worker %s", job["id"], job.get("worker"))
+            _get_pool().submit(_run_job, job["id"])
+        else:
+            logger.warning("[jobs] Gave up on job %s after %d recoveries", job["id"], recoveries - 1)
+    return claimed
+
+
+def _monitor_loop():
+    while True:
+        try:
+            store.heartbeat(WORKER_ID, _now())
+            recover_stale()
+        except Exception:
+            logger.exception("[jobs] Heartbeat / recovery pass failed")
+        time.sleep(JOB_HEARTBEAT_SECONDS)
+
+
+def start_monitor():
+    """Start this process's heartbeat / stale-job recovery thread (idempotent; called at startup)."""
+    global _monitor
+    with _monitor_lock:
+        if _monitor is None:
+            _monitor = threading.Thread(target=_monitor_loop, name="docgen-job-monitor", daemon=True)
+            _monitor.start()
+
+
+# -----------------------
+# Worker
+# -----------------------
+def _cancel_requested(job_id: str) -> bool:
+    job = store.get(job_id)
+    return bool(job and job.get("cancel_requested"))
+
+
+def _cancel_item(job_id: str, doc_id: str, i: int, item: dict):
+    store.update(job_id, {f"items.{i}.status": ITEM_CANCELLED, "updated_at": _now()})
+    generation.cancel_item(doc_id, item["kind"], item["index"])
+
+
+def _run_item(job_id: str, doc_id: str, raw_text: str, i: int, item: dict, use_cache: bool,
+              writer: Optional[generation.VersionedItemWriter] = None):
+    if _cancel_requested(job_id):
+        _cancel_item(job_id, doc_id, i, item)
+        return
+
+    store.update(job_id, {f"items.{i}.status": ITEM_RUNNING, "updated_at": _now()})
+    store.inc(job_id, {f"items.{i}.attempts": 1})
+    try:
+        generation.generate_item(doc_id, raw_text, item["kind"], item["index"], item["config"],
+                                 use_cache=use_cache, raise_errors=True, writer=writer)
+    except Exception as e:
+        store.update(job_id, {f"items.{i}.status": ITEM_FAILED, f"items.{i}.error": str(e), "updated_at": _now()})
+        store.inc(job_id, {"progress.failed": 1})
+        return
+    store.update(job_id, {f"items.{i}.status": ITEM_DONE, "updated_at": _now()})
+    store.inc(job_id, {"progress.done": 1})
+
+
+def _run_job(job_id: str):
+    from app.database import find_by_id
+
+    job = store.get(job_id)
+    if not job:
+        return
+    try:
+        if job.get("cancel_requested"):
+            for i, item in enumerate(job["items"]):
+                if item["status"] == ITEM_PENDING:
+                    _cancel_item(job_id, job["doc_id"], i, item)
+            generation.finalize_document(job["doc_id"], job["type"], job.get("user_id"))
+            _finish(job_id, JOB_CANCELLED)
+            return
+
+        store.update(job_id, {"status": JOB_RUNNING, "started_at": job.get("started_at") or _now(), "updated_at": _now()})
+        doc = find_by_id("documents", job["doc_id"])
+        if not doc:
+            raise RuntimeError(f"Document {job['doc_id']} not found")
+        src = sources.load(doc)
+        raw_text = src["raw_text"]
+        retrieval.remember_index(src["raw_text_index"])
+        digest.remember_digest(src["raw_text_digest"])
+
+        writer = None
+        if job.get("base_version") is not None:
+            writer = generation.VersionedItemWriter(job["doc_id"], job["base_version"], job["type"], job.get("user_id"))
+
+        todo = [(i, item) for i, item in enumerate(job["items"]) if item["status"] == ITEM_PENDING]
+        workers = max(1, min(ai.AI_MAX_CONCURRENCY, len(todo)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"job-{job_id[:8]}") as pool:
+            for i, item in todo:
+                pool.submit(_run_item, job_id, job["doc_id"], raw_text, i, item, job.get("use_cache", True), writer)
+        job = store.get(job_id)
+        statuses = [item["status"] for item in job["items"]]
+        if ITEM_CANCELLED in statuses:
+            status = JOB_CANCELLED
+        elif ITEM_FAILED in statuses:
+            status = JOB_FAILED
+        else:
+            status = JOB_COMPLETED
+
+        generation.finalize_document(job["doc_id"], job["type"], job.get("user_id"), writer)
+        if writer is not None:
+            # a retry continues from the last version this run wrote
+            store.update(job_id, {"base_version": writer.version})
+        _finish(job_id, status)
+    except Exception as e:
+        logger.exception("[jobs] Job %s crashed", job_id)
+        store.update(job_id, {"error": str(e)})
+        _finish(job_id, JOB_FAILED)
+
+
+def _finish(job_id: str, status: str):
+    store.update(job_id, {"status": status, "finished_at": _now(), "updated_at": _now()})
@@ -0,0 +1,106 @@
+# backend/app/lookups.py
+"""
+Cached user and user-config lookups for the authenticated request path.
+
+Two layers in front of Mongo:
+  - request scope: a dict in a contextvar, installed for every HTTP request by
+    RequestMemoMiddleware, so one request never loads the same record twice;
+  - process scope: a size-bounded, short-TTL MemoryCache (AUTH_CACHE_TTL_SECONDS)
+    shared by requests in this worker.
+
+Writers call the invalidate_* helpers. Other gunicorn workers are not notified;
+the TTL bounds how long they can serve a stale record.
+Callers always get their own copy, so mutating a returned dict is safe.
+"""
+import os
+import copy
+import contextvars
+from typing import Optional
+
+from app.cache import MemoryCache
+from app.database import find_by_id
+
+AUTH_CACHE_TTL_SECONDS = int(os.getenv("AUTH_CACHE_TTL_SECONDS", "30"))
+AUTH_CACHE_MAX_ENTRIES = int(os.getenv("AUTH_CACHE_MAX_ENTRIES", "2048"))
+
+_caches = {
+    "users": MemoryCache(max_entries=AUTH_CACHE_MAX_ENTRIES, ttl=AUTH_CACHE_TTL_SECONDS),
+    "user_configs": MemoryCache(max_entries=AUTH_CACHE_MAX_ENTRIES, ttl=AUTH_CACHE_TTL_SECONDS),
+}
+
+_request_memo: contextvars.ContextVar = contextvars.ContextVar("request_memo", default=None)
+
+
+def _lookup(collection: str, _id: Optional[str]) -> Optional[dict]:
+    if not _id:
+        return None
+    key = f"{collection}:{_id}"
+    memo = _request_memo.get()
+    if memo is not None and key in memo:
+        return copy.deepcopy(memo[key])
+
+    cache = _caches[collection] if AUTH_CACHE_TTL_SECONDS > 0 else None
+    record = cache.get(_id) if cache else None
+    if record is None:
+        record = find_by_id(collection, _id)
+        if cache and record is not None:
+            cache.set(_id, record)
+
+    if memo is not None:
+        memo[key] = record
+    return copy.deepcopy(record)
+
+
+def get_user(user_id: Optional[str]) -> Optional[dict]:
+    return _lookup("users", user_id)
+
+
+def get_user_config(user_id: Optional[str]) -> Optional[dict]:
+    return _lookup("user_configs", user_id)
+
+
+def _forget(collection: str, _id: Optional[str]):
+    if not _id:
+        return
+    _caches[collection].delete(_id)
+    memo = _request_memo.get()
+    if memo is not None:
+        memo.pop(f"{collection}:{_id}", None)
+
+
+def invalidate_user(user_id: Optional[str]):
+    _forget("users", user_id)
+
+
+def invalidate_user_config(user_id: Optional[str]):
+    _forget("user_configs", user_id)
+
+
+def invalidate_all_users():
+    """For bulk writes (e.g. a company's users deleted in one go)."""
+    _caches["users"].clear()
+    memo = _request_memo.get()
+    if memo is not None:
+        for key in [k for k in memo if k.startswith("users:")]:
+            memo.pop(key, None)
+
+
+def stats() -> dict:
+    return {name: cache.stats() for name, cache in _caches.items()}
+
+
+class RequestMemoMiddleware:
+    """Pure ASGI middleware giving each HTTP request a fresh lookup memo."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        token = _request_memo.set({})
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _request_memo.reset(token)
@@ -26,6 +26,8 @@ from app.routes.user_routes import router as users_router
 from app.routes.company_routes import router as companies_router
 from app.routes.admin_routes import router as admin_router
 from app.routes.config_routes import router as config_router
+from app.lookups import RequestMemoMiddleware
+from app import database, ingest, jobs
 
 # ---------------------------
 # Initialize FastAPI app
@@ -41,14 +43,29 @@ app = FastAPI(
 # ---------------------------
 allowed_origins = os.getenv("CORS_ALLOWED_ORIGINS", "*").split(",")
 
+# Per-request memo for user / user-config lookups (app/lookups.py)
+app.add_middleware(RequestMemoMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=allowed_origins,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # document version for If-Match (optimistic concurrency on document writes)
+    expose_headers=["ETag"],
 )
 
+# ---------------------------
+# Background work left behind by a restarted / redeployed worker
+# ---------------------------
+@app.on_event("startup")
+def resume_background_work():
+    database.run_migrations()  # no-op once applied; ensure_indexes may be switched off
+    jobs.start_monitor()
+    ingest.start_monitor()
+
+
 # ---------------------------
 # Register routers (API routes under /api/*)
 # ---------------------------
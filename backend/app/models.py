@@ -84,6 +84,7 @@ class CreateDocumentRequest(BaseModel):
     """
     template_id: Optional[str] = None
     raw_text: Optional[str] = None           # raw extracted text from upload
+    source_document_id: Optional[str] = None # id returned by /upload (reuses its raw_text + index)
     pages: Optional[List[PageDefinition]] = None
     sections: Optional[List[SectionDefinition]] = None
 
@@ -91,6 +92,8 @@ class CreateDocumentRequest(BaseModel):
     editable_prompt: Optional[str] = None
     title: Optional[str] = None
 
+    bypass_cache: Optional[bool] = False     # skip the LLM response cache for this request
+
 
 class RegenerateSectionRequest(BaseModel):
     """Request payload when regenerating a single section."""
@@ -98,6 +101,8 @@ class RegenerateSectionRequest(BaseModel):
     raw_text: Optional[str] = None
     user_instruction: Optional[str] = None   # replaces editable_prompt
     base_prompt: Optional[str] = None        # new: to send correct base prompt
+    bypass_cache: Optional[bool] = False     # skip the LLM response cache for this request
+    expected_version: Optional[int] = None   # 409 if another edit to this section landed first
 
 
 class RegeneratePageRequest(BaseModel):
@@ -106,6 +111,8 @@ class RegeneratePageRequest(BaseModel):
     raw_text: Optional[str] = None
     user_instruction: Optional[str] = None
     base_prompt: Optional[str] = None        # new: to send correct base prompt
+    bypass_cache: Optional[bool] = False     # skip the LLM response cache for this request
+    expected_version: Optional[int] = None   # 409 if another edit to this page landed first
 
 
 class RegenerateDocumentRequest(BaseModel):
@@ -119,6 +126,8 @@ class RegenerateDocumentRequest(BaseModel):
     raw_text: Optional[str] = None
     sections_prompts: Optional[Dict[str, str]] = None
     pages_prompts: Optional[Dict[str, str]] = None
+    bypass_cache: Optional[bool] = False     # skip the LLM response cache for this request
+    expected_version: Optional[int] = None   # 409 unless the document is still at this version
 
 
 # ----------------------------------------------------------------------
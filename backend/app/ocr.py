@@ -1,46 +1,518 @@
 # backend/app/ocr.py
 import os
+import time
+import hashlib
+import logging
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional
 from dotenv import load_dotenv
 load_dotenv()
 
+from app.cache import DiskCache, TieredCache, build_cache, data_dir, make_key
+
+logger = logging.getLogger(__name__)
+
 AZ_FORM_ENDPOINT = os.getenv("AZURE_FORM_RECOGNIZER_ENDPOINT")
 AZ_FORM_KEY = os.getenv("AZURE_FORM_RECOGNIZER_KEY")
+# Shared client tuning: LRO poll interval and overall wait (s), HTTP timeouts (s), keep-alive pool size
+AZ_FORM_POLL_INTERVAL = float(os.getenv("AZURE_FORM_RECOGNIZER_POLL_INTERVAL", "1"))
+AZ_FORM_TIMEOUT = float(os.getenv("AZURE_FORM_RECOGNIZER_TIMEOUT", "300"))
+AZ_FORM_CONNECT_TIMEOUT = float(os.getenv("AZURE_FORM_RECOGNIZER_CONNECT_TIMEOUT", "10"))
+AZ_FORM_READ_TIMEOUT = float(os.getenv("AZURE_FORM_RECOGNIZER_READ_TIMEOUT", "120"))
+AZ_FORM_POOL_SIZE = int(os.getenv("AZURE_FORM_RECOGNIZER_POOL_SIZE", "10"))
+AZ_FORM_METRICS_WINDOW = int(os.getenv("AZURE_FORM_RECOGNIZER_METRICS_WINDOW", "500"))
 
-def extract_text_with_azure(file_path: str) -> str:
-    # Try Azure Document Intelligence (prebuilt-read). Fallback to pytesseract or raw read.
-    if AZ_FORM_ENDPOINT and AZ_FORM_KEY:
-        try:
+# Local OCR fans pages out over a process pool (tesseract is CPU bound)
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", str(os.cpu_count() or 1)))
+# Rasterisation resolution for PDF pages
+OCR_PDF_DPI = int(os.getenv("OCR_PDF_DPI", "300"))
+
+# PDF pages whose text layer has fewer characters than this are treated as scans and OCR'd
+OCR_MIN_PAGE_CHARS = int(os.getenv("OCR_MIN_PAGE_CHARS", "20"))
+
+# Bump when extraction output changes, so cached results keyed on it are not reused
+EXTRACTOR_VERSION = 2
+
+# Extraction results by file content: mongo (shared, default) | memory | disk | none,
+# optionally fronted by a local disk tier (OCR_CACHE_DISK_DIR)
+OCR_CACHE_BACKEND = os.getenv("OCR_CACHE_BACKEND", "mongo")
+OCR_CACHE_TTL_SECONDS = int(os.getenv("OCR_CACHE_TTL_SECONDS", "0"))
+OCR_CACHE_DISK_DIR = os.getenv("OCR_CACHE_DISK_DIR", "")
+
+_shared_cache = build_cache(
+    OCR_CACHE_BACKEND,
+    ttl=OCR_CACHE_TTL_SECONDS,
+    max_entries=256,
+    directory=data_dir("cache", "ocr"),
+    collection="ocr_cache",
+)
+ocr_cache = TieredCache(DiskCache(OCR_CACHE_DISK_DIR, ttl=OCR_CACHE_TTL_SECONDS), _shared_cache) \
+    if OCR_CACHE_DISK_DIR else _shared_cache
+
+_PDF_EXTS = {".pdf"}
+_TIFF_EXTS = {".tif", ".tiff"}
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn: forking a threaded server process can deadlock the children
+            _pool = ProcessPoolExecutor(
+                max_workers=max(1, OCR_WORKERS),
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _pool
+
+
+# -----------------------
+# Page assembly
+# -----------------------
+def _join_pages(page_texts: List[str]) -> dict:
+    """
+    Join per-page text in page order. Returns {"text", "pages"} where each page
+    records its 1-based number and [start, end) character offsets into text.
+    """
+    parts, pages, offset = [], [], 0
+    for number, page_text in enumerate(page_texts, start=1):
+        page_text = (page_text or "").strip()
+        if parts:
+            offset += 1  # "\n" separator
+        pages.append({"page": number, "start": offset, "end": offset + len(page_text)})
+        parts.append(page_text)
+        offset += len(page_text)
+    return {"text": "\n".join(parts), "pages": pages}
+
+
+def _single_page(text: str) -> dict:
+    text = (text or "").strip()
+    return {"text": text, "pages": [{"page": 1, "start": 0, "end": len(text)}] if text else []}
+
+
+# -----------------------
+# Azure Document Intelligence
+# -----------------------
+_azure_client = None
+_azure_client_lock = threading.Lock()
+
+# Recent latencies (ms) per phase: submit (upload + begin), poll (wait for result), parse (build text)
+_AZ_PHASES = ("submit", "poll", "parse", "total")
+_az_latency = {phase: deque(maxlen=AZ_FORM_METRICS_WINDOW) for phase in _AZ_PHASES}
+_az_counts = {"calls": 0, "errors": 0, "timeouts": 0}
+_az_metrics_lock = threading.Lock()
+
+
+def _get_azure_client():
+    """One DocumentAnalysisClient per process, sharing a keep-alive connection pool."""
+    global _azure_client
+    if _azure_client is not None:
+        return _azure_client
+    with _azure_client_lock:
+        if _azure_client is None:
+            import requests
+            from requests.adapters import HTTPAdapter
             from azure.ai.formrecognizer import DocumentAnalysisClient
             from azure.core.credentials import AzureKeyCredential
-            client = DocumentAnalysisClient(AZ_FORM_ENDPOINT, AzureKeyCredential(AZ_FORM_KEY))
-            with open(file_path, "rb") as f:
-                poller = client.begin_analyze_document("prebuilt-read", document=f)
-                result = poller.result()
-            lines = []
-            for page in getattr(result, "pages", []):
-                for line in getattr(page, "lines", []):
-                    lines.append(line.content)
-            text = "\n".join(lines).strip()
-            if text:
-                return text
+            from azure.core.pipeline.transport import RequestsTransport
+
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=AZ_FORM_POOL_SIZE, pool_maxsize=AZ_FORM_POOL_SIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            transport = RequestsTransport(
+                session=session,
+                session_owner=False,
+                connection_timeout=AZ_FORM_CONNECT_TIMEOUT,
+                read_timeout=AZ_FORM_READ_TIMEOUT,
+            )
+            _azure_client = DocumentAnalysisClient(
+                AZ_FORM_ENDPOINT,
+                AzureKeyCredential(AZ_FORM_KEY),
+                transport=transport,
+                polling_interval=AZ_FORM_POLL_INTERVAL,
+            )
+        return _azure_client
+
+
+def _record_latency(timings: dict, outcome: Optional[str] = None):
+    with _az_metrics_lock:
+        _az_counts["calls"] += 1
+        if outcome:
+            _az_counts[outcome] += 1
+        for phase, ms in timings.items():
+            _az_latency[phase].append(ms)
+
+
+def _percentile(values: list, pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def azure_metrics() -> dict:
+    """Azure OCR call counts and per-phase latency (ms) over the last AZ_FORM_METRICS_WINDOW calls (per process)."""
+    with _az_metrics_lock:
+        out = dict(_az_counts)
+        samples = {phase: list(values) for phase, values in _az_latency.items()}
+    out["latency_ms"] = {
+        phase: {
+            "count": len(values),
+            "avg": round(sum(values) / len(values), 1),
+            "p50": round(_percentile(values, 50), 1),
+            "p95": round(_percentile(values, 95), 1),
+            "max": round(max(values), 1),
+        } if values else {"count": 0}
+        for phase, values in samples.items()
+    }
+    out["config"] = {
+        "poll_interval_s": AZ_FORM_POLL_INTERVAL,
+        "timeout_s": AZ_FORM_TIMEOUT,
+        "connect_timeout_s": AZ_FORM_CONNECT_TIMEOUT,
+        "read_timeout_s": AZ_FORM_READ_TIMEOUT,
+        "pool_size": AZ_FORM_POOL_SIZE,
+    }
+    return out
+
+
+def _ms_since(started: float) -> float:
+    return (time.perf_counter() - started) * 1000
+
+
+def _azure_pages(file_path: str, page_numbers: Optional[List[int]] = None) -> Optional[dict]:
+    """
+    Azure Document Intelligence (prebuilt-read); it splits pages server-side.
+    Returns {page_number (1-based): text}, limited to `page_numbers` when given.
+    """
+    if not (AZ_FORM_ENDPOINT and AZ_FORM_KEY):
+        return None
+    timings, outcome = {}, None
+    started = time.perf_counter()
+    try:
+        client = _get_azure_client()
+        kwargs = {"pages": ",".join(str(n) for n in page_numbers)} if page_numbers else {}
+
+        t = time.perf_counter()
+        with open(file_path, "rb") as f:
+            poller = client.begin_analyze_document("prebuilt-read", document=f, **kwargs)
+        timings["submit"] = _ms_since(t)
+
+        t = time.perf_counter()
+        result = poller.result(timeout=AZ_FORM_TIMEOUT)
+        timings["poll"] = _ms_since(t)
+        if not poller.done():
+            outcome = "timeouts"
+            raise TimeoutError(f"Azure prebuilt-read did not finish within {AZ_FORM_TIMEOUT}s")
+
+        t = time.perf_counter()
+        pages = {
+            getattr(page, "page_number", i): "\n".join(line.content for line in getattr(page, "lines", []))
+            for i, page in enumerate(getattr(result, "pages", []), start=1)
+        }
+        timings["parse"] = _ms_since(t)
+        if any(p.strip() for p in pages.values()):
+            return pages
+    except Exception:
+        outcome = outcome or "errors"
+        logger.exception("[OCR] Azure prebuilt-read failed for %s", file_path)
+    finally:
+        timings["total"] = _ms_since(started)
+        _record_latency(timings, outcome)
+        logger.info("[OCR] Azure prebuilt-read %s: %s", file_path,
+                    ", ".join(f"{k}={v:.0f}ms" for k, v in timings.items()))
+    return None
+
+
+# -----------------------
+# Local page-level OCR (tesseract)
+# -----------------------
+def _page_count(file_path: str, ext: str) -> int:
+    if ext in _PDF_EXTS:
+        import pdfplumber
+        with pdfplumber.open(file_path) as pdf:
+            return len(pdf.pages)
+    from PIL import Image
+    with Image.open(file_path) as img:
+        return getattr(img, "n_frames", 1)
+
+
+def _ocr_page(file_path: str, ext: str, index: int) -> str:
+    """OCR one page (0-based) of a PDF or multi-frame image. Runs in a worker process."""
+    import pytesseract
+    if ext in _PDF_EXTS:
+        import pdfplumber
+        with pdfplumber.open(file_path) as pdf:
+            img = pdf.pages[index].to_image(resolution=OCR_PDF_DPI).original
+            return pytesseract.image_to_string(img) or ""
+    from PIL import Image
+    with Image.open(file_path) as img:
+        img.seek(index)
+        return pytesseract.image_to_string(img.copy()) or ""
+
+
+def ocr_pages(file_path: str, page_indexes: Optional[List[int]] = None) -> List[str]:
+    """
+    Tesseract-OCR the pages of a PDF, TIFF or other image, one process per page,
+    and return their text in page order. `page_indexes` limits OCR to those pages
+    (0-based); the result still has one entry per page.
+    """
+    ext = ".pdf" if sniff_format(file_path) == "pdf" else os.path.splitext(file_path)[1].lower()
+    count = _page_count(file_path, ext)
+    todo = list(range(count)) if page_indexes is None else [i for i in page_indexes if 0 <= i < count]
+    texts = [""] * count
+    if len(todo) <= 1:
+        for i in todo:
+            texts[i] = _ocr_page(file_path, ext, i)
+        return texts
+
+    pool = _get_pool()
+    futures = {i: pool.submit(_ocr_page, file_path, ext, i) for i in todo}
+    for i, future in futures.items():
+        try:
+            texts[i] = future.result()
+        except Exception:
+            logger.exception("[OCR] tesseract failed on page %d of %s", i + 1, file_path)
+    return texts
+
+
+# -----------------------
+# Format sniffing
+# -----------------------
+def sniff_format(file_path: str) -> str:
+    """pdf | docx | tiff | image | html | text | unknown, from the file's leading bytes (extension as a tiebreak)."""
+    ext = os.path.splitext(file_path)[1].lower()
+    try:
+        with open(file_path, "rb") as f:
+            head = f.read(2048)
+    except Exception:
+        return "unknown"
+
+    if head.startswith(b"%PDF"):
+        return "pdf"
+    if head.startswith(b"PK\x03\x04"):
+        import zipfile
+        try:
+            with zipfile.ZipFile(file_path) as z:
+                if "word/document.xml" in z.namelist():
+                    return "docx"
         except Exception:
             pass
+        return "unknown"
+    if head[:4] in (b"II*\x00", b"MM\x00*"):
+        return "tiff"
+    if head.startswith((b"\x89PNG", b"\xff\xd8\xff", b"GIF8", b"BM")) or head[8:12] == b"WEBP":
+        return "image"
+
+    sample = head.lstrip(b"\xef\xbb\xbf").lstrip().lower()
+    if sample.startswith((b"<!doctype html", b"<html")) or ext in (".html", ".htm"):
+        return "html"
+    if b"\x00" not in head:
+        return "text"
+    return "unknown"
+
+
+# -----------------------
+# Native text extractors
+# -----------------------
+def _read_text_file(file_path: str) -> str:
+    with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
+        return f.read()
+
+
+def _pdf_text_pages(file_path: str) -> List[str]:
+    import pdfplumber
+    with pdfplumber.open(file_path) as pdf:
+        return [page.extract_text() or "" for page in pdf.pages]
+
+
+def _docx_text(file_path: str) -> str:
+    import docx
+    d = docx.Document(file_path)
+    parts = [p.text for p in d.paragraphs]
+    for table in d.tables:
+        for row in table.rows:
+            parts.append("\t".join(cell.text for cell in row.cells))
+    return "\n".join(p for p in parts if p.strip())
+
+
+def _html_text(file_path: str) -> str:
+    from html.parser import HTMLParser
+
+    class _Text(HTMLParser):
+        _SKIP = {"script", "style", "head", "noscript"}
+        _BLOCK = {"p", "div", "br", "li", "tr", "h1", "h2", "h3", "h4", "h5", "h6", "section", "article"}
+
+        def __init__(self):
+            super().__init__()
+            self.parts, self._skipping = [], 0
+
+        def handle_starttag(self, tag, attrs):
+            if tag in self._SKIP:
+                self._skipping += 1
+            elif tag in self._BLOCK:
+                self.parts.append("\n")
+
+        def handle_endtag(self, tag):
+            if tag in self._SKIP and self._skipping:
+                self._skipping -= 1
+
+        def handle_data(self, data):
+            if not self._skipping:
+                self.parts.append(data)
+
+    parser = _Text()
+    parser.feed(_read_text_file(file_path))
+    lines = (" ".join(line.split()) for line in "".join(parser.parts).splitlines())
+    return "\n".join(line for line in lines if line)
+
+
+# -----------------------
+# OCR
+# -----------------------
+def _ocr_page_texts(file_path: str, page_indexes: Optional[List[int]] = None) -> tuple:
+    """
+    OCR the given pages (0-based; all when None): Azure first, then local tesseract.
+    Returns ({index: text}, engine name) with only non-empty results.
+    """
+    numbers = [i + 1 for i in page_indexes] if page_indexes is not None else None
+    azure = _azure_pages(file_path, numbers)
+    if azure:
+        return {n - 1: t for n, t in azure.items() if t.strip()}, "azure_read"
+    try:
+        texts = ocr_pages(file_path, page_indexes)
+        return {i: t for i, t in enumerate(texts) if t.strip()}, "tesseract"
+    except Exception:
+        logger.info("[OCR] local OCR unavailable for %s", file_path, exc_info=True)
+    return {}, None
+
 
+def _extract_pdf(file_path: str, info: dict) -> List[str]:
     try:
-        from PIL import Image
-        import pytesseract
-        img = Image.open(file_path)
-        text = pytesseract.image_to_string(img)
-        if text and text.strip():
-            return text.strip()
+        pages = _pdf_text_pages(file_path)
+        info["extractor"] = "pdfplumber"
     except Exception:
-        pass
+        logger.exception("[OCR] pdfplumber failed for %s; OCR'ing the whole file", file_path)
+        pages = None
+
+    if pages is None:
+        found, engine = _ocr_page_texts(file_path)
+        info["extractor"] = engine or "none"
+        info["ocr_pages"] = sorted(i + 1 for i in found)
+        return [found[i] for i in sorted(found)]
+
+    scanned = [i for i, text in enumerate(pages) if len(text.strip()) < OCR_MIN_PAGE_CHARS]
+    if scanned:
+        found, engine = _ocr_page_texts(file_path, scanned)
+        for i, text in found.items():
+            if i < len(pages):
+                pages[i] = text
+        if engine:
+            info["extractor"] = f"pdfplumber+{engine}"
+        info["ocr_pages"] = sorted(i + 1 for i in found)
+    return pages
+
+
+# -----------------------
+# Public API
+# -----------------------
+def extract_document(file_path: str) -> dict:
+    """
+    Extract text from an uploaded file. Returns {"text", "pages", "extraction"}:
+    "pages" holds the character offsets of each page in "text"; "extraction" records
+    the sniffed format, the extractor(s) used, pages that needed OCR and the duration.
+
+    Embedded text layers are read directly (PDF via pdfplumber, DOCX, HTML, plain
+    text); only images and PDF pages without a usable text layer are OCR'd.
+    """
+    started = time.perf_counter()
+    fmt = sniff_format(file_path)
+    info = {"format": fmt, "extractor": None, "ocr_pages": [], "version": EXTRACTOR_VERSION}
+    out = _single_page("")
 
     try:
-        with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
-            content = f.read()
-            return content.strip()
+        if fmt == "pdf":
+            out = _join_pages(_extract_pdf(file_path, info))
+        elif fmt == "docx":
+            info["extractor"] = "python-docx"
+            out = _single_page(_docx_text(file_path))
+        elif fmt == "html":
+            info["extractor"] = "html"
+            out = _single_page(_html_text(file_path))
+        elif fmt == "text":
+            info["extractor"] = "text"
+            out = _single_page(_read_text_file(file_path))
+        else:
+            found, engine = _ocr_page_texts(file_path)
+            if found:
+                info["extractor"] = engine
+                info["ocr_pages"] = sorted(i + 1 for i in found)
+                texts = [""] * (max(found) + 1)
+                for i, text in found.items():
+                    texts[i] = text
+                out = _join_pages(texts)
     except Exception:
-        pass
+        logger.exception("[OCR] %s extraction failed for %s", fmt, file_path)
+
+    if not out["text"] and fmt not in ("docx", "pdf", "tiff", "image"):
+        # last resort, as before: whatever decodes as text
+        try:
+            info["extractor"] = "raw"
+            out = _single_page(_read_text_file(file_path))
+        except Exception:
+            pass
+
+    info["duration_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    logger.info("[OCR] %s via %s in %.0f ms (%d chars)", fmt, info["extractor"], info["duration_ms"], len(out["text"]))
+    return {**out, "extraction": info}
+
+
+def extract_text_with_azure(file_path: str) -> str:
+    # Kept for existing callers; see extract_document
+    return extract_document(file_path)["text"]
+
+
+# -----------------------
+# Cached extraction
+# -----------------------
+def file_sha256(file_path: str) -> str:
+    h = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def extract_document_cached(file_path: str, sha256: Optional[str] = None, use_cache: bool = True) -> dict:
+    """
+    extract_document through the OCR cache, keyed by the file's SHA-256 and
+    EXTRACTOR_VERSION, so the same bytes are only extracted once across users.
+    "extraction" gains "sha256" and "cached".
+    """
+    sha256 = sha256 or file_sha256(file_path)
+    if use_cache:
+        cached = lookup_cached(sha256)
+        if cached is not None:
+            logger.info("[OCR] cache hit for %s (%s)", file_path, sha256[:12])
+            return cached
+
+    result = extract_document(file_path)
+    if result["text"]:
+        # empty results are not cached: they usually mean OCR was unavailable
+        ocr_cache.set(_cache_key(sha256), result)
+    return {**result, "extraction": {**result["extraction"], "sha256": sha256, "cached": False}}
+
+
+def _cache_key(sha256: str) -> str:
+    return make_key("ocr", sha256, EXTRACTOR_VERSION)
+
 
-    return ""
+def lookup_cached(sha256: str) -> Optional[dict]:
+    """Cached extraction for a file hash, or None. Cheap enough to call inline."""
+    cached = ocr_cache.get(_cache_key(sha256))
+    if cached is None:
+        return None
+    return {**cached, "extraction": {**(cached.get("extraction") or {}), "sha256": sha256, "cached": True}}
@@ -0,0 +1,235 @@
+# backend/app/retrieval.py
+"""
+Local lexical retrieval over a document's raw_text.
+
+At upload time raw_text is split into overlapping chunks (pure Python, no
+external service). The stored index is a small plain dict - the chunks'
+offsets into raw_text and their token estimates, never a second copy of the
+text - and the BM25 statistics are derived from raw_text when it is loaded
+(load_index). At generation time each page/section sends only the chunks most
+relevant to its name, instruction and formatting rules, up to a configurable
+token budget.
+"""
+import os
+import re
+import math
+import hashlib
+from collections import Counter
+from typing import List, Optional, Tuple
+
+from app.cache import MemoryCache
+
+RETRIEVAL_CHUNK_TOKENS = int(os.getenv("RETRIEVAL_CHUNK_TOKENS", "400"))
+RETRIEVAL_CHUNK_OVERLAP = int(os.getenv("RETRIEVAL_CHUNK_OVERLAP", "50"))
+# raw_text tokens sent per page/section; raw_text under this size is sent whole
+RETRIEVAL_TOKEN_BUDGET = int(os.getenv("RETRIEVAL_TOKEN_BUDGET", "6000"))
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "12"))
+
+INDEX_VERSION = 2
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# Keys of the stored form of an index (see build_index)
+_STORED_KEYS = ("version", "text_hash", "spans", "chunk_tokens")
+
+# Recently used indexes, keyed by text hash, so per-item lookups don't rebuild them:
+# loaded ones (with chunks and BM25 statistics), and stored ones remembered from Mongo
+_index_cache = MemoryCache(max_entries=int(os.getenv("RETRIEVAL_INDEX_CACHE_SIZE", "16")))
+_stored_cache = MemoryCache(max_entries=int(os.getenv("RETRIEVAL_INDEX_CACHE_SIZE", "16")))
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+_STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "has", "in", "is", "it",
+    "its", "of", "on", "or", "that", "the", "this", "to", "was", "were", "will", "with",
+}
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token)."""
+    return (len(text or "") + 3) // 4
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()
+
+
+def _terms(text: str) -> List[str]:
+    return [t for t in _TOKEN_RE.findall((text or "").lower()) if t not in _STOPWORDS and len(t) > 1]
+
+
+def chunk_spans(text: str, chunk_tokens: int = None, overlap_tokens: int = None) -> List[Tuple[int, int]]:
+    """
+    (start, end) offsets of chunks of roughly `chunk_tokens`, preferring paragraph and
+    line boundaries; consecutive chunks share about `overlap_tokens` of text.
+    Offsets exclude the whitespace at either end of a chunk.
+    """
+    text = text or ""
+    max_chars = max(1, (chunk_tokens or RETRIEVAL_CHUNK_TOKENS) * 4)
+    overlap_chars = max(0, (overlap_tokens if overlap_tokens is not None else RETRIEVAL_CHUNK_OVERLAP) * 4)
+    overlap_chars = min(overlap_chars, max_chars // 2)
+
+    spans, start, n = [], 0, len(text)
+    while start < n:
+        end = min(n, start + max_chars)
+        if end < n:
+            # back off to the nearest paragraph / line / sentence break in the second half
+            window = text[start + max_chars // 2:end]
+            for sep in ("\n\n", "\n", ". "):
+                cut = window.rfind(sep)
+                if cut != -1:
+                    end = start + max_chars // 2 + cut + len(sep)
+                    break
+        lo, hi = start, end
+        while lo < hi and text[lo].isspace():
+            lo += 1
+        while hi > lo and text[hi - 1].isspace():
+            hi -= 1
+        if lo < hi:
+            spans.append((lo, hi))
+        if end >= n:
+            break
+        start = max(end - overlap_chars, start + 1)
+    return spans
+
+
+def chunk_text(text: str, chunk_tokens: int = None, overlap_tokens: int = None) -> List[str]:
+    """The chunks chunk_spans() describes, as strings."""
+    return [text[lo:hi] for lo, hi in chunk_spans(text, chunk_tokens, overlap_tokens)]
+
+
+def build_index(text: str, chunk_tokens: int = None, overlap_tokens: int = None) -> dict:
+    """
+    Chunk `text` into the index stored alongside it: chunk offsets and token estimates
+    only (JSON/BSON serialisable). load_index() adds the chunks and BM25 statistics.
+    """
+    spans = chunk_spans(text, chunk_tokens, overlap_tokens)
+    return {
+        "version": INDEX_VERSION,
+        "text_hash": text_hash(text),
+        "spans": [[lo, hi] for lo, hi in spans],
+        "chunk_tokens": [estimate_tokens(text[lo:hi]) for lo, hi in spans],
+    }
+
+
+def load_index(index: dict, text: str) -> dict:
+    """The stored `index` of `text` with its chunks and BM25 statistics filled in, ready for search()."""
+    chunks = [text[lo:hi] for lo, hi in index["spans"]]
+    term_freqs = [dict(Counter(_terms(c))) for c in chunks]
+    doc_freq = Counter()
+    for tf in term_freqs:
+        doc_freq.update(tf.keys())
+    lengths = [sum(tf.values()) for tf in term_freqs]
+    return {
+        **index,
+        "chunks": chunks,
+        "term_freqs": term_freqs,
+        "doc_freq": dict(doc_freq),
+        "avg_len": (sum(lengths) / len(lengths)) if lengths else 0.0,
+        "lengths": lengths,
+    }
+
+
+def index_matches(index: Optional[dict], text: str) -> bool:
+    return bool(index) and index.get("version") == INDEX_VERSION and index.get("text_hash") == text_hash(text)
+
+
+def needs_index(text: str, token_budget: int = None) -> bool:
+    return estimate_tokens(text) > (token_budget or RETRIEVAL_TOKEN_BUDGET)
+
+
+def remember_index(index: Optional[dict]) -> None:
+    """Make a stored index (e.g. loaded from Mongo) available to get_index / select_context."""
+    if index and index.get("version") == INDEX_VERSION and index.get("text_hash"):
+        _stored_cache.set(index["text_hash"], index)
+
+
+def get_index(text: str) -> dict:
+    """Loaded index for `text`: from the in-process cache, else from a remembered stored index, else built."""
+    key = text_hash(text)
+    index = _index_cache.get(key)
+    if index is None:
+        index = load_index(_stored_cache.get(key) or build_index(text), text)
+        _index_cache.set(key, index)
+    return index
+
+
+def ensure_index(text: str, stored: Optional[dict] = None) -> Optional[dict]:
+    """
+    Index to persist alongside `text` (the stored form): None when the text is small
+    enough to be sent whole, the stored index when it is still current, otherwise a new one.
+    """
+    if not text or not needs_index(text):
+        return None
+    if index_matches(stored, text):
+        remember_index(stored)
+        return stored
+    index = get_index(text)
+    return {k: index[k] for k in _STORED_KEYS}
+
+
+def search(index: dict, query: str, top_k: int = None) -> List[int]:
+    """
+    Chunk positions of a loaded index ranked by BM25 score for `query`
+    (best first, zero-score chunks dropped).
+    """
+    q_terms = set(_terms(query))
+    n = len(index.get("chunks") or [])
+    if not q_terms or not n:
+        return []
+    avg_len = index.get("avg_len") or 1.0
+    doc_freq = index.get("doc_freq") or {}
+    scores = []
+    for i, tf in enumerate(index["term_freqs"]):
+        length = index["lengths"][i]
+        score = 0.0
+        for term in q_terms:
+            f = tf.get(term)
+            if not f:
+                continue
+            df = doc_freq.get(term, 0)
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            score += idf * f * (BM25_K1 + 1) / (f + BM25_K1 * (1 - BM25_B + BM25_B * length / avg_len))
+        if score > 0:
+            scores.append((score, i))
+    scores.sort(key=lambda x: (-x[0], x[1]))
+    return [i for _, i in scores[: (top_k or RETRIEVAL_TOP_K)]]
+
+
+def item_query(item: dict) -> str:
+    """Retrieval query for a page/section config: its name, instruction and formatting rules."""
+    parts = [
+        item.get("name"),
+        item.get("instruction"),
+        item.get("purpose"),
+        item.get("type") or item.get("page_type"),
+        " ".join(item.get("formatting_rules") or []),
+    ]
+    return " ".join(str(p) for p in parts if p)
+
+
+def select_context(text: str, query: str, index: Optional[dict] = None,
+                   token_budget: int = None, top_k: int = None) -> str:
+    """
+    Return the part of `text` to send with one LLM call: the whole text if it fits the
+    budget, otherwise the top-k matching chunks, topped up with leading chunks while
+    budget remains, emitted in document order.
+    """
+    budget = token_budget or RETRIEVAL_TOKEN_BUDGET
+    if not text or estimate_tokens(text) <= budget:
+        return text or ""
+    if not index_matches(index, text):
+        index = get_index(text)
+    elif "term_freqs" not in index:
+        index = load_index(index, text)
+
+    matches = search(index, query, top_k)
+    matched = set(matches)
+    ranked = matches + [i for i in range(len(index["chunks"])) if i not in matched]
+    chosen, used = [], 0
+    for i in ranked:
+        cost = index["chunk_tokens"][i]
+        if used + cost > budget:
+            continue
+        chosen.append(i)
+        used += cost
+    return "\n\n".join(index["chunks"][i] for i in sorted(chosen))
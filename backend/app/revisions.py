@@ -0,0 +1,235 @@
+# backend/app/revisions.py
+"""
+Version history for generated documents.
+
+Every write that bumps a document's `version` records a revision in
+`document_revisions`, keyed "<doc_id>:<version>":
+  - delta:      only the pages/sections that changed (and the title, if it did);
+  - checkpoint: the full title/pages/sections, written for whole-document writes
+                (generation, regenerate-document) and every REVISION_CHECKPOINT_EVERY
+                versions, so rebuilding a version reads one checkpoint plus at most
+                REVISION_CHECKPOINT_EVERY - 1 deltas, however long the history is.
+The payload is JSON in `data`, compressed by the app/database.py large-field codec.
+
+Documents created before history existed get a "baseline" checkpoint of their
+current state the first time they are edited.
+
+  REVISIONS_ENABLED          "true" (default) | "false"
+  REVISION_CHECKPOINT_EVERY  versions between full checkpoints
+"""
+import os
+import re
+import json
+import logging
+import difflib
+import datetime
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+REVISIONS_ENABLED = os.getenv("REVISIONS_ENABLED", "true").strip().lower() in ("1", "true", "yes", "on")
+REVISION_CHECKPOINT_EVERY = max(1, int(os.getenv("REVISION_CHECKPOINT_EVERY", "10")))
+
+KIND_CHECKPOINT = "checkpoint"
+KIND_DELTA = "delta"
+
+_ITEM_KINDS = ("pages", "sections")
+
+
+def _now() -> str:
+    return datetime.datetime.utcnow().isoformat()
+
+
+def _coll():
+    # imported lazily: app.database connects to Mongo at import time
+    from app.database import COLLECTIONS
+    return COLLECTIONS["document_revisions"]
+
+
+def _version(doc: dict) -> int:
+    return int(doc.get("version") or 1)
+
+
+def _snapshot(doc: dict) -> dict:
+    return {"title": doc.get("title"), "pages": doc.get("pages") or [], "sections": doc.get("sections") or []}
+
+
+def _save(doc_id: str, version: int, kind: str, data: dict, action: str, user_id: Optional[str], changed: list):
+    from app.database import upsert
+
+    upsert("document_revisions", {
+        "id": f"{doc_id}:{version}",
+        "doc_id": doc_id,
+        "version": version,
+        "kind": kind,
+        "action": action,
+        "user_id": user_id,
+        "changed": changed,
+        "created_at": _now(),
+        "data": json.dumps(data, ensure_ascii=False, default=str),
+    })
+
+
+# -----------------------
+# Recording
+# -----------------------
+def checkpoint(doc: Optional[dict], action: str, user_id: Optional[str] = None, changed: Optional[list] = None):
+    """
+    Record the document's current version as a full snapshot. `changed` lists the
+    items the write touched when it was a page/section edit (empty = whole document).
+    """
+    if not REVISIONS_ENABLED or not doc:
+        return
+    try:
+        _save(doc["id"], _version(doc), KIND_CHECKPOINT, _snapshot(doc), action, user_id, changed or [])
+    except Exception:
+        logger.exception("[revisions] checkpoint failed for document %s", doc.get("id"))
+
+
+def ensure_baseline(doc_id: str, doc: Optional[dict] = None):
+    """
+    Before the first recorded edit of a document with no history, checkpoint its
+    current state so the edit has something to be a delta against.
+    `doc` (the stored record, if the caller already has it) saves a read.
+    """
+    if not REVISIONS_ENABLED:
+        return
+    if _coll().find_one({"doc_id": doc_id}, {"_id": 0, "id": 1}) is not None:
+        return
+    if doc is None:
+        from app.database import find_by_id
+        doc = find_by_id("documents", doc_id)
+    checkpoint(doc, "baseline")
+
+
+def record_change(doc: Optional[dict], changed: List[Tuple[str, str]], action: str, user_id: Optional[str] = None):
+    """
+    Record the version `doc` (the record after the write) as a delta of the
+    `changed` [(kind, name)] items, kind "page" | "section".
+    """
+    if not REVISIONS_ENABLED or not doc:
+        return
+    version = _version(doc)
+    changed_meta = [{"kind": kind, "name": name} for kind, name in changed]
+    if version % REVISION_CHECKPOINT_EVERY == 0:
+        checkpoint(doc, action, user_id, changed_meta)
+        return
+    data = {"items": {kind: {} for kind in _ITEM_KINDS}}
+    for kind, name in changed:
+        item = next((i for i in doc.get(f"{kind}s") or [] if i.get("name") == name), None)
+        data["items"][f"{kind}s"][name] = item
+    try:
+        _save(doc["id"], version, KIND_DELTA, data, action, user_id, changed_meta)
+    except Exception:
+        logger.exception("[revisions] delta failed for document %s", doc.get("id"))
+
+
+def changes_since(doc_id: str, since: int, until: int) -> Optional[set]:
+    """
+    {(kind, name)} of the pages/sections changed by versions since+1 .. until, or None
+    if that is unknown: a version in between was not recorded, or rewrote the whole document.
+    """
+    if until <= since:
+        return set()
+    entries = list(_coll().find(
+        {"doc_id": doc_id, "version": {"$gt": since, "$lte": until}},
+        {"_id": 0, "version": 1, "changed": 1},
+    ))
+    if len({e["version"] for e in entries}) != until - since:
+        return None
+    out = set()
+    for entry in entries:
+        if not entry.get("changed"):
+            return None
+        out.update((c["kind"], c["name"]) for c in entry["changed"])
+    return out
+
+
+def delete_history(doc_id: str):
+    _coll().delete_many({"doc_id": doc_id})
+
+
+# -----------------------
+# Reading
+# -----------------------
+def list_revisions(doc_id: str) -> List[dict]:
+    """Newest first, without payloads."""
+    cursor = _coll().find({"doc_id": doc_id}, {"_id": 0, "data": 0}).sort("version", -1)
+    return list(cursor)
+
+
+def _load_data(entry: dict) -> dict:
+    from app.database import decode_fields
+    return json.loads(decode_fields(entry)["data"])
+
+
+def _apply(state: dict, delta: dict):
+    for kind, items in (delta.get("items") or {}).items():
+        current = state[kind]
+        for name, item in items.items():
+            pos = next((i for i, it in enumerate(current) if it.get("name") == name), None)
+            if item is None:
+                if pos is not None:
+                    current.pop(pos)
+            elif pos is None:
+                current.append(item)
+            else:
+                current[pos] = item
+    if "title" in delta:
+        state["title"] = delta["title"]
+
+
+def reconstruct(doc_id: str, version: int) -> Optional[dict]:
+    """{id, version, title, pages, sections} as of `version`, or None if that version was not recorded."""
+    coll = _coll()
+    if coll.find_one({"doc_id": doc_id, "version": version}, {"_id": 0, "id": 1}) is None:
+        return None
+    base = coll.find_one(
+        {"doc_id": doc_id, "kind": KIND_CHECKPOINT, "version": {"$lte": version}},
+        {"_id": 0}, sort=[("version", -1)],
+    )
+    if base is None:
+        return None
+    state = _load_data(base)
+    deltas = coll.find(
+        {"doc_id": doc_id, "kind": KIND_DELTA, "version": {"$gt": base["version"], "$lte": version}},
+        {"_id": 0},
+    ).sort("version", 1)
+    for entry in deltas:
+        _apply(state, _load_data(entry))
+    return {"id": doc_id, "version": version, **state}
+
+
+def _lines(content) -> List[str]:
+    if not isinstance(content, str):
+        content = json.dumps(content, ensure_ascii=False, indent=1, default=str)
+    # one tag per line, so HTML diffs point at the paragraph that changed
+    return re.sub(r">\s*<", ">\n<", content or "").splitlines()
+
+
+def diff(old: dict, new: dict) -> dict:
+    """Item-level changes between two reconstructed versions, with a unified diff of each changed body."""
+    out = {"from_version": old["version"], "to_version": new["version"], "title": None, "items": []}
+    if old.get("title") != new.get("title"):
+        out["title"] = {"from": old.get("title"), "to": new.get("title")}
+    for kind in _ITEM_KINDS:
+        before = {i.get("name"): i for i in old.get(kind) or []}
+        after = {i.get("name"): i for i in new.get(kind) or []}
+        for name in list(before) + [n for n in after if n not in before]:
+            a, b = before.get(name), after.get(name)
+            if a == b:
+                continue
+            entry = {"kind": kind[:-1], "name": name}
+            if a is None:
+                entry["change"] = "added"
+            elif b is None:
+                entry["change"] = "removed"
+            else:
+                entry["change"] = "modified"
+                entry["fields"] = sorted(k for k in set(a) | set(b) if a.get(k) != b.get(k))
+            entry["content_diff"] = list(difflib.unified_diff(
+                _lines((a or {}).get("content")), _lines((b or {}).get("content")),
+                fromfile=f"v{old['version']}", tofile=f"v{new['version']}", lineterm="",
+            ))
+            out["items"].append(entry)
+    return out
@@ -1,7 +1,8 @@
 # backend/app/routes/admin_routes.py
 from fastapi import APIRouter, Body, Depends, HTTPException
 from app.auth import require_role, get_current_user, create_token
-from app.database import read_all
+from app.database import read_all, ensure_indexes, index_report
+from app import ai, ocr, user_repo
 from typing import Dict
 
 router = APIRouter()
@@ -18,19 +19,18 @@ def admin_login(data: Dict = Body(...)):
     if not email or not password:
         raise HTTPException(status_code=400, detail="email and password required")
 
-    users = read_all("users")
-    for u in users:
-        if u.get("email") == email and u.get("password") == password:
-            if u.get("role") != "superadmin":
-                raise HTTPException(status_code=403, detail="Not a superadmin")
-            token = create_token({
-                "user_id": u.get("id"),
-                "role": u.get("role"),
-                "company_id": u.get("company_id"),
-                "company_name": u.get("company_name"),
-                "created_by": u.get("created_by")
-            })
-            return {"message": "ok", "token": token, "user": {"id": u.get("id"), "email": u.get("email"), "name": u.get("name"), "role": u.get("role")}}
+    u = user_repo.authenticate(email, password)
+    if u:
+        if u.get("role") != "superadmin":
+            raise HTTPException(status_code=403, detail="Not a superadmin")
+        token = create_token({
+            "user_id": u.get("id"),
+            "role": u.get("role"),
+            "company_id": u.get("company_id"),
+            "company_name": u.get("company_name"),
+            "created_by": u.get("created_by")
+        })
+        return {"message": "ok", "token": token, "user": {"id": u.get("id"), "email": u.get("email"), "name": u.get("name"), "role": u.get("role")}}
     raise HTTPException(status_code=401, detail="Invalid credentials")
 
 @router.get("/seed")
@@ -45,3 +45,28 @@ def dump_data(user=Depends(require_role(["admin","superadmin"]))):
         "documents": read_all("documents"),
         "companies": read_all("companies")
     }
+
+@router.get("/ai-cache")
+def ai_cache_stats(user=Depends(require_role(["superadmin"]))):
+    """Hit/miss counters of the LLM response cache (per worker process)."""
+    return ai.response_cache.stats()
+
+@router.get("/ocr-cache")
+def ocr_cache_stats(user=Depends(require_role(["superadmin"]))):
+    """Hit/miss counters of the OCR/text-extraction cache (per worker process)."""
+    return ocr.ocr_cache.stats()
+
+@router.get("/ocr-metrics")
+def ocr_metrics(user=Depends(require_role(["superadmin"]))):
+    """Azure Document Intelligence latency by phase (submit, poll, parse) for this worker process."""
+    return ocr.azure_metrics()
+
+@router.get("/indexes")
+def index_status(user=Depends(require_role(["superadmin"]))):
+    """Registered MongoDB/Cosmos indexes per collection, flagging missing or non-unique ones."""
+    return index_report()
+
+@router.post("/indexes")
+def apply_indexes(user=Depends(require_role(["superadmin"]))):
+    """Re-apply the index registry (idempotent) and return the per-index outcome."""
+    return {"results": ensure_indexes(), "report": index_report()}
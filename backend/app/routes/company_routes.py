@@ -2,6 +2,7 @@
 from fastapi import APIRouter, Body, HTTPException, Depends
 from app.database import read_all, find_by_id, upsert, delete_by_id, COLLECTIONS
 from app.auth import get_current_user, require_role
+from app import lookups
 import uuid
 
 router = APIRouter()
@@ -51,5 +52,6 @@ def delete_company(company_id: str, user=Depends(require_role(["admin", "superad
 
     # Cascade delete users under this company
     COLLECTIONS["users"].delete_many({"company_id": company_id})
+    lookups.invalidate_all_users()
 
     return {"message": "deleted (company + users)"}
@@ -2,9 +2,9 @@
 from fastapi import APIRouter, Depends, HTTPException, Body
 from datetime import datetime
 from app.auth import get_current_user
-from app.database import find_by_id, upsert
+from app.database import upsert
 from app.models import UserConfig, SectionDefinition, PageDefinition
-from app import ai  # ✅ use ai._build_section_prompt & ai._build_page_prompt
+from app import ai, lookups  # ✅ use ai._build_section_prompt & ai._build_page_prompt
 
 router = APIRouter()
 
@@ -91,7 +91,7 @@ def get_user_config(user=Depends(get_current_user)):
     Get the saved configuration for the current user.
     Returns 404 if not found.
     """
-    cfg = find_by_id("user_configs", user.get("id"))
+    cfg = lookups.get_user_config(user.get("id"))
     if not cfg:
         raise HTTPException(404, "No configuration found for this user")
     return cfg
@@ -113,6 +113,7 @@ def create_or_update_config(payload: UserConfig = Body(...), user=Depends(get_cu
     cfg_obj = _apply_prompts_generation(cfg_obj)
 
     saved = upsert("user_configs", cfg_obj)
+    lookups.invalidate_user_config(user.get("id"))
     return saved
 
 
@@ -131,4 +132,5 @@ def update_config(payload: UserConfig = Body(...), user=Depends(get_current_user
     cfg_obj = _apply_prompts_generation(cfg_obj)
 
     saved = upsert("user_configs", cfg_obj)
+    lookups.invalidate_user_config(user.get("id"))
     return saved
@@ -1,5 +1,5 @@
 # backend/app/routes/document_routes.py
-from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, Body, Query, Request
+from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, Body, Query, Request, Header, Response
 import os
 import uuid
 import json
@@ -7,7 +7,12 @@ import logging
 import io
 import datetime
 import re
+import queue
+import asyncio
+import hashlib
+import base64
 import html as pyhtml
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional, List, Any
 from pydantic import BaseModel, Field
 from docx import Document  # still needed for htmldocx
@@ -21,11 +26,12 @@ from app.models import (
     RegenerateDocumentRequest,
     PageDefinition,
 )
-from app.database import upsert, find_by_id
+from app.database import upsert, find_by_id, update_fields, update_array_item, COLLECTIONS
 from app.auth import get_current_user
-from app import ai, ocr
+from app import ai, ai_async, digest, ocr, generation, ingest, jobs, lookups, retrieval, revisions, sources
 
 from fastapi.responses import StreamingResponse, JSONResponse
+from pymongo.errors import OperationFailure
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
@@ -36,11 +42,121 @@ BASE_DIR = os.path.dirname(__file__)
 STORAGE_DIR = os.path.join(os.path.dirname(BASE_DIR), "uploads")
 os.makedirs(STORAGE_DIR, exist_ok=True)
 
+# Uploads are streamed to disk in UPLOAD_CHUNK_BYTES pieces and rejected (413) above UPLOAD_MAX_BYTES
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(100 * 1024 * 1024)))
+UPLOAD_CHUNK_BYTES = int(os.getenv("UPLOAD_CHUNK_BYTES", str(1024 * 1024)))
+# multipart boundaries/headers on top of the file itself
+_MULTIPART_SLACK_BYTES = 64 * 1024
+# /upload-batch: files per request, and files extracted at once when merging
+UPLOAD_BATCH_MAX_FILES = int(os.getenv("UPLOAD_BATCH_MAX_FILES", "20"))
+UPLOAD_BATCH_CONCURRENCY = int(os.getenv("UPLOAD_BATCH_CONCURRENCY", "4"))
+# Page/section writes that lost a version race but touch a different item are re-applied up to this many times
+DOC_WRITE_RETRIES = int(os.getenv("DOC_WRITE_RETRIES", "3"))
+
 
 def _make_id() -> str:
     return str(uuid.uuid4())
 
 
+# Internal fields kept on the stored record but never sent to clients
+_PRIVATE_DOC_FIELDS = ("raw_text_index", "raw_text_digest", "raw_text_ref")
+
+
+def _public_doc(doc: Optional[dict]) -> Optional[dict]:
+    if not doc:
+        return doc
+    return {k: v for k, v in doc.items() if k not in _PRIVATE_DOC_FIELDS}
+
+
+def _store_digest(doc: dict, src: dict, raw_text: str):
+    """
+    Keep the digest generation just used, if it was built for the document's own
+    source text (`src` = sources.load(doc)) and is not stored yet.
+    """
+    built = digest.peek(raw_text)
+    if built and built != src.get("raw_text_digest") and raw_text == (src.get("raw_text") or "").strip():
+        sources.store_digest(doc, built)
+
+
+# Page/section updates answer with the document minus raw_text: the client already
+# has it. (Only records written before app/sources.py still carry it inline.)
+_ITEM_UPDATE_PROJECTION = {"raw_text": 0, **{f: 0 for f in _PRIVATE_DOC_FIELDS}}
+_ACCESS_PROJECTION = {"_id": 0, "id": 1, "user_id": 1, "company_id": 1}
+
+
+# ---------------------------
+# Optimistic concurrency
+# ---------------------------
+# Writes can name the version they were based on (`expected_version` in the body, or an
+# If-Match header carrying the ETag from GET /{doc_id}). Page/section writes then apply
+# only if no other write has touched the same item since; edits to other items are
+# merged (the write is re-applied on top of them). Anything else is a 409.
+def _etag(version) -> str:
+    return f'"{int(version or 1)}"'
+
+
+def _expected_version(explicit: Optional[int], if_match: Optional[str]) -> Optional[int]:
+    if explicit is not None:
+        return int(explicit)
+    if not if_match or if_match.strip() == "*":
+        return None
+    value = if_match.split(",")[0].strip()
+    if value.startswith("W/"):
+        value = value[2:]
+    try:
+        return int(value.strip('"'))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="If-Match must be a document version ETag")
+
+
+def _conflict(current_version: int, detail: str = None) -> HTTPException:
+    return HTTPException(
+        status_code=409,
+        detail=detail or "The document was changed by someone else. Reload it and try again.",
+        headers={"ETag": _etag(current_version)},
+    )
+
+
+def _rebase(doc_id: str, kind: str, name: str, expected: int, current_version: int) -> int:
+    """
+    The version to re-apply a `kind` ("page" | "section") write on, given it was based
+    on `expected` and the document is now at `current_version`; raises 409 if a write
+    in between touched the same item (or cannot be told apart from one).
+    """
+    if current_version < expected:
+        raise _conflict(current_version)
+    changed = revisions.changes_since(doc_id, expected, current_version)
+    if changed is None or (kind, name) in changed:
+        raise _conflict(current_version, f"This {kind} was changed by someone else. Reload it and try again.")
+    return current_version
+
+
+def _update_item(doc_id: str, array: str, name: str, fields: dict, expected_version: Optional[int] = None) -> dict:
+    """
+    $set `fields` on the page/section called `name` (bumping version); 404 if it does not exist.
+    With `expected_version`, a compare-and-swap (see above).
+    """
+    kind = array[:-1]
+    expected = expected_version
+    for _ in range(DOC_WRITE_RETRIES + 1):
+        updated = update_array_item(
+            "documents", doc_id, array, {"name": name}, fields,
+            extra={"updated_at": datetime.datetime.utcnow().isoformat()},
+            projection=_ITEM_UPDATE_PROJECTION,
+            expected_version=expected,
+        )
+        if updated is not None:
+            return updated
+        current = COLLECTIONS["documents"].find_one({"id": doc_id}, {"_id": 0, "version": 1, f"{array}.name": 1})
+        if not current:
+            raise HTTPException(status_code=404, detail="Document not found")
+        if not any(item.get("name") == name for item in current.get(array) or []):
+            raise HTTPException(status_code=404, detail=f"{kind.capitalize()} not found")
+        if expected is not None:
+            expected = _rebase(doc_id, kind, name, expected, current.get("version") or 1)
+    raise _conflict(expected or 1)
+
+
 def _can_access_doc(user: dict, doc: dict) -> bool:
     if user.get("role") == "superadmin":
         return True
@@ -55,7 +171,7 @@ def _get_user_config(user: dict) -> Optional[dict]:
     try:
         if not user or not user.get("id"):
             return None
-        return find_by_id("user_configs", user.get("id"))
+        return lookups.get_user_config(user.get("id"))
     except Exception:
         logger.exception("Failed to load user config for user id=%s", user.get("id") if user else None)
         return None
@@ -74,55 +190,224 @@ def _ensure_user_config_or_403(user: dict):
 # -----------------
 # Upload endpoint
 # -----------------
-@router.post("/upload")
-async def upload_file(file: UploadFile = File(...), user=Depends(get_current_user)):
-    _ensure_user_config_or_403(user)
+def _too_large() -> HTTPException:
+    return HTTPException(
+        status_code=413,
+        detail=f"File too large. Maximum upload size is {UPLOAD_MAX_BYTES // (1024 * 1024)} MB.",
+    )
 
-    ext = os.path.splitext(file.filename)[1].lower()
-    tmp_name = _make_id() + ext
-    path = os.path.join(STORAGE_DIR, tmp_name)
 
+def _reject_oversized_request(request: Request):
+    """Fail fast on Content-Length, before any of the body is read."""
     try:
-        with open(path, "wb") as f:
-            f.write(await file.read())
+        length = int(request.headers.get("content-length") or 0)
+    except ValueError:
+        length = 0
+    if length > UPLOAD_MAX_BYTES + _MULTIPART_SLACK_BYTES:
+        raise _too_large()
+
+
+async def _save_upload(file: UploadFile, path: str):
+    """
+    Stream `file` to `path` in UPLOAD_CHUNK_BYTES pieces, hashing as it goes.
+    Returns (sha256 hex, size in bytes). Raises 413 past UPLOAD_MAX_BYTES (nothing is kept).
+    """
+    if getattr(file, "size", None) and file.size > UPLOAD_MAX_BYTES:
+        raise _too_large()
+
+    digest_, size = hashlib.sha256(), 0
+    part = path + ".part"
+    try:
+        with open(part, "wb") as f:
+            while True:
+                chunk = await file.read(UPLOAD_CHUNK_BYTES)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > UPLOAD_MAX_BYTES:
+                    raise _too_large()
+                digest_.update(chunk)
+                f.write(chunk)
+        os.replace(part, path)
+    except HTTPException:
+        os.remove(part)
+        raise
     except Exception:
         logger.exception("Failed to save uploaded file to path=%s", path)
+        if os.path.exists(part):
+            os.remove(part)
         raise HTTPException(status_code=500, detail="Failed to save uploaded file.")
+    return digest_.hexdigest(), size
+
+
+def _storage_path(filename: str) -> str:
+    ext = os.path.splitext(filename or "")[1].lower()
+    return os.path.join(STORAGE_DIR, _make_id() + ext)
 
-    text = ""
-    try:
-        text = ocr.extract_text_with_azure(path) or ""
-    except Exception as e:
-        logger.exception("OCR extraction failed for path=%s: %s", path, e)
-        text = ""
 
+def _new_upload_doc(user: dict, filename: str, path: str, sha256: str, size: int) -> dict:
+    """Store the documents record for an uploaded file whose text is not extracted yet."""
     # ✅ Always define now here (outside try/except)
     now = datetime.datetime.utcnow().isoformat()
-    doc_id = _make_id()
-
     db_doc = {
-        "id": doc_id,
-        "filename": file.filename,
+        "id": _make_id(),
+        "filename": filename,
         "path": path,
-        "raw_text": text,
+        # content hash of the stored file, for dedupe and the OCR cache
+        "sha256": sha256,
+        "size_bytes": size,
+        # raw_text is filled in by app/ingest.py once extraction finishes
+        **ingest.pending_fields(),
         "created_at": now,
         "updated_at": now,
         "user_id": user.get("id"),
         "company_id": user.get("company_id"),
         "company_name": user.get("company_name"),
     }
-
     upsert("documents", db_doc)
+    return db_doc
+
 
+def _upload_result(doc: dict, fields: dict) -> dict:
+    text = fields.get("raw_text") or ""
     return {
-        "id": doc_id,
-        "filename": file.filename,
-        "path": path,
+        "id": doc["id"],
+        "filename": doc["filename"],
+        "path": doc["path"],
         "raw_text": text,
         "extracted_text": text,
+        "ocr_status": fields["ocr_status"],
+        "ocr_error": fields.get("ocr_error"),
     }
 
 
+@router.post("/upload")
+async def upload_file(request: Request, file: UploadFile = File(...), user=Depends(get_current_user)):
+    _reject_oversized_request(request)
+    _ensure_user_config_or_403(user)
+
+    path = _storage_path(file.filename)
+    sha256, size = await _save_upload(file, path)
+
+    db_doc = _new_upload_doc(user, file.filename, path, sha256, size)
+    fields = await asyncio.to_thread(ingest.start, db_doc["id"], path, sha256)
+    return _upload_result(db_doc, fields)
+
+
+# -----------------
+# Batch upload
+# -----------------
+def _merge_corpus(user: dict, members: list) -> dict:
+    """
+    One documents record whose raw_text concatenates the extracted text of `members`
+    ([(upload doc, fields)], in upload order), with each file's offsets in raw_text_sources.
+    """
+    parts, file_spans, offset = [], [], 0
+    for doc, fields in members:
+        text = (fields.get("raw_text") or "").strip()
+        if not text:
+            continue
+        block = f"===== {doc['filename']} =====\n{text}"
+        if parts:
+            offset += 2  # "\n\n" separator
+        file_spans.append({"document_id": doc["id"], "filename": doc["filename"],
+                           "start": offset, "end": offset + len(block)})
+        parts.append(block)
+        offset += len(block)
+
+    raw_text = "\n\n".join(parts)
+    now = datetime.datetime.utcnow().isoformat()
+    corpus = {
+        "id": _make_id(),
+        "filename": f"{len(file_spans)} merged files",
+        "raw_text": raw_text,
+        "raw_text_sources": file_spans,
+        "raw_text_index": retrieval.ensure_index(raw_text),
+        "ocr_status": ingest.OCR_COMPLETED if raw_text else ingest.OCR_FAILED,
+        "ocr_error": None if raw_text else "No text could be extracted from any file.",
+        "created_at": now,
+        "updated_at": now,
+        "user_id": user.get("id"),
+        "company_id": user.get("company_id"),
+        "company_name": user.get("company_name"),
+    }
+    upsert("documents", sources.externalize(corpus))
+    return corpus
+
+
+@router.post("/upload-batch")
+async def upload_batch(
+    files: List[UploadFile] = File(...),
+    merge: bool = Query(False, description="Also build one document whose raw_text is all files' text"),
+    user=Depends(get_current_user),
+):
+    """
+    Upload several files in one request. Each file is streamed to storage and gets its
+    own document, exactly like /upload. Without `merge`, extraction runs in the
+    background (poll /{id}/ocr-status); with `merge`, files are extracted concurrently
+    (at most UPLOAD_BATCH_CONCURRENCY at a time) and the merged corpus is returned too.
+    """
+    _ensure_user_config_or_403(user)
+    if not files:
+        raise HTTPException(status_code=400, detail="No files uploaded.")
+    if len(files) > UPLOAD_BATCH_MAX_FILES:
+        raise HTTPException(status_code=400, detail=f"Too many files. At most {UPLOAD_BATCH_MAX_FILES} per batch.")
+
+    results, saved = [], []
+    for file in files:
+        path = _storage_path(file.filename)
+        try:
+            sha256, size = await _save_upload(file, path)
+        except HTTPException as e:
+            results.append({"filename": file.filename, "ocr_status": ingest.OCR_FAILED,
+                            "error": e.detail, "status_code": e.status_code})
+            continue
+        doc = _new_upload_doc(user, file.filename, path, sha256, size)
+        results.append(None)  # filled below, keeping upload order
+        saved.append((len(results) - 1, doc, sha256))
+
+    if merge:
+        limit = asyncio.Semaphore(max(1, UPLOAD_BATCH_CONCURRENCY))
+
+        async def _extract(doc, sha256):
+            async with limit:
+                return await asyncio.to_thread(ingest.run, doc["id"], doc["path"], sha256)
+
+        extracted = await asyncio.gather(*[_extract(doc, sha256) for _, doc, sha256 in saved])
+    else:
+        extracted = [await asyncio.to_thread(ingest.start, doc["id"], doc["path"], sha256)
+                     for _, doc, sha256 in saved]
+
+    for (pos, doc, _), fields in zip(saved, extracted):
+        results[pos] = _upload_result(doc, fields)
+
+    out = {"files": results}
+    if merge:
+        corpus = await asyncio.to_thread(
+            _merge_corpus, user, [(doc, fields) for (_, doc, _), fields in zip(saved, extracted)]
+        )
+        out["corpus"] = {
+            "id": corpus["id"],
+            "raw_text": corpus["raw_text"],
+            "sources": corpus["raw_text_sources"],
+            "ocr_status": corpus["ocr_status"],
+        }
+    return out
+
+
+@router.get("/{doc_id}/ocr-status")
+def get_ocr_status(doc_id: str, user=Depends(get_current_user)):
+    """Poll target for uploads: extraction status without the (large) text fields."""
+    doc = COLLECTIONS["documents"].find_one(
+        {"id": doc_id},
+        {"_id": 0, "id": 1, "user_id": 1, "company_id": 1, "ocr_status": 1, "ocr_error": 1,
+         "ocr_finished_at": 1, "extraction": 1},
+    )
+    if not doc:
+        raise HTTPException(status_code=404, detail="Document not found")
+    if not _can_access_doc(user, doc):
+        raise HTTPException(status_code=403, detail="Access denied")
+    return ingest.status(doc)
 
 
 def _try_load_raw_text_from_path(path: Optional[str]) -> str:
@@ -130,22 +415,47 @@ def _try_load_raw_text_from_path(path: Optional[str]) -> str:
         return ""
     try:
         if os.path.exists(path):
-            return ocr.extract_text_with_azure(path) or ""
+            return ocr.extract_document_cached(path)["text"] or ""
     except Exception as e:
         logger.exception("Failed to load raw_text from path '%s': %s", path, e)
     return ""
 
 
-# -----------------
-# Generate endpoint
-# -----------------
-@router.post("/generate")
-def generate_document(payload: CreateDocumentRequest = Body(...), user=Depends(get_current_user)):
+def _prepare_generation(payload: CreateDocumentRequest, user: dict):
+    """
+    Resolve raw_text and the page/section configs (payload overrides, else the user's
+    saved config) and build the prompt for each item. Returns (raw_text, pages, sections).
+    """
     raw_text = (payload.raw_text or "").strip()
+    src = None
+    if payload.source_document_id:
+        src = find_by_id("documents", payload.source_document_id)
+        if not src:
+            raise HTTPException(status_code=404, detail="Source document not found")
+        if not _can_access_doc(user, src):
+            raise HTTPException(status_code=403, detail="Access denied")
+        if ingest.ocr_status(src) == ingest.OCR_PENDING:
+            src = ingest.wait_for(src["id"])
+            if not src:
+                raise HTTPException(status_code=404, detail="Source document not found")
+            if ingest.ocr_status(src) == ingest.OCR_PENDING:
+                raise HTTPException(
+                    status_code=409,
+                    detail="Text extraction for this document is still running. Please try again shortly.",
+                )
+        src_text = sources.load(src, with_text=not raw_text)
+        raw_text = raw_text or src_text["raw_text"].strip()
+        retrieval.remember_index(src_text["raw_text_index"])
     file_path = getattr(payload, "file_path", None) or getattr(payload, "path", None)
     if not raw_text and file_path:
         raw_text = _try_load_raw_text_from_path(file_path)
 
+    # Large uploads generate from a map-reduce digest; build it once and keep it on the upload
+    stored_digest = src_text["raw_text_digest"] if src else None
+    built = digest.ensure_digest(raw_text, stored_digest, use_cache=not payload.bypass_cache)
+    if src and built and built is not stored_digest:
+        sources.store_digest(src, built)
+
     user_config = _get_user_config(user)
     provided_pages = [p.dict() for p in payload.pages] if getattr(payload, "pages", None) else None
     provided_sections = [s.dict() for s in payload.sections] if getattr(payload, "sections", None) else None
@@ -190,11 +500,34 @@ def generate_document(payload: CreateDocumentRequest = Body(...), user=Depends(g
             logger.exception("Failed to build section prompt")
             s["generated_prompt"] = s.get("instruction") or ""
 
-    
+    return raw_text, pages_override, sections_override
+
+
+# -----------------
+# Generate endpoint
+# -----------------
+@router.post("/generate")
+def generate_document(
+    payload: CreateDocumentRequest = Body(...),
+    background: bool = Query(False, description="Queue a background job and return its id immediately"),
+    user=Depends(get_current_user),
+):
+    raw_text, pages_override, sections_override = _prepare_generation(payload, user)
+
+    if background:
+        db_doc = generation.new_document(user, raw_text, pages_override, sections_override)
+        upsert("documents", sources.externalize(db_doc))
+        job = jobs.enqueue("generate", db_doc["id"], user.get("id"),
+                           generation.pending_items(db_doc), use_cache=not payload.bypass_cache)
+        return JSONResponse(status_code=202, content={
+            "message": "Document generation queued", "id": db_doc["id"], "job_id": job["id"], "job": job,
+        })
 
     ai_resp_str = ""
     try:
-        ai_resp_str = ai.generate_document_from_template({}, raw_text, pages_override, sections_override)
+        ai_resp_str = ai.generate_document_from_template(
+            {}, raw_text, pages_override, sections_override, use_cache=not payload.bypass_cache
+        )
     except Exception:
         logger.exception("AI generate_document_from_template call failed.")
         ai_resp_str = ""
@@ -211,6 +544,8 @@ def generate_document(payload: CreateDocumentRequest = Body(...), user=Depends(g
         "id": doc_id,
         "title": doc_json.get("title", "Untitled Document"),
         "raw_text": raw_text,
+        "raw_text_index": retrieval.ensure_index(raw_text),
+        "raw_text_digest": digest.peek(raw_text),
         "pages": doc_json.get("pages", []),
         "sections": doc_json.get("sections", []),
         "created_at": now,
@@ -220,36 +555,182 @@ def generate_document(payload: CreateDocumentRequest = Body(...), user=Depends(g
         "company_id": user.get("company_id"),
         "company_name": user.get("company_name"),
     }
-    upsert("documents", db_doc)
-    return {"message": "Document generated", "id": doc_id, "document": db_doc}
+    upsert("documents", sources.externalize(db_doc))
+    revisions.checkpoint(db_doc, "generate", user.get("id"))
+    return {"message": "Document generated", "id": doc_id, "document": _public_doc(db_doc)}
 
-from app.database import COLLECTIONS
 
-@router.get("/my-documents")
-def list_user_documents(user=Depends(get_current_user)):
+# -----------------
+# Streaming generate (NDJSON)
+# -----------------
+def _ndjson(event: dict) -> bytes:
+    return (json.dumps(event, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+
+
+def _stream_generation(doc: dict, items: list, use_cache: bool):
     """
-    Return user's documents sorted by created_at (newest first).
-    Cosmos DB Mongo API doesn't allow sort on unindexed fields,
-    so we fetch first and then sort in Python.
+    Yield NDJSON events while the given (kind, index, config) items generate concurrently:
+      start -> delta* / item|error (one per item, in completion order) -> done
+    Workers persist each item themselves, so a dropped connection loses nothing;
+    the remaining items can be picked up with POST /{doc_id}/generate-stream.
     """
-    docs = list(
-        COLLECTIONS["documents"].find(
-            {"user_id": user.get("id")},
-            {"_id": 0}
-        )
+    events = queue.Queue()
+    workers = max(1, min(ai.AI_MAX_CONCURRENCY, len(items)))
+    yield _ndjson({
+        "event": "start",
+        "id": doc["id"],
+        "pages": [p.get("name") for p in doc.get("pages", [])],
+        "sections": [s.get("name") for s in doc.get("sections", [])],
+        "pending": len(items),
+    })
+
+    src = sources.load(doc)
+    retrieval.remember_index(src["raw_text_index"])
+    digest.remember_digest(src["raw_text_digest"])
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ai-stream")
+    generation.submit_items(pool, doc["id"], src["raw_text"], items, use_cache, events.put)
+    # don't block on shutdown: if the client goes away the workers still finish and persist
+    pool.shutdown(wait=False)
+
+    remaining = len(items)
+    while remaining:
+        event = events.get()
+        if event["event"] in ("item", "error"):
+            remaining -= 1
+        yield _ndjson(event)
+
+    final = generation.finalize_document(doc["id"], "generate", doc.get("user_id"))
+    yield _ndjson({"event": "done", "id": doc["id"], "document": _public_doc(final)})
+
+
+@router.post("/generate-stream")
+def generate_document_stream(payload: CreateDocumentRequest = Body(...), user=Depends(get_current_user)):
+    """
+    Same inputs as /generate, but streams each page/section (and its tokens) as NDJSON
+    the moment it is ready instead of returning once the whole document is done.
+    """
+    raw_text, pages_override, sections_override = _prepare_generation(payload, user)
+
+    db_doc = generation.new_document(user, raw_text, pages_override, sections_override)
+    upsert("documents", sources.externalize(db_doc))
+    items = generation.pending_items(db_doc)
+    return StreamingResponse(
+        _stream_generation(db_doc, items, not payload.bypass_cache),
+        media_type="application/x-ndjson",
     )
 
-    # ✅ Sort in Python (newest first)
-    docs.sort(
-        key=lambda x: x.get("created_at", ""),
-        reverse=True
-    )
 
-    return {"documents": docs}
+# Fields returned per document by /my-documents; bodies come from GET /{doc_id}
+_SUMMARY_PROJECTION = {
+    "_id": 0, "id": 1, "title": 1, "filename": 1, "created_at": 1, "updated_at": 1, "version": 1,
+    "generation_status": 1, "ocr_status": 1, "pages.name": 1, "sections.name": 1,
+}
+MY_DOCUMENTS_DEFAULT_LIMIT = 50
+MY_DOCUMENTS_MAX_LIMIT = 200
+
+
+def _summary(doc: dict) -> dict:
+    out = {k: v for k, v in doc.items() if k not in ("pages", "sections")}
+    out["page_count"] = len(doc.get("pages") or [])
+    out["section_count"] = len(doc.get("sections") or [])
+    return out
 
 
+def _encode_cursor(doc: dict) -> str:
+    raw = json.dumps([doc.get("created_at") or "", doc.get("id") or ""]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
 
 
+def _decode_cursor(cursor: str):
+    try:
+        created_at, doc_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return str(created_at), str(doc_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+@router.get("/my-documents")
+def list_user_documents(
+    limit: int = Query(MY_DOCUMENTS_DEFAULT_LIMIT, ge=1, le=MY_DOCUMENTS_MAX_LIMIT),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    q: Optional[str] = Query(None, description="Case-insensitive title/filename search"),
+    user=Depends(get_current_user),
+):
+    """
+    Return a page of the user's documents, newest first, as summaries
+    (id, title, filename, dates, version, status, page/section counts).
+
+    Keyset pagination on (created_at, id) served by the (user_id, created_at, id)
+    index; pass `next_cursor` back as `cursor` for the next page.
+    """
+    filters = [{"user_id": user.get("id")}]
+    if q and q.strip():
+        pattern = {"$regex": re.escape(q.strip()), "$options": "i"}
+        filters.append({"$or": [{"title": pattern}, {"filename": pattern}]})
+    if cursor:
+        created_at, doc_id = _decode_cursor(cursor)
+        filters.append({"$or": [
+            {"created_at": {"$lt": created_at}},
+            {"created_at": created_at, "id": {"$lt": doc_id}},
+        ]})
+    query = filters[0] if len(filters) == 1 else {"$and": filters}
+
+    coll = COLLECTIONS["documents"]
+    try:
+        docs = list(coll.find(query, _SUMMARY_PROJECTION).sort([("created_at", -1), ("id", -1)]).limit(limit + 1))
+    except OperationFailure:
+        # Cosmos DB Mongo API rejects sorts its indexes don't cover (e.g. before the
+        # index exists); sort the (small, projected) result in Python instead
+        logger.warning("[documents] my-documents sort not index-backed; sorting in Python")
+        docs = list(coll.find(query, _SUMMARY_PROJECTION))
+        docs.sort(key=lambda x: (x.get("created_at") or "", x.get("id") or ""), reverse=True)
+        docs = docs[: limit + 1]
+
+    has_more = len(docs) > limit
+    docs = docs[:limit]
+    return {
+        "documents": [_summary(d) for d in docs],
+        "next_cursor": _encode_cursor(docs[-1]) if has_more and docs else None,
+        "has_more": has_more,
+    }
+
+
+# -----------------
+# Background jobs
+# -----------------
+def _get_job_or_404(job_id: str, user: dict) -> dict:
+    job = jobs.get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    doc = find_by_id("documents", job.get("doc_id"))
+    allowed = _can_access_doc(user, doc) if doc else job.get("user_id") == user.get("id")
+    if not allowed and user.get("role") != "superadmin":
+        raise HTTPException(status_code=403, detail="Access denied")
+    return job
+
+
+@router.get("/jobs/{job_id}")
+def get_job(job_id: str, user=Depends(get_current_user)):
+    """Job status with per-item progress."""
+    return jobs.public_view(_get_job_or_404(job_id, user))
+
+
+@router.post("/jobs/{job_id}/cancel")
+def cancel_job(job_id: str, user=Depends(get_current_user)):
+    _get_job_or_404(job_id, user)
+    return jobs.public_view(jobs.cancel(job_id))
+
+
+@router.post("/jobs/{job_id}/retry")
+def retry_job(job_id: str, user=Depends(get_current_user)):
+    """Re-run only the failed items of a finished job."""
+    _get_job_or_404(job_id, user)
+    try:
+        job = jobs.retry_failed(job_id)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return jobs.public_view(job)
+
 
 from app.database import delete_by_id
 
@@ -268,44 +749,152 @@ def delete_document(doc_id: str, user=Depends(get_current_user)):
     ok = delete_by_id("documents", doc_id)
     if not ok:
         raise HTTPException(status_code=404, detail="Delete failed")
+    sources.release(doc.get("raw_text_ref"))
+    revisions.delete_history(doc_id)
 
     return {"message": "Document deleted", "id": doc_id}
 
 
 
 @router.get("/{doc_id}")
-def get_document(doc_id: str, user=Depends(get_current_user)):
+def get_document(doc_id: str, response: Response, user=Depends(get_current_user)):
     doc = find_by_id("documents", doc_id)
+    if not doc:
+        raise HTTPException(status_code=404, detail="Document not found")
+    if not _can_access_doc(user, doc):
+        raise HTTPException(status_code=403, detail="Access denied")
+    response.headers["ETag"] = _etag(doc.get("version"))
+    return _public_doc(sources.hydrate(doc))
+
+# -----------------
+# Version history
+# -----------------
+def _get_accessible_doc(doc_id: str, user: dict) -> dict:
+    doc = COLLECTIONS["documents"].find_one({"id": doc_id}, {**_ACCESS_PROJECTION, "version": 1})
     if not doc:
         raise HTTPException(status_code=404, detail="Document not found")
     if not _can_access_doc(user, doc):
         raise HTTPException(status_code=403, detail="Access denied")
     return doc
 
+
+@router.get("/{doc_id}/revisions")
+def list_document_revisions(doc_id: str, user=Depends(get_current_user)):
+    """Recorded versions, newest first (metadata only)."""
+    doc = _get_accessible_doc(doc_id, user)
+    return {"id": doc_id, "version": doc.get("version", 1), "revisions": revisions.list_revisions(doc_id)}
+
+
+@router.get("/{doc_id}/revisions/{version}")
+def get_document_revision(doc_id: str, version: int, user=Depends(get_current_user)):
+    """Title, pages and sections as of `version`, rebuilt from the nearest checkpoint and the deltas after it."""
+    _get_accessible_doc(doc_id, user)
+    state = revisions.reconstruct(doc_id, version)
+    if state is None:
+        raise HTTPException(status_code=404, detail="Version not found")
+    return state
+
+
+@router.get("/{doc_id}/diff")
+def diff_document_versions(
+    doc_id: str,
+    from_version: int = Query(..., ge=1),
+    to_version: Optional[int] = Query(None, ge=1, description="Defaults to the current version"),
+    user=Depends(get_current_user),
+):
+    doc = _get_accessible_doc(doc_id, user)
+    to_version = to_version or doc.get("version", 1)
+    old = revisions.reconstruct(doc_id, from_version)
+    new = revisions.reconstruct(doc_id, to_version)
+    if old is None or new is None:
+        raise HTTPException(status_code=404, detail="Version not found")
+    return revisions.diff(old, new)
+
+
+@router.post("/{doc_id}/generate-stream")
+def resume_document_stream(doc_id: str, bypass_cache: bool = Query(False), user=Depends(get_current_user)):
+    """Resume an interrupted /generate-stream: only pages/sections still pending are generated."""
+    doc = find_by_id("documents", doc_id)
+    if not doc:
+        raise HTTPException(status_code=404, detail="Document not found")
+    if not _can_access_doc(user, doc):
+        raise HTTPException(status_code=403, detail="Access denied")
+
+    items = generation.pending_items(doc)
+    return StreamingResponse(
+        _stream_generation(doc, items, not bypass_cache),
+        media_type="application/x-ndjson",
+    )
+
 # -----------------
-# Regenerate Section
+# Regeneration: the database side
 # -----------------
-@router.post("/{doc_id}/regenerate-section")
-async def regenerate_section(doc_id: str, payload: RegenerateSectionRequest = Body(...), user=Depends(get_current_user)):
+# The regenerate handlers are async; these do their blocking pymongo round trips
+# (lookups, the conditional write, revision bookkeeping) and are called through
+# asyncio.to_thread so the event loop keeps serving while Mongo answers.
+def _regeneration_target(doc_id: str, user: dict, kind: str, name: str,
+                         explicit_version: Optional[int], if_match: Optional[str]):
+    """
+    (document, its page/section `name`, version the write is conditioned on): the
+    client's version rebased onto the current one, or the one just read.
+    """
     doc = find_by_id("documents", doc_id)
     if not doc:
         raise HTTPException(status_code=404, detail="Document not found")
     if not _can_access_doc(user, doc):
         raise HTTPException(status_code=403, detail="Access denied")
 
-    section = next((s for s in doc.get("sections", []) if s.get("name") == payload.section_name), None)
-    if not section:
-        raise HTTPException(status_code=404, detail="Section not found")
+    item = next((i for i in doc.get(f"{kind}s", []) if i.get("name") == name), None)
+    if not item:
+        raise HTTPException(status_code=404, detail=f"{kind.capitalize()} not found")
+
+    # the write is conditioned on the version this regeneration is based on: the
+    # client's, or the one just read (the AI call can take a while)
+    expected = _expected_version(explicit_version, if_match)
+    if expected is not None and expected != (doc.get("version") or 1):
+        expected = _rebase(doc_id, kind, item.get("name"), expected, doc.get("version") or 1)
+    return doc, item, expected or (doc.get("version") or 1)
+
 
-    raw_text = (payload.raw_text or doc.get("raw_text", "") or "").strip()
+def _save_regenerated_item(doc: dict, src: dict, full_text: str, kind: str, name: str,
+                           fields: dict, expected: int, user_id: Optional[str]) -> dict:
+    """Write a regenerated page/section (compare-and-swap on `expected`) and record the revision."""
+    _store_digest(doc, src, full_text)
+    revisions.ensure_baseline(doc["id"], doc)
+    updated = _update_item(doc["id"], f"{kind}s", name, fields, expected_version=expected)
+    revisions.record_change(updated, [(kind, name)], f"regenerate_{kind}", user_id)
+    return updated
+
+
+# -----------------
+# Regenerate Section
+# -----------------
+@router.post("/{doc_id}/regenerate-section")
+async def regenerate_section(
+    doc_id: str,
+    response: Response,
+    payload: RegenerateSectionRequest = Body(...),
+    if_match: Optional[str] = Header(None, alias="If-Match"),
+    user=Depends(get_current_user),
+):
+    doc, section, expected = await asyncio.to_thread(
+        _regeneration_target, doc_id, user, "section", payload.section_name, payload.expected_version, if_match
+    )
+
+    src = await asyncio.to_thread(sources.load, doc)
+    full_text = (payload.raw_text or src["raw_text"]).strip()
+    retrieval.remember_index(src["raw_text_index"])
+    digest.remember_digest(src["raw_text_digest"])
+    raw_text = await asyncio.to_thread(ai._context_for, section, full_text, payload.user_instruction or "")
 
     try:
         prompt_to_use = section.get("editable_prompt") or section.get("generated_prompt") or ai._build_section_prompt(section)
-        ai_resp = ai.regenerate_section(
+        ai_resp = await ai_async.regenerate_section(
             raw_text,
             section.get("content"),
             payload.user_instruction,
-            prompt_to_use
+            prompt_to_use,
+            use_cache=not payload.bypass_cache,
         )
     except Exception:
         logger.exception("AI regenerate_section call failed")
@@ -336,50 +925,51 @@ async def regenerate_section(doc_id: str, payload: RegenerateSectionRequest = Bo
     if not isinstance(new_section, dict):
         new_section = {"content": str(new_section), "prompt_used": prompt_to_use}
 
-    for i, s in enumerate(doc.get("sections", [])):
-        if s.get("name") == section.get("name"):
-            doc["sections"][i].update({
-                "content": new_section.get("content"),
-                "prompt_used": new_section.get("prompt_used", prompt_to_use),
-                "generated_prompt": section.get("generated_prompt"),
-                "editable_prompt": section.get("editable_prompt") or section.get("generated_prompt"),
-                "user_instruction": payload.user_instruction,
-                "last_regenerated_at": datetime.datetime.utcnow().isoformat(),
-                "manually_edited": False,
-                "prompt_last_updated_at": datetime.datetime.utcnow().isoformat(),
-            })
-            break
-
-    doc["version"] = doc.get("version", 1) + 1
-    doc["updated_at"] = datetime.datetime.utcnow().isoformat()
-    upsert("documents", doc)
-    return {"message": "Section regenerated", "document": doc}
+    updated = await asyncio.to_thread(_save_regenerated_item, doc, src, full_text, "section", section.get("name"), {
+        "content": new_section.get("content"),
+        "prompt_used": new_section.get("prompt_used", prompt_to_use),
+        "token_usage": new_section.get("token_usage"),
+        "generated_prompt": section.get("generated_prompt"),
+        "editable_prompt": section.get("editable_prompt") or section.get("generated_prompt"),
+        "user_instruction": payload.user_instruction,
+        "last_regenerated_at": datetime.datetime.utcnow().isoformat(),
+        "manually_edited": False,
+        "prompt_last_updated_at": datetime.datetime.utcnow().isoformat(),
+    }, expected, user.get("id"))
+    response.headers["ETag"] = _etag(updated.get("version"))
+    return {"message": "Section regenerated", "document": updated}
 
 # -----------------
 # Regenerate Page
 # -----------------
 @router.post("/{doc_id}/regenerate-page")
-async def regenerate_page(doc_id: str, payload: RegeneratePageRequest = Body(...), user=Depends(get_current_user)):
-    doc = find_by_id("documents", doc_id)
-    if not doc:
-        raise HTTPException(status_code=404, detail="Document not found")
-    if not _can_access_doc(user, doc):
-        raise HTTPException(status_code=403, detail="Access denied")
-
-    page = next((p for p in doc.get("pages", []) if p.get("name") == payload.page_name), None)
-    if not page:
-        raise HTTPException(status_code=404, detail="Page not found")
+async def regenerate_page(
+    doc_id: str,
+    response: Response,
+    payload: RegeneratePageRequest = Body(...),
+    if_match: Optional[str] = Header(None, alias="If-Match"),
+    user=Depends(get_current_user),
+):
+    doc, page, expected = await asyncio.to_thread(
+        _regeneration_target, doc_id, user, "page", payload.page_name, payload.expected_version, if_match
+    )
 
-    raw_text = (payload.raw_text or doc.get("raw_text", "") or "").strip()
+    src = await asyncio.to_thread(sources.load, doc)
+    full_text = (payload.raw_text or src["raw_text"]).strip()
+    retrieval.remember_index(src["raw_text_index"])
+    digest.remember_digest(src["raw_text_digest"])
+    raw_text = await asyncio.to_thread(ai._context_for, page, full_text, payload.user_instruction or "")
     try:
-        author_role = (_get_user_config(user).get("created_by") or _get_user_config(user).get("document_type")) if _get_user_config(user) else None
+        user_cfg = await asyncio.to_thread(_get_user_config, user)
+        author_role = (user_cfg.get("created_by") or user_cfg.get("document_type")) if user_cfg else None
         prompt_to_use = page.get("editable_prompt") or page.get("generated_prompt") or ai._build_page_prompt({**page, "created_by": author_role})
 
-        ai_resp = ai.regenerate_page(
+        ai_resp = await ai_async.regenerate_page(
             raw_text,
             page.get("content"),
             payload.user_instruction,
-            prompt_to_use
+            prompt_to_use,
+            use_cache=not payload.bypass_cache,
         )
     except Exception:
         logger.exception("AI regenerate_page call failed")
@@ -403,43 +993,26 @@ async def regenerate_page(doc_id: str, payload: RegeneratePageRequest = Body(...
         logger.exception("Failed to parse AI response while regenerating page.")
         new_page = {"content": "AI error", "prompt_used": prompt_to_use}
 
-    for i, p in enumerate(doc.get("pages", [])):
-        if p.get("name") == page.get("name"):
-            doc["pages"][i].update({
-                "content": new_page.get("content"),
-                "prompt_used": new_page.get("prompt_used", prompt_to_use),
-                "generated_prompt": page.get("generated_prompt"),
-                "editable_prompt": page.get("editable_prompt") or page.get("generated_prompt"),
-                "user_instruction": payload.user_instruction,
-                "last_regenerated_at": datetime.datetime.utcnow().isoformat(),
-                "manually_edited": False,
-                "prompt_last_updated_at": datetime.datetime.utcnow().isoformat(),
-            })
-            break
-
-    doc["version"] = doc.get("version", 1) + 1
-    doc["updated_at"] = datetime.datetime.utcnow().isoformat()
-    upsert("documents", doc)
-    return {"message": "Page regenerated", "document": doc}
+    updated = await asyncio.to_thread(_save_regenerated_item, doc, src, full_text, "page", page.get("name"), {
+        "content": new_page.get("content"),
+        "prompt_used": new_page.get("prompt_used", prompt_to_use),
+        "token_usage": new_page.get("token_usage"),
+        "generated_prompt": page.get("generated_prompt"),
+        "editable_prompt": page.get("editable_prompt") or page.get("generated_prompt"),
+        "user_instruction": payload.user_instruction,
+        "last_regenerated_at": datetime.datetime.utcnow().isoformat(),
+        "manually_edited": False,
+        "prompt_last_updated_at": datetime.datetime.utcnow().isoformat(),
+    }, expected, user.get("id"))
+    response.headers["ETag"] = _etag(updated.get("version"))
+    return {"message": "Page regenerated", "document": updated}
 
 
 # -----------------
 # Regenerate Document
 # -----------------
-@router.post("/{doc_id}/regenerate-document")
-async def regenerate_document(
-    doc_id: str,
-    payload: RegenerateDocumentRequest = Body(...),
-    user=Depends(get_current_user)
-):
-    doc = find_by_id("documents", doc_id)
-    if not doc:
-        raise HTTPException(status_code=404, detail="Document not found")
-    if not _can_access_doc(user, doc):
-        raise HTTPException(status_code=403, detail="Access denied")
-
-    raw_text = (payload.raw_text or doc.get("raw_text", "") or "").strip()
-
+def _regeneration_overrides(doc: dict, user: dict):
+    """Rebuild page/section configs (with fresh prompts unless manually edited) from a stored document."""
     pages_override = []
     # get document_type from stored config (if any)
     user_config = _get_user_config(user)
@@ -518,12 +1091,83 @@ async def regenerate_document(
             sec_copy["generated_prompt"] = s.get("generated_prompt") or s.get("instruction") or ""
         sections_override.append(sec_copy)
 
+    return pages_override, sections_override
+
+
+def _queue_document_regeneration(doc: dict, new_text: Optional[str], items: list, user_id: Optional[str],
+                                 use_cache: bool, base_version: int) -> dict:
+    """Enqueue a background regenerate_document job (storing `new_text` first, if given)."""
+    if new_text is not None:
+        # jobs read raw_text from the stored document
+        # the old digest no longer matches; the job builds a new one on first use
+        sources.replace_text(doc["id"], new_text, retrieval.ensure_index(new_text))
+    # the job rewrites items one by one (each a new version): keep the current one restorable
+    revisions.ensure_baseline(doc["id"], doc)
+    return jobs.enqueue("regenerate_document", doc["id"], user_id, items,
+                        use_cache=use_cache, base_version=base_version)
+
+
+def _save_regenerated_document(doc: dict, src: dict, raw_text: str, fields: dict, current_version: int,
+                               user_id: Optional[str]) -> dict:
+    """
+    Write the regenerated fields if the document is still at `current_version` (409
+    otherwise), checkpoint the new version, and return it hydrated.
+    """
+    revisions.ensure_baseline(doc["id"], doc)
+    # only the regenerated fields: the source text stays where it is; and only
+    # if nobody saved or regenerated anything while the AI was running
+    if not update_fields("documents", doc["id"], fields, expected_version=current_version):
+        latest = COLLECTIONS["documents"].find_one({"id": doc["id"]}, {"_id": 0, "version": 1}) or {}
+        raise _conflict(latest.get("version") or 1)
+    doc = {**doc, **fields}
+    revisions.checkpoint(doc, "regenerate_document", user_id)
+    _store_digest(doc, src, raw_text)
+    return sources.hydrate(doc)
+
+
+@router.post("/{doc_id}/regenerate-document")
+async def regenerate_document(
+    doc_id: str,
+    payload: RegenerateDocumentRequest = Body(...),
+    background: bool = Query(False, description="Queue a background job and return its id immediately"),
+    if_match: Optional[str] = Header(None, alias="If-Match"),
+    user=Depends(get_current_user)
+):
+    doc = await asyncio.to_thread(find_by_id, "documents", doc_id)
+    if not doc:
+        raise HTTPException(status_code=404, detail="Document not found")
+    if not _can_access_doc(user, doc):
+        raise HTTPException(status_code=403, detail="Access denied")
+    # rewrites every item, so any write since the client's version is a conflict
+    current_version = doc.get("version") or 1
+    expected = _expected_version(payload.expected_version, if_match)
+    if expected is not None and expected != current_version:
+        raise _conflict(current_version)
+
+    src = await asyncio.to_thread(sources.load, doc)
+    raw_text = (payload.raw_text or src["raw_text"]).strip()
+    retrieval.remember_index(src["raw_text_index"])
+    digest.remember_digest(src["raw_text_digest"])
+    pages_override, sections_override = await asyncio.to_thread(_regeneration_overrides, doc, user)
+
+    if background:
+        items = [("page", i, p) for i, p in enumerate(pages_override)] + \
+                [("section", i, s) for i, s in enumerate(sections_override)]
+        new_text = raw_text if payload.raw_text and payload.raw_text.strip() != src["raw_text"].strip() else None
+        job = await asyncio.to_thread(
+            _queue_document_regeneration, doc, new_text, items, user.get("id"),
+            not payload.bypass_cache, current_version,
+        )
+        return JSONResponse(status_code=202, content={
+            "message": "Document regeneration queued", "id": doc_id, "job_id": job["id"], "job": job,
+        })
+
     # -----------------
     # Call AI
     # -----------------
     try:
-        ai_resp_str = ai.generate_document_from_template(
-            {}, raw_text, pages_override, sections_override
+        ai_resp_str = await ai_async.generate_document_from_template(
+            {}, raw_text, pages_override, sections_override, use_cache=not payload.bypass_cache
         )
     except Exception:
         logger.exception("AI generate_document_from_template call failed")
@@ -535,17 +1179,15 @@ async def regenerate_document(
         logger.exception("AI returned invalid JSON during regenerate_document.")
         raise HTTPException(status_code=500, detail="AI returned invalid JSON")
 
-    doc.update(
-        {
-            "title": doc_json.get("title", doc.get("title")),
-            "pages": doc_json.get("pages", doc.get("pages")),
-            "sections": doc_json.get("sections", doc.get("sections")),
-            "version": doc.get("version", 1) + 1,
-            "updated_at": datetime.datetime.utcnow().isoformat(),
-        }
-    )
-    upsert("documents", doc)
-    return {"message": "Document regenerated", "document": doc}
+    fields = {
+        "title": doc_json.get("title", doc.get("title")),
+        "pages": doc_json.get("pages", doc.get("pages")),
+        "sections": doc_json.get("sections", doc.get("sections")),
+        "version": current_version + 1,
+        "updated_at": datetime.datetime.utcnow().isoformat(),
+    }
+    doc = await asyncio.to_thread(_save_regenerated_document, doc, src, raw_text, fields, current_version, user.get("id"))
+    return {"message": "Document regenerated", "document": _public_doc(doc)}
 
 
 
@@ -692,61 +1334,67 @@ def _normalize_content(content):
 
 
 @router.post("/{doc_id}/save-section")
-def save_section(doc_id: str, payload: dict = Body(...), user=Depends(get_current_user)):
+def save_section(
+    doc_id: str,
+    response: Response,
+    payload: dict = Body(...),
+    if_match: Optional[str] = Header(None, alias="If-Match"),
+    user=Depends(get_current_user),
+):
     section_name = payload.get("section_name")
     content = payload.get("content", "")
 
     if not section_name:
         raise HTTPException(status_code=400, detail="section_name is required")
 
-    doc = find_by_id("documents", doc_id)
+    # ownership fields only: the update itself is a targeted $set
+    doc = COLLECTIONS["documents"].find_one({"id": doc_id}, _ACCESS_PROJECTION)
     if not doc:
         raise HTTPException(status_code=404, detail="Document not found")
     if not _can_access_doc(user, doc):
         raise HTTPException(status_code=403, detail="Access denied")
 
-    for i, s in enumerate(doc.get("sections", [])):
-        if s.get("name") == section_name:
-            doc["sections"][i]["content"] = _normalize_content(content)
-            doc["sections"][i]["manually_edited"] = True
-            doc["sections"][i]["last_saved_at"] = datetime.datetime.utcnow().isoformat()
-            break
-    else:
-        raise HTTPException(status_code=404, detail="Section not found")
-
-    doc["version"] = doc.get("version", 1) + 1
-    doc["updated_at"] = datetime.datetime.utcnow().isoformat()
-    upsert("documents", doc)
-    return {"message": "Section saved", "document": doc}
+    revisions.ensure_baseline(doc_id)
+    updated = _update_item(doc_id, "sections", section_name, {
+        "content": _normalize_content(content),
+        "manually_edited": True,
+        "last_saved_at": datetime.datetime.utcnow().isoformat(),
+    }, expected_version=_expected_version(payload.get("expected_version"), if_match))
+    revisions.record_change(updated, [("section", section_name)], "save_section", user.get("id"))
+    response.headers["ETag"] = _etag(updated.get("version"))
+    return {"message": "Section saved", "document": updated}
 
 
 # ---------------------------
 # Save Page
 # ---------------------------
 @router.post("/{doc_id}/save-page")
-def save_page(doc_id: str, payload: dict = Body(...), user=Depends(get_current_user)):
+def save_page(
+    doc_id: str,
+    response: Response,
+    payload: dict = Body(...),
+    if_match: Optional[str] = Header(None, alias="If-Match"),
+    user=Depends(get_current_user),
+):
     page_name = payload.get("page_name")
     content = payload.get("content", "")
 
     if not page_name:
         raise HTTPException(status_code=400, detail="page_name is required")
 
-    doc = find_by_id("documents", doc_id)
+    # ownership fields only: the update itself is a targeted $set
+    doc = COLLECTIONS["documents"].find_one({"id": doc_id}, _ACCESS_PROJECTION)
     if not doc:
         raise HTTPException(status_code=404, detail="Document not found")
     if not _can_access_doc(user, doc):
         raise HTTPException(status_code=403, detail="Access denied")
 
-    for i, p in enumerate(doc.get("pages", [])):
-        if p.get("name") == page_name:
-            doc["pages"][i]["content"] = _normalize_content(content)
-            doc["pages"][i]["manually_edited"] = True
-            doc["pages"][i]["last_saved_at"] = datetime.datetime.utcnow().isoformat()
-            break
-    else:
-        raise HTTPException(status_code=404, detail="Page not found")
-
-    doc["version"] = doc.get("version", 1) + 1
-    doc["updated_at"] = datetime.datetime.utcnow().isoformat()
-    upsert("documents", doc)
-    return {"message": "Page saved", "document": doc}
\ No newline at end of file
+    revisions.ensure_baseline(doc_id)
+    updated = _update_item(doc_id, "pages", page_name, {
+        "content": _normalize_content(content),
+        "manually_edited": True,
+        "last_saved_at": datetime.datetime.utcnow().isoformat(),
+    }, expected_version=_expected_version(payload.get("expected_version"), if_match))
+    revisions.record_change(updated, [("page", page_name)], "save_page", user.get("id"))
+    response.headers["ETag"] = _etag(updated.get("version"))
+    return {"message": "Page saved", "document": updated}
\ No newline at end of file
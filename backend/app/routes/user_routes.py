@@ -5,8 +5,9 @@ import uuid
 import random
 import string
 
-from app.database import read_all, find_by_id, upsert, delete_by_id
+from app.database import read_all, find_by_id, upsert, delete_by_id, COLLECTIONS
 from app.auth import get_current_user, require_role, create_token
+from app import lookups, user_repo
 
 router = APIRouter(tags=["users"])
 
@@ -46,8 +47,7 @@ def create_user(payload: Dict = Body(...), user=Depends(require_role(["admin", "
     if not email:
         raise HTTPException(status_code=400, detail="Email required")
 
-    existing = [u for u in read_all("users") if (u.get("email") or "").lower() == email]
-    if existing:
+    if user_repo.email_taken(email):
         raise HTTPException(status_code=400, detail="Email already registered")
 
     company_id = payload.get("company_id")
@@ -67,7 +67,10 @@ def create_user(payload: Dict = Body(...), user=Depends(require_role(["admin", "
         "company_id": company_id,
         "created_by": user.get("id"),
     }
-    upsert("users", obj)
+    try:
+        user_repo.save(obj)
+    except user_repo.EmailTaken:
+        raise HTTPException(status_code=400, detail="Email already registered")
     return {"message": "created", "user": obj}
 
 
@@ -82,7 +85,7 @@ def signup(payload: Dict = Body(...)):
     if not email:
         raise HTTPException(status_code=400, detail="Email required")
 
-    if any((x.get("email") or "").lower() == email for x in read_all("users")):
+    if user_repo.email_taken(email):
         raise HTTPException(status_code=400, detail="Email already used")
 
     password = payload.get("password") or _rand_password(10)
@@ -96,7 +99,10 @@ def signup(payload: Dict = Body(...)):
         "company_id": None,
         "created_by": uid,
     }
-    upsert("users", user_obj)
+    try:
+        user_repo.save(user_obj)
+    except user_repo.EmailTaken:
+        raise HTTPException(status_code=400, detail="Email already used")
 
     token = create_token(user_obj)
     user_out = {k: v for k, v in user_obj.items() if k != "password"}
@@ -112,11 +118,7 @@ def login(payload: Dict = Body(...)):
     """
     email = (payload.get("email") or "").strip().lower()
     password = payload.get("password") or ""
-    users = read_all("users")
-    found = next(
-        (u for u in users if (u.get("email") or "").lower() == email and u.get("password") == password),
-        None,
-    )
+    found = user_repo.authenticate(email, password)
     if not found:
         raise HTTPException(status_code=401, detail="Invalid credentials")
 
@@ -150,11 +152,7 @@ def update_user(user_id: str, payload: Dict = Body(...), user=Depends(get_curren
         new_email = (payload.get("email") or "").strip().lower()
         if not new_email:
             raise HTTPException(status_code=400, detail="Email cannot be empty")
-        duplicates = [
-            x for x in read_all("users")
-            if (x.get("email") or "").lower() == new_email and x.get("id") != user_id
-        ]
-        if duplicates:
+        if user_repo.email_taken(new_email, exclude_id=user_id):
             raise HTTPException(status_code=400, detail="Email already used by another user")
         u["email"] = new_email
 
@@ -176,13 +174,17 @@ def update_user(user_id: str, payload: Dict = Body(...), user=Depends(get_curren
         u["company_id"] = company_id
 
     u["updated_by"] = user.get("id")
-    upsert("users", u)
+    try:
+        user_repo.save(u)
+    except user_repo.EmailTaken:
+        raise HTTPException(status_code=400, detail="Email already used by another user")
     return {"message": "updated", "user": u}
 
 
 @router.delete("/{user_id}")
 def delete_user(user_id: str, user=Depends(require_role(["admin", "superadmin"]))):
     ok = delete_by_id("users", user_id)
+    lookups.invalidate_user(user_id)
     if not ok:
         raise HTTPException(status_code=404, detail="User not found")
     return {"message": "deleted"}
@@ -192,8 +194,7 @@ def seed_superadmin():
     TEMPORARY: Seed a default superadmin user if none exists.
     WARNING: Remove this after first use!
     """
-    users = read_all("users")
-    if any(u.get("role") == "superadmin" for u in users):
+    if COLLECTIONS["users"].find_one({"role": "superadmin"}, {"_id": 0, "id": 1}):
         return {"message": "Superadmin already exists"}
 
     uid = str(uuid.uuid4())
@@ -0,0 +1,230 @@
+# backend/app/sources.py
+"""
+Content store for a document's source text.
+
+`documents` records no longer embed the extracted raw_text (plus its retrieval
+index and digest); they carry `raw_text_ref`, the SHA-256 of the text, and
+`raw_text_chars`. The text lives once per distinct content in the source store,
+so listing, saving and editing documents never move it, and two documents
+built from the same text share one entry.
+
+Only generation / regeneration (and GET /{doc_id}) load it, via load().
+Records written before the split still have the fields inline; load() reads those as-is.
+
+  SOURCE_STORE      "mongo" (default: the document_sources collection) | "disk"
+  SOURCE_STORE_DIR  directory for the disk backend (one JSON file per text); defaults
+                    under DOCGEN_DATA_DIR (app/cache.py) - set one of them to persistent
+                    storage, the temp-directory fallback does not survive a restart
+"""
+import os
+import json
+import hashlib
+import logging
+import datetime
+import threading
+from typing import Optional
+
+from app.cache import data_dir
+
+logger = logging.getLogger(__name__)
+
+SOURCE_STORE = os.getenv("SOURCE_STORE", "mongo").strip().lower()
+SOURCE_STORE_DIR = os.getenv("SOURCE_STORE_DIR") or data_dir("sources")
+
+# Fields moved out of `documents` into the store
+TEXT_FIELDS = ("raw_text", "raw_text_index", "raw_text_digest")
+
+
+def _now() -> str:
+    return datetime.datetime.utcnow().isoformat()
+
+
+def key_for(text: str) -> str:
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()
+
+
+class MongoSourceStore:
+    """Entries in COLLECTIONS["document_sources"] as {id, raw_text, raw_text_index, raw_text_digest, chars, created_at}."""
+    name = "mongo"
+
+    def _coll(self):
+        # imported lazily: app.database connects to Mongo at import time
+        from app.database import COLLECTIONS
+        return COLLECTIONS["document_sources"]
+
+    def put(self, ref: str, text: str, fields: dict):
+        from app.database import encode_fields
+
+        # raw_text is stored compressed above DB_COMPRESS_MIN_BYTES (app/database.py codec)
+        new = encode_fields("document_sources", {"raw_text": text, "chars": len(text), "created_at": _now()})
+        update = {"$setOnInsert": new}
+        if fields:
+            update["$set"] = fields
+        self._coll().update_one({"id": ref}, update, upsert=True)
+
+    def get(self, ref: str, with_text: bool = True) -> Optional[dict]:
+        from app.database import decode_fields
+
+        projection = {"_id": 0} if with_text else {"_id": 0, "raw_text": 0}
+        return decode_fields(self._coll().find_one({"id": ref}, projection))
+
+    def update(self, ref: str, fields: dict):
+        self._coll().update_one({"id": ref}, {"$set": fields})
+
+    def delete(self, ref: str):
+        self._coll().delete_one({"id": ref})
+
+
+class DiskSourceStore:
+    """One JSON file per text, sharded into sub-directories by key prefix."""
+    name = "disk"
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, ref: str) -> str:
+        return os.path.join(self.directory, ref[:2], f"{ref}.json")
+
+    def _write(self, ref: str, entry: dict):
+        path = self._path(ref)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(tmp, path)  # atomic, so readers never see half a file
+
+    def put(self, ref: str, text: str, fields: dict):
+        with self._lock:
+            entry = self.get(ref) or {"id": ref, "raw_text": text, "chars": len(text), "created_at": _now()}
+            entry.update(fields)
+            self._write(ref, entry)
+
+    def get(self, ref: str, with_text: bool = True) -> Optional[dict]:
+        try:
+            with open(self._path(ref), "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            return None
+        if not with_text:
+            entry.pop("raw_text", None)
+        return entry
+
+    def update(self, ref: str, fields: dict):
+        with self._lock:
+            entry = self.get(ref)
+            if entry is not None:
+                entry.update(fields)
+                self._write(ref, entry)
+
+    def delete(self, ref: str):
+        try:
+            os.remove(self._path(ref))
+        except FileNotFoundError:
+            pass
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            if SOURCE_STORE == "disk":
+                if not (os.getenv("SOURCE_STORE_DIR") or os.getenv("DOCGEN_DATA_DIR")):
+                    logger.warning("[sources] Disk source store in %s (temp directory): set SOURCE_STORE_DIR "
+                                   "or DOCGEN_DATA_DIR to persistent storage", SOURCE_STORE_DIR)
+                _store = DiskSourceStore(SOURCE_STORE_DIR)
+            else:
+                _store = MongoSourceStore()
+        return _store
+
+
+# -----------------------
+# documents <-> store
+# -----------------------
+def put(text: str, index: Optional[dict] = None, digest: Optional[dict] = None) -> Optional[str]:
+    """Store `text` (and its index / digest when given); returns its ref, or None for empty text."""
+    if not text:
+        return None
+    ref = key_for(text)
+    fields = {k: v for k, v in (("raw_text_index", index), ("raw_text_digest", digest)) if v is not None}
+    get_store().put(ref, text, fields)
+    return ref
+
+
+def externalize(record: dict) -> dict:
+    """
+    Copy of a documents record (or field update) with raw_text / raw_text_index /
+    raw_text_digest moved to the store and replaced by raw_text_ref + raw_text_chars.
+    Records without a "raw_text" key are returned unchanged.
+    """
+    if "raw_text" not in record:
+        return record
+    out = {k: v for k, v in record.items() if k not in TEXT_FIELDS}
+    text = record.get("raw_text") or ""
+    out["raw_text_ref"] = put(text, record.get("raw_text_index"), record.get("raw_text_digest"))
+    out["raw_text_chars"] = len(text)
+    return out
+
+
+def load(doc: Optional[dict], with_text: bool = True) -> dict:
+    """
+    {"raw_text", "raw_text_index", "raw_text_digest"} for a documents record: inline
+    values when present (older records, or records still in memory), else from the store.
+    """
+    out = {"raw_text": "", "raw_text_index": None, "raw_text_digest": None}
+    if not doc:
+        return out
+    if "raw_text" in doc or not doc.get("raw_text_ref"):
+        out.update({k: doc.get(k) for k in TEXT_FIELDS})
+        out["raw_text"] = out["raw_text"] or ""
+        return out
+    entry = get_store().get(doc["raw_text_ref"], with_text=with_text)
+    if entry is None:
+        logger.warning("[sources] missing source %s for document %s", doc["raw_text_ref"], doc.get("id"))
+        return out
+    out.update({k: entry.get(k) for k in TEXT_FIELDS if k in entry})
+    out["raw_text"] = out["raw_text"] or ""
+    return out
+
+
+def hydrate(doc: Optional[dict]) -> Optional[dict]:
+    """The record with raw_text filled back in, for clients that expect it inline."""
+    if not doc or "raw_text" in doc or not doc.get("raw_text_ref"):
+        return doc
+    return {**doc, "raw_text": load(doc)["raw_text"]}
+
+
+def store_digest(doc: dict, built: dict):
+    """Persist a digest built for the document's source text."""
+    from app.database import update_fields
+
+    if doc.get("raw_text_ref") and "raw_text" not in doc:
+        get_store().update(doc["raw_text_ref"], {"raw_text_digest": built})
+    else:
+        update_fields("documents", doc["id"], {"raw_text_digest": built})
+
+
+def replace_text(doc_id: str, text: str, index: Optional[dict] = None):
+    """Point a stored document at new source text, dropping any inline copy of the old one."""
+    from app.database import COLLECTIONS
+
+    fields = externalize({"raw_text": text, "raw_text_index": index})
+    COLLECTIONS["documents"].update_one(
+        {"id": doc_id},
+        {"$set": fields, "$unset": {k: "" for k in TEXT_FIELDS}},
+    )
+
+
+def release(ref: Optional[str]):
+    """Drop a source once no document references it any more."""
+    from app.database import COLLECTIONS
+
+    if not ref:
+        return
+    if COLLECTIONS["documents"].find_one({"raw_text_ref": ref}, {"_id": 0, "id": 1}) is None:
+        get_store().delete(ref)
@@ -0,0 +1,124 @@
+# backend/app/tokens.py
+"""
+Local token accounting for LLM calls.
+
+Counts use tiktoken when it is installed (no network call once the encoding
+is cached); otherwise a ~4 characters/token estimate. Context budgets are
+per deployment:
+
+  AI_CONTEXT_TOKENS   default context window (tokens)
+  AI_CONTEXT_BUDGETS  JSON map of deployment/model -> context window,
+                      e.g. {"gpt-4o-prod": 128000, "gpt-35-turbo": 16000}
+  AI_RESPONSE_TOKENS  tokens reserved for the completion
+
+Counts of large texts (a document's raw_text or digest, which every page/section
+of a generation measures) are memoised by content hash, so each is tokenized once.
+"""
+import os
+import json
+import hashlib
+import logging
+import threading
+from typing import Optional
+
+from app.cache import MemoryCache
+
+logger = logging.getLogger(__name__)
+
+AI_CONTEXT_TOKENS = int(os.getenv("AI_CONTEXT_TOKENS", "128000"))
+AI_RESPONSE_TOKENS = int(os.getenv("AI_RESPONSE_TOKENS", "4096"))
+# texts at least this long have their token count memoised
+TOKEN_COUNT_CACHE_MIN_CHARS = int(os.getenv("TOKEN_COUNT_CACHE_MIN_CHARS", "20000"))
+# Chat framing overhead per message (role markers etc.)
+_TOKENS_PER_MESSAGE = 4
+
+try:
+    _CONTEXT_BUDGETS = {k: int(v) for k, v in json.loads(os.getenv("AI_CONTEXT_BUDGETS") or "{}").items()}
+except Exception as e:
+    logger.warning("[tokens] Ignoring invalid AI_CONTEXT_BUDGETS: %s", e)
+    _CONTEXT_BUDGETS = {}
+
+_encoders = {}
+_encoders_lock = threading.Lock()
+
+_count_cache = MemoryCache(max_entries=int(os.getenv("TOKEN_COUNT_CACHE_SIZE", "256")))
+
+
+def _encoder(model: Optional[str]):
+    """tiktoken encoding for `model`, or None when tiktoken is unavailable."""
+    key = model or ""
+    with _encoders_lock:
+        if key in _encoders:
+            return _encoders[key]
+        enc = None
+        try:
+            import tiktoken
+            try:
+                enc = tiktoken.encoding_for_model(model) if model else None
+            except KeyError:
+                enc = None  # Azure deployment names are arbitrary
+            if enc is None:
+                enc = tiktoken.get_encoding("o200k_base")
+        except Exception as e:
+            logger.info("[tokens] tiktoken unavailable, using estimate: %s", e)
+            enc = None
+        _encoders[key] = enc
+        return enc
+
+
+def count_tokens(text: str, model: Optional[str] = None) -> int:
+    if not text:
+        return 0
+    enc = _encoder(model)
+    if enc is None:
+        return (len(text) + 3) // 4
+    if len(text) < TOKEN_COUNT_CACHE_MIN_CHARS:
+        return len(enc.encode(text, disallowed_special=()))
+    key = f"{enc.name}:{hashlib.sha256(text.encode('utf-8')).hexdigest()}"
+    count = _count_cache.get(key)
+    if count is None:
+        count = len(enc.encode(text, disallowed_special=()))
+        _count_cache.set(key, count)
+    return count
+
+
+def count_messages(messages: list, model: Optional[str] = None) -> int:
+    """Prompt tokens for a chat request's messages."""
+    return sum(_TOKENS_PER_MESSAGE + count_tokens(m.get("content") or "", model) for m in messages) + 2
+
+
+def context_budget(model: Optional[str] = None) -> int:
+    """Prompt tokens available for `model`: its context window minus the completion reserve."""
+    window = _CONTEXT_BUDGETS.get(model or "", AI_CONTEXT_TOKENS)
+    return max(0, window - AI_RESPONSE_TOKENS)
+
+
+def truncate_to_tokens(text: str, max_tokens: int, model: Optional[str] = None) -> str:
+    """Keep the first `max_tokens` tokens of `text`."""
+    if max_tokens <= 0 or not text:
+        return ""
+    enc = _encoder(model)
+    if enc is None:
+        return text[: max_tokens * 4]
+    ids = enc.encode(text, disallowed_special=())
+    return text if len(ids) <= max_tokens else enc.decode(ids[:max_tokens])
+
+
+def head_tail(text: str, max_tokens: int, model: Optional[str] = None, head_ratio: float = 2 / 3) -> str:
+    """Keep the beginning and end of `text` within `max_tokens`, marking the cut."""
+    marker = "\n\n[... middle of source text omitted ...]\n\n"
+    if count_tokens(text, model) <= max_tokens:
+        return text
+    usable = max_tokens - count_tokens(marker, model)
+    if usable <= 0:
+        return truncate_to_tokens(text, max_tokens, model)
+    head_tokens = int(usable * head_ratio)
+    tail_tokens = usable - head_tokens
+    head = truncate_to_tokens(text, head_tokens, model)
+    enc = _encoder(model)
+    if enc is None:
+        tail = text[-tail_tokens * 4:] if tail_tokens else ""
+    else:
+        ids = enc.encode(text, disallowed_special=())
+        tail = enc.decode(ids[-tail_tokens:]) if tail_tokens else ""
+    return head + marker + tail
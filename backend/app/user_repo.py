@@ -0,0 +1,60 @@
+# backend/app/user_repo.py
+"""
+Indexed user lookups.
+
+Users are found by `email_normalized` (trimmed, lower-cased email; unique
+index from database.INDEXES) with a single find_one, instead of loading
+the whole users collection and scanning it in Python.
+
+Records written before email_normalized existed are backfilled once by
+database.run_migrations() (at import via ensure_indexes, and on app startup), so
+a miss here is a real miss - no fallback scan on `email`.
+"""
+from typing import Optional
+
+from pymongo.errors import DuplicateKeyError
+
+from app import lookups
+from app.database import COLLECTIONS, normalize_email, upsert
+
+
+class EmailTaken(Exception):
+    """Another user already has this (normalised) email."""
+
+
+def find_by_email(email: str) -> Optional[dict]:
+    norm = normalize_email(email)
+    if not norm:
+        return None
+    return COLLECTIONS["users"].find_one({"email_normalized": norm}, {"_id": 0})
+
+
+def email_taken(email: str, exclude_id: Optional[str] = None) -> bool:
+    norm = normalize_email(email)
+    if not norm:
+        return False
+    query = {"email_normalized": norm}
+    if exclude_id:
+        query["id"] = {"$ne": exclude_id}
+    return COLLECTIONS["users"].find_one(query, {"_id": 0, "id": 1}) is not None
+
+
+def authenticate(email: str, password: str) -> Optional[dict]:
+    """The user with this email and password, or None."""
+    user = find_by_email(email)
+    if user and password and user.get("password") == password:
+        return user
+    return None
+
+
+def save(user: dict) -> dict:
+    """
+    upsert() a user record. Raises EmailTaken if the unique email index rejects it
+    (two concurrent signups with the same address).
+    """
+    try:
+        return upsert("users", user)
+    except DuplicateKeyError:
+        raise EmailTaken(user.get("email"))
+    finally:
+        lookups.invalidate_user(user.get("id"))
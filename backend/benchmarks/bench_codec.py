@@ -0,0 +1,141 @@
+"""
+Large-field codec benchmark (app.database COMPRESSED_FIELDS): stored size and
+encode/decode latency per codec, plus Mongo write/read round trips.
+
+Documents are synthetic but shaped like real ones - OCR-style source text and
+generated HTML pages/sections - unless BENCH_SAMPLE_DIR points at a directory
+of .txt (source text) and .html (generated bodies) files to use instead.
+
+    python -m benchmarks.bench_codec                       # codec only, no database
+    BENCH_MONGO_URI=mongodb://localhost:27017 python -m benchmarks.bench_codec
+    BENCH_TEXT_KB=50,500,5000 BENCH_ROUNDS=20 python -m benchmarks.bench_codec
+
+(run from backend/). The Mongo part writes to a throwaway database - never point
+it at production.
+"""
+import os
+import sys
+import time
+import random
+import statistics
+
+BENCH_MONGO_URI = os.getenv("BENCH_MONGO_URI", "")
+BENCH_DB = os.getenv("BENCH_MONGO_DB", "docgen_bench")
+TEXT_KB = [int(x) for x in os.getenv("BENCH_TEXT_KB", "20,200,2000").split(",")]
+PAGES = int(os.getenv("BENCH_PAGES", "12"))
+ROUNDS = int(os.getenv("BENCH_ROUNDS", "10"))
+SAMPLE_DIR = os.getenv("BENCH_SAMPLE_DIR", "")
+
+# app.database connects on import: aim it at the benchmark database (or nowhere)
+os.environ["MONGO_URI"] = BENCH_MONGO_URI or "mongodb://localhost:1/?serverSelectionTimeoutMS=1"
+os.environ["MONGO_DB"] = BENCH_DB
+os.environ["DB_ENSURE_INDEXES"] = "false"
+os.environ.pop("SUPERADMIN_EMAIL", None)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bson  # noqa: E402
+from app import database  # noqa: E402
+
+_WORDS = ("agreement party services payment invoice shall term period notice clause section "
+          "company client provider schedule annex total amount date signed liability insurance "
+          "delivery project milestone report review approval budget cost tax rate").split()
+
+
+def _ocr_text(kb: int, rng: random.Random) -> str:
+    lines, size, page = [], 0, 1
+    while size < kb * 1024:
+        if rng.random() < 0.03:
+            line = f"--- Page {page} ---"
+            page += 1
+        else:
+            words = [rng.choice(_WORDS) for _ in range(rng.randint(6, 16))]
+            if rng.random() < 0.3:
+                words.append(f"{rng.randint(1, 99999):,}.{rng.randint(0, 99):02d}")
+            line = " ".join(words).capitalize() + "."
+        lines.append(line)
+        size += len(line) + 1
+    return "\n".join(lines)
+
+
+def _html(rng: random.Random) -> str:
+    parts = [f"<h2>{rng.choice(_WORDS).title()} {rng.choice(_WORDS)}</h2>"]
+    for _ in range(rng.randint(4, 10)):
+        parts.append("<p>" + " ".join(rng.choice(_WORDS) for _ in range(rng.randint(30, 80))) + ".</p>")
+    rows = "".join(f"<tr><td>{rng.choice(_WORDS)}</td><td>{rng.randint(1, 9999)}</td></tr>" for _ in range(rng.randint(3, 12)))
+    parts.append(f"<table><tr><th>Item</th><th>Amount</th></tr>{rows}</table>")
+    return "\n".join(parts)
+
+
+def _samples():
+    """[(label, raw_text, [html bodies])]"""
+    if SAMPLE_DIR:
+        names = sorted(os.listdir(SAMPLE_DIR))
+        read = lambda n: open(os.path.join(SAMPLE_DIR, n), encoding="utf-8", errors="ignore").read()  # noqa: E731
+        bodies = [read(n) for n in names if n.endswith(".html")] or [""]
+        return [(n, read(n), bodies) for n in names if n.endswith(".txt")]
+    rng = random.Random(42)
+    return [(f"{kb} KB", _ocr_text(kb, rng), [_html(rng) for _ in range(PAGES)]) for kb in TEXT_KB]
+
+
+def _document(raw_text: str, bodies: list) -> dict:
+    half = len(bodies) // 2
+    return {
+        "id": "bench-doc",
+        "title": "Benchmark document",
+        "raw_text": raw_text,
+        "pages": [{"name": f"Page {i}", "content": b} for i, b in enumerate(bodies[:half])],
+        "sections": [{"name": f"Section {i}", "content": b} for i, b in enumerate(bodies[half:])],
+        "version": 1,
+    }
+
+
+def _ms(fn, n: int) -> float:
+    samples = []
+    for _ in range(n):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+def _codecs():
+    out = ["off", "zlib"]
+    if database._zstd is not None:
+        out.append("zstd")
+    else:
+        print("(zstandard not installed: zstd row skipped)")
+    return out
+
+
+def main():
+    coll = database.COLLECTIONS["documents"] if BENCH_MONGO_URI else None
+    if coll is not None:
+        coll.delete_many({"id": "bench-doc"})
+    header = f"{'sample':>10} {'codec':>5} | {'bson KB':>9} {'ratio':>6} | {'encode':>8} {'decode':>8}"
+    if coll is not None:
+        header += f" | {'write':>8} {'read':>8}"
+    print(header + "   (ms, median)")
+
+    codecs = _codecs()
+    for label, raw_text, bodies in _samples():
+        doc = _document(raw_text, bodies)
+        plain = len(bson.encode(doc))
+        for codec in codecs:
+            database.DB_COMPRESSION = codec
+            encoded = database.encode_fields("documents", doc)
+            size = len(bson.encode(encoded))
+            enc = _ms(lambda: database.encode_fields("documents", doc), ROUNDS)
+            dec = _ms(lambda: database.decode_fields(bson.decode(bson.encode(encoded))), ROUNDS)
+            line = f"{label:>10} {codec:>5} | {size / 1024:>9.1f} {plain / size:>6.2f} | {enc:>8.2f} {dec:>8.2f}"
+            if coll is not None:
+                write = _ms(lambda: database.upsert("documents", dict(doc)), ROUNDS)
+                read = _ms(lambda: database.find_by_id("documents", "bench-doc"), ROUNDS)
+                line += f" | {write:>8.2f} {read:>8.2f}"
+            print(line)
+
+    if coll is not None:
+        coll.delete_many({"id": "bench-doc"})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Login lookup micro-benchmark: indexed find_one (app.user_repo) vs the old
+read_all("users") + Python scan, as the users collection grows. Times both a
+hit (login of an existing user) and a miss (unknown address at login, plus the
+email_taken check a signup makes).
+
+Runs against a throwaway database - never point it at production:
+
+    BENCH_MONGO_URI=mongodb://localhost:27017 python -m benchmarks.bench_login
+    BENCH_SIZES=100,10000,1000000 BENCH_LOOKUPS=500 python -m benchmarks.bench_login
+
+(run from backend/). The linear scan is skipped above BENCH_SCAN_MAX users.
+"""
+import os
+import sys
+import time
+import random
+import statistics
+
+BENCH_MONGO_URI = os.getenv("BENCH_MONGO_URI", "mongodb://localhost:27017")
+BENCH_DB = os.getenv("BENCH_MONGO_DB", "docgen_bench")
+SIZES = [int(x) for x in os.getenv("BENCH_SIZES", "100,1000,10000,100000,1000000").split(",")]
+LOOKUPS = int(os.getenv("BENCH_LOOKUPS", "200"))
+SCAN_MAX = int(os.getenv("BENCH_SCAN_MAX", "10000"))
+BATCH = 10000
+
+# app.database connects on import: aim it at the benchmark database
+os.environ["MONGO_URI"] = BENCH_MONGO_URI
+os.environ["MONGO_DB"] = BENCH_DB
+os.environ.pop("SUPERADMIN_EMAIL", None)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.database import COLLECTIONS, ensure_indexes, read_all  # noqa: E402
+from app import user_repo  # noqa: E402
+
+
+def _email(i: int) -> str:
+    return f"User{i}@Example.com"
+
+
+def _grow(coll, current: int, target: int):
+    """Insert users [current, target) in batches."""
+    for start in range(current, target, BATCH):
+        end = min(target, start + BATCH)
+        coll.insert_many([
+            {"id": f"bench-{i}", "email": _email(i).lower(), "email_normalized": _email(i).lower(),
+             "password": "pw", "role": "user", "company_id": None}
+            for i in range(start, end)
+        ], ordered=False)
+
+
+def _time(fn, n: int) -> dict:
+    samples = []
+    for _ in range(n):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return {
+        "p50": statistics.median(samples),
+        "p95": samples[int(0.95 * (len(samples) - 1))],
+        "mean": statistics.fmean(samples),
+    }
+
+
+def _scan_login(email: str, password: str):
+    email = email.strip().lower()
+    return next((u for u in read_all("users")
+                 if (u.get("email") or "").lower() == email and u.get("password") == password), None)
+
+
+def main():
+    coll = COLLECTIONS["users"]
+    coll.delete_many({})
+    ensure_indexes()
+
+    print(f"{'users':>9} | {'hit p50':>8} {'p95':>8} | {'miss p50':>8} {'p95':>8} | {'scan p50':>10} {'p95':>10}   (ms)")
+    current = 0
+    for size in sorted(SIZES):
+        _grow(coll, current, size)
+        current = size
+
+        def indexed():
+            i = random.randrange(size)
+            assert user_repo.authenticate(_email(i), "pw")
+
+        def missed():
+            i = size + random.randrange(size)  # never inserted
+            assert user_repo.authenticate(_email(i), "pw") is None
+            assert not user_repo.email_taken(_email(i))
+
+        found = _time(indexed, LOOKUPS)
+        miss = _time(missed, LOOKUPS)
+        if size <= SCAN_MAX:
+            scan = _time(lambda: _scan_login(_email(random.randrange(size)), "pw"), max(5, LOOKUPS // 20))
+            scan_txt = f"{scan['p50']:>10.2f} {scan['p95']:>10.2f}"
+        else:
+            scan_txt = f"{'skipped':>10} {'':>10}"
+        print(f"{size:>9} | {found['p50']:>8.3f} {found['p95']:>8.3f} | {miss['p50']:>8.3f} {miss['p95']:>8.3f} | {scan_txt}")
+
+    coll.delete_many({})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+import os
+import sys
+
+import pytest
+
+# app.database connects on import: point it nowhere and skip index/seed work.
+os.environ.setdefault("MONGO_URI", "mongodb://localhost:1/?serverSelectionTimeoutMS=1")
+os.environ["DB_ENSURE_INDEXES"] = "false"
+os.environ.pop("SUPERADMIN_EMAIL", None)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _find_one_and_update_after(original):
+    """
+    mongomock re-runs the filter to fetch ReturnDocument.AFTER, so an update that
+    changes a filtered field (every `version` compare-and-swap) returns None.
+    Fetch the post-image by `id` instead. (The pre-image is projected to `id` alone:
+    other projections make mongomock apply positional `$` updates to the wrong element.)
+    """
+    from pymongo import ReturnDocument
+
+    def find_one_and_update(self, filter, update, projection=None, sort=None, upsert=False,
+                            return_document=ReturnDocument.BEFORE, **kwargs):
+        if return_document != ReturnDocument.AFTER:
+            return original(self, filter, update, projection=projection, sort=sort, upsert=upsert,
+                            return_document=return_document, **kwargs)
+        before = original(self, filter, update, projection={"_id": 0, "id": 1}, sort=sort, upsert=upsert,
+                          return_document=ReturnDocument.BEFORE, **kwargs)
+        if before is None:
+            return None
+        return self.find_one({"id": before["id"]}, projection)
+
+    return find_one_and_update
+
+
+@pytest.fixture
+def db(monkeypatch):
+    """Every database.COLLECTIONS entry backed by a fresh in-memory (mongomock) database."""
+    mongomock = pytest.importorskip("mongomock")
+    from app import database, sources
+
+    mock_db = mongomock.MongoClient().get_database("docgen_test")
+    for name in database.COLLECTIONS:
+        monkeypatch.setitem(database.COLLECTIONS, name, mock_db.get_collection(name))
+    Collection = mongomock.collection.Collection
+    monkeypatch.setattr(Collection, "find_one_and_update", _find_one_and_update_after(Collection.find_one_and_update))
+    monkeypatch.setattr(sources, "_store", sources.MongoSourceStore())
+    database.ensure_indexes()
+    return database.COLLECTIONS
+
+
+class DeferredPool:
+    """Stands in for a worker pool: submitted calls run when the test calls run()."""
+
+    def __init__(self):
+        self.queued = []
+
+    def submit(self, fn, *args):
+        self.queued.append((fn, args))
+
+    def run(self):
+        while self.queued:
+            fn, args = self.queued.pop(0)
+            fn(*args)
+
+
+@pytest.fixture
+def deferred_pool():
+    return DeferredPool()
@@ -0,0 +1,88 @@
+"""app/cache.py backends: get/set/delete, TTL expiry, LRU bound, tiering and hit/miss stats."""
+import pytest
+
+from app import cache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Controls time.time() as seen by app.cache."""
+    now = {"t": 1_000_000.0}
+    monkeypatch.setattr(cache.time, "time", lambda: now["t"])
+    return now
+
+
+@pytest.fixture(params=["memory", "disk", "mongo"])
+def backend(request, tmp_path):
+    def build(ttl=0):
+        if request.param == "mongo":
+            request.getfixturevalue("db")
+        return cache.build_cache(request.param, ttl=ttl, directory=str(tmp_path), collection="ai_cache")
+    return build
+
+
+def test_round_trip_and_delete(backend):
+    c = backend()
+    key = cache.make_key("prompt", {"model": "m", "text": "x"})
+
+    assert c.get(key) is None
+    c.set(key, {"content": "<p>x</p>", "n": 1})
+    assert c.get(key) == {"content": "<p>x</p>", "n": 1}
+    c.delete(key)
+    assert c.get(key) is None
+    assert c.stats()["hits"] == 1 and c.stats()["misses"] == 2
+
+
+def test_entries_expire_after_ttl(backend, clock):
+    c = backend(ttl=60)
+    c.set("k", "v")
+
+    clock["t"] += 59
+    assert c.get("k") == "v"
+    clock["t"] += 2
+    assert c.get("k") is None
+
+
+def test_ttl_zero_never_expires(backend, clock):
+    c = backend()
+    c.set("k", "v")
+    clock["t"] += 10 ** 9
+    assert c.get("k") == "v"
+
+
+def test_none_is_never_stored(backend):
+    c = backend()
+    c.set("k", None)
+    assert c.get("k") is None
+
+
+def test_memory_cache_evicts_least_recently_used():
+    c = cache.MemoryCache(max_entries=2)
+    c.set("a", 1)
+    c.set("b", 2)
+    c.get("a")
+    c.set("c", 3)
+
+    assert (c.get("a"), c.get("b"), c.get("c")) == (1, None, 3)
+    assert c.stats()["entries"] == 2
+
+
+def test_tiered_cache_backfills_faster_tiers(tmp_path):
+    fast, slow = cache.MemoryCache(), cache.DiskCache(str(tmp_path))
+    tiered = cache.TieredCache(fast, slow)
+    slow.set("k", "v")
+
+    assert tiered.get("k") == "v"
+    assert fast.get("k") == "v"
+    assert tiered.blocking
+
+
+def test_build_cache_falls_back(tmp_path):
+    assert isinstance(cache.build_cache("off"), cache.NullCache)
+    assert isinstance(cache.build_cache("redis"), cache.MemoryCache)
+    assert isinstance(cache.build_cache("disk", directory=str(tmp_path)), cache.DiskCache)
+
+
+def test_make_key_ignores_dict_order():
+    assert cache.make_key({"a": 1, "b": 2}) == cache.make_key({"b": 2, "a": 1})
+    assert cache.make_key("x") != cache.make_key("y")
@@ -0,0 +1,60 @@
+"""Large-field codec (app/database.py): designated fields compress on write and decode on read."""
+import pytest
+
+from app import database
+from app.database import decode_fields, encode_fields, find_by_id, upsert
+
+BIG = "<p>" + "long generated paragraph " * 400 + "</p>"
+
+
+@pytest.fixture(params=["zlib", "zstd"])
+def codec(request, monkeypatch):
+    if request.param == "zstd" and database._zstd is None:
+        pytest.skip("zstandard not installed")
+    monkeypatch.setattr(database, "DB_COMPRESSION", request.param)
+    return request.param
+
+
+def test_designated_fields_round_trip(codec):
+    record = {"id": "d1", "raw_text": BIG, "title": BIG,
+              "pages": [{"name": "p", "content": BIG}, {"name": "q", "content": "short"}]}
+
+    encoded = encode_fields("documents", record)
+
+    assert encoded["raw_text"]["_codec"] == codec
+    assert encoded["pages"][0]["content"]["_codec"] == codec
+    assert encoded["pages"][1]["content"] == "short"  # below DB_COMPRESS_MIN_BYTES
+    assert encoded["title"] == BIG                    # not a designated field
+    assert record["raw_text"] == BIG                  # the caller's record is not mutated
+    assert decode_fields(encoded) == record
+
+
+def test_dotted_and_positional_paths_are_encoded(codec):
+    fields = encode_fields("documents", {"pages.3.content": BIG, "sections.$.content": BIG, "updated_at": "t"})
+
+    assert fields["pages.3.content"]["_codec"] == codec
+    assert fields["sections.$.content"]["_codec"] == codec
+    assert fields["updated_at"] == "t"
+
+
+def test_compression_off_still_reads_compressed_values(codec, monkeypatch):
+    stored = encode_fields("documents", {"raw_text": BIG})
+    monkeypatch.setattr(database, "DB_COMPRESSION", "off")
+
+    assert encode_fields("documents", {"raw_text": BIG})["raw_text"] == BIG
+    assert decode_fields(stored)["raw_text"] == BIG
+
+
+def test_plain_values_read_as_is():
+    legacy = {"id": "d1", "raw_text": "plain", "pages": [{"content": None}]}
+    assert decode_fields(dict(legacy)) == legacy
+
+
+def test_upsert_stores_compressed_and_reads_plain(db, codec):
+    upsert("documents", {"id": "d1", "raw_text": BIG, "sections": [{"name": "s", "content": BIG}]})
+
+    raw = db["documents"].find_one({"id": "d1"})
+    assert raw["raw_text"]["_codec"] == codec
+    assert raw["sections"][0]["content"]["_codec"] == codec
+    doc = find_by_id("documents", "d1")
+    assert doc["raw_text"] == BIG and doc["sections"][0]["content"] == BIG
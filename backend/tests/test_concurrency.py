@@ -0,0 +1,86 @@
+"""Optimistic concurrency on documents: version compare-and-swap and the rebasing item writer."""
+import pytest
+
+from app import generation, revisions
+from app.database import find_by_id, update_array_item, update_fields, upsert
+
+
+@pytest.fixture
+def doc(db):
+    record = {
+        "id": "d1", "user_id": "u1", "title": "T", "version": 1,
+        "pages": [{"name": "p1", "content": "page"}],
+        "sections": [{"name": "s1", "content": "one"}, {"name": "s2", "content": "two"}],
+    }
+    upsert("documents", record)
+    revisions.ensure_baseline("d1")
+    return record
+
+
+def _save_section(name: str, content: str, expected_version: int) -> dict:
+    """A page/section save as the routes do it: CAS on the version, then a revision."""
+    updated = update_array_item("documents", "d1", "sections", {"name": name}, {"content": content},
+                                expected_version=expected_version)
+    revisions.record_change(updated, [("section", name)], "save_section", "u2")
+    return updated
+
+
+def test_update_array_item_is_a_compare_and_swap(doc):
+    updated = update_array_item("documents", "d1", "sections", {"name": "s2"}, {"content": "new"},
+                                expected_version=1)
+
+    assert updated["version"] == 2
+    assert [s["content"] for s in updated["sections"]] == ["one", "new"]
+    assert update_array_item("documents", "d1", "sections", {"name": "s2"}, {"content": "stale"},
+                             expected_version=1) is None
+    assert find_by_id("documents", "d1")["sections"][1]["content"] == "new"
+
+
+def test_version_match_treats_unversioned_records_as_version_1(db):
+    upsert("documents", {"id": "legacy", "sections": [{"name": "s", "content": "x"}]})
+
+    assert update_fields("documents", "legacy", {"title": "t"}, expected_version=1)
+    assert not update_fields("documents", "legacy", {"title": "t"}, expected_version=2)
+
+
+def test_writer_rebases_over_edits_to_other_items(doc):
+    writer = generation.VersionedItemWriter("d1", 1, "regenerate_document", "u1")
+    _save_section("s2", "USER", expected_version=1)
+
+    writer.persist("section", 0, {"name": "s1", "content": "JOB"})
+
+    stored = find_by_id("documents", "d1")
+    assert [s["content"] for s in stored["sections"]] == ["JOB", "USER"]
+    assert stored["version"] == writer.version == 3
+    assert revisions.changes_since("d1", 2, 3) == {("section", "s1")}
+
+
+def test_writer_refuses_an_item_someone_else_changed(doc):
+    writer = generation.VersionedItemWriter("d1", 1, "regenerate_document", "u1")
+    _save_section("s2", "USER", expected_version=1)
+
+    with pytest.raises(generation.ItemConflict):
+        writer.persist("section", 1, {"name": "s2", "content": "JOB"})
+    assert find_by_id("documents", "d1")["sections"][1]["content"] == "USER"
+
+
+def test_writer_refuses_after_an_unrecorded_write(doc):
+    writer = generation.VersionedItemWriter("d1", 1, "regenerate_document", "u1")
+    # a whole-document write without item-level history: nothing can be rebased on it
+    update_fields("documents", "d1", {"title": "X", "version": 2}, expected_version=1)
+
+    with pytest.raises(generation.ItemConflict):
+        writer.persist("page", 0, {"name": "p1", "content": "JOB"})
+
+
+def test_finalize_bumps_version_and_checkpoints(doc):
+    writer = generation.VersionedItemWriter("d1", 1, "regenerate_document", "u1")
+    writer.persist("section", 0, {"name": "s1", "content": "<p>JOB</p>"})
+
+    final = generation.finalize_document("d1", "regenerate_document", "u1", writer)
+
+    assert final["version"] == writer.version == 3
+    assert final["generation_status"] == generation.DOC_COMPLETED
+    latest = revisions.list_revisions("d1")[0]
+    assert (latest["version"], latest["kind"], latest["action"]) == (3, revisions.KIND_CHECKPOINT, "regenerate_document")
+    assert revisions.reconstruct("d1", 3)["sections"][0]["content"] == final["sections"][0]["content"]
@@ -0,0 +1,38 @@
+"""What one page/section is sent: the whole digest for large uploads, else raw text or its best chunks."""
+import pytest
+
+from app import ai, digest, retrieval
+
+
+@pytest.fixture
+def small_budget(monkeypatch):
+    monkeypatch.setattr(retrieval, "RETRIEVAL_TOKEN_BUDGET", 200)
+
+
+def _paragraphs(n: int, topic: str = "filler") -> str:
+    return "\n\n".join(f"Paragraph {i} about {topic} and unrelated background material." * 3 for i in range(n))
+
+
+def test_digest_is_sent_whole(monkeypatch, small_budget):
+    raw_text = _paragraphs(400)
+    summary = _paragraphs(100, "the digest")  # well over RETRIEVAL_TOKEN_BUDGET
+    monkeypatch.setattr(digest, "needs_digest", lambda text: text == raw_text)
+    digest.remember_digest({"version": digest.DIGEST_VERSION, "text_hash": retrieval.text_hash(raw_text),
+                            "content": summary})
+
+    assert ai._context_for({"name": "Pricing"}, raw_text) == summary
+
+
+def test_raw_text_is_narrowed_to_matching_chunks(monkeypatch, small_budget):
+    monkeypatch.setattr(digest, "needs_digest", lambda text: False)
+    raw_text = _paragraphs(60) + "\n\nThe pricing schedule lists a monthly fee of 400 EUR."
+
+    context = ai._context_for({"name": "Pricing schedule"}, raw_text)
+
+    assert "monthly fee of 400 EUR" in context
+    assert retrieval.estimate_tokens(context) <= 200 < retrieval.estimate_tokens(raw_text)
+
+
+def test_small_raw_text_is_sent_whole(monkeypatch):
+    monkeypatch.setattr(digest, "needs_digest", lambda text: False)
+    assert ai._context_for({"name": "Intro"}, "short source") == "short source"
@@ -0,0 +1,97 @@
+"""Document routes: If-Match / 409 on page and section saves, and source document lookups."""
+import pytest
+
+pytest.importorskip("htmldocx")
+
+from fastapi import HTTPException, Response  # noqa: E402
+
+from app import revisions  # noqa: E402
+from app.database import find_by_id, upsert  # noqa: E402
+from app.models import CreateDocumentRequest  # noqa: E402
+from app.routes import document_routes  # noqa: E402
+
+USER = {"id": "u1", "role": "user", "company_id": None}
+
+
+@pytest.fixture
+def doc(db):
+    record = {
+        "id": "d1", "user_id": "u1", "title": "T", "version": 1,
+        "pages": [{"name": "p1", "content": "page"}],
+        "sections": [{"name": "s1", "content": "one"}, {"name": "s2", "content": "two"}],
+    }
+    upsert("documents", record)
+    return record
+
+
+def _save_section(name: str, content: str, if_match=None, expected_version=None):
+    response = Response()
+    payload = {"section_name": name, "content": content}
+    if expected_version is not None:
+        payload["expected_version"] = expected_version
+    out = document_routes.save_section("d1", response, payload, if_match, USER)
+    return out["document"], response.headers["ETag"]
+
+
+@pytest.mark.parametrize("explicit, header, expected", [
+    (None, None, None), (None, "*", None), (None, '"3"', 3), (None, 'W/"4"', 4), (None, '"5", "6"', 5), (7, '"3"', 7),
+])
+def test_expected_version_sources(explicit, header, expected):
+    assert document_routes._expected_version(explicit, header) == expected
+
+
+def test_expected_version_rejects_other_etags():
+    with pytest.raises(HTTPException) as err:
+        document_routes._expected_version(None, '"abc"')
+    assert err.value.status_code == 400
+
+
+def test_saves_bump_the_version_and_answer_with_its_etag(doc):
+    updated, etag = _save_section("s1", "<p>new</p>", if_match='"1"')
+
+    assert (updated["version"], etag) == (2, '"2"')
+    _, etag = _save_section("s1", "<p>again</p>")  # unconditional
+    assert etag == '"3"'
+    assert [r["version"] for r in revisions.list_revisions("d1")] == [3, 2, 1]
+
+
+def test_stale_save_of_another_item_is_merged(doc):
+    _save_section("s1", "<p>A</p>", if_match='"1"')
+
+    updated, etag = _save_section("s2", "<p>B</p>", if_match='"1"')
+
+    assert etag == '"3"'
+    assert [s["content"] for s in updated["sections"]] == ["<p>A</p>", "<p>B</p>"]
+
+
+def test_stale_save_of_the_same_item_is_a_conflict(doc):
+    _save_section("s1", "<p>A</p>", expected_version=1)
+
+    with pytest.raises(HTTPException) as err:
+        _save_section("s1", "<p>B</p>", expected_version=1)
+
+    assert err.value.status_code == 409
+    assert err.value.headers["ETag"] == '"2"'
+    assert find_by_id("documents", "d1")["sections"][0]["content"] == "<p>A</p>"
+
+
+def test_save_from_the_future_is_a_conflict(doc):
+    with pytest.raises(HTTPException) as err:
+        _save_section("s1", "<p>A</p>", if_match='"9"')
+    assert err.value.status_code == 409
+
+
+def test_save_of_a_missing_section_is_404(doc):
+    with pytest.raises(HTTPException) as err:
+        _save_section("nope", "x", if_match='"1"')
+    assert err.value.status_code == 404
+
+
+@pytest.mark.parametrize("source_id, status", [("missing", 404), ("theirs", 403)])
+def test_generation_source_must_exist_and_be_readable(db, source_id, status):
+    upsert("documents", {"id": "theirs", "user_id": "u2", "raw_text": "private"})
+    payload = CreateDocumentRequest(source_document_id=source_id, pages=[{"name": "p"}])
+
+    with pytest.raises(HTTPException) as err:
+        document_routes._prepare_generation(payload, USER)
+    assert err.value.status_code == status
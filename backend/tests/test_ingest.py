@@ -0,0 +1,116 @@
+"""Upload text extraction (app/ingest.py): pending -> completed | failed, and stale-extraction takeover."""
+import pytest
+
+from app import ingest, jobs, ocr, sources
+from app.database import find_by_id, upsert
+
+TEXT = "Master services agreement between Acme and Globex."
+
+
+@pytest.fixture
+def pool(db, deferred_pool, monkeypatch):
+    pool = deferred_pool
+    monkeypatch.setattr(ingest, "_get_pool", lambda: pool)
+    monkeypatch.setattr(ingest, "start_monitor", lambda: None)
+    monkeypatch.setattr(ingest, "OCR_ASYNC", True)
+    return pool
+
+
+@pytest.fixture
+def extractor(monkeypatch):
+    """Fake OCR: nothing cached; extraction returns TEXT, or raises for paths in `fail`."""
+    state = {"fail": set(), "cached": None}
+
+    def extract(path, sha256=None):
+        if path in state["fail"]:
+            raise RuntimeError(f"cannot read {path}")
+        return {"text": TEXT, "pages": [{"page": 1, "start": 0, "end": len(TEXT)}], "extraction": {"format": "text"}}
+
+    monkeypatch.setattr(ocr, "lookup_cached", lambda sha256: state["cached"])
+    monkeypatch.setattr(ocr, "extract_document_cached", extract)
+    return state
+
+
+def _upload(doc_id: str, path: str = "/uploads/a.pdf", **extra) -> dict:
+    doc = {"id": doc_id, "user_id": "u1", "path": path, "sha256": "abc", **ingest.pending_fields(), **extra}
+    upsert("documents", doc)
+    return doc
+
+
+def test_pending_until_the_worker_extracts(pool, extractor):
+    _upload("d1")
+
+    assert ingest.start("d1", "/uploads/a.pdf", "abc") == {"ocr_status": ingest.OCR_PENDING}
+    assert ingest.ocr_status(find_by_id("documents", "d1")) == ingest.OCR_PENDING
+
+    pool.run()
+    doc = find_by_id("documents", "d1")
+    assert ingest.status(doc)["ocr_status"] == ingest.OCR_COMPLETED
+    assert "raw_text" not in doc and doc["raw_text_chars"] == len(TEXT)
+    assert sources.load(doc)["raw_text"] == TEXT
+
+
+def test_cache_hit_completes_inline(pool, extractor):
+    extractor["cached"] = {"text": TEXT}
+    _upload("d1")
+
+    fields = ingest.start("d1", "/uploads/a.pdf", "abc")
+
+    assert fields["ocr_status"] == ingest.OCR_COMPLETED and pool.queued == []
+    assert find_by_id("documents", "d1")["ocr_status"] == ingest.OCR_COMPLETED
+
+
+def test_extraction_errors_and_empty_text_fail(pool, extractor, monkeypatch):
+    extractor["fail"] = {"/uploads/bad.pdf"}
+    _upload("bad", "/uploads/bad.pdf")
+    ingest.run("bad", "/uploads/bad.pdf")
+    bad = find_by_id("documents", "bad")
+    assert (bad["ocr_status"], bad["ocr_error"]) == (ingest.OCR_FAILED, "cannot read /uploads/bad.pdf")
+
+    monkeypatch.setattr(ocr, "extract_document_cached", lambda path, sha256=None: {"text": ""})
+    _upload("empty")
+    ingest.run("empty", "/uploads/a.pdf")
+    assert find_by_id("documents", "empty")["ocr_status"] == ingest.OCR_FAILED
+
+
+def test_records_without_status_count_as_completed():
+    assert ingest.ocr_status({"id": "legacy", "raw_text": "x"}) == ingest.OCR_COMPLETED
+
+
+def test_wait_for_returns_once_extraction_is_done(pool, extractor):
+    _upload("d1")
+    ingest.start("d1", "/uploads/a.pdf", "abc")
+
+    assert ingest.wait_for("d1", timeout=0)["ocr_status"] == ingest.OCR_PENDING
+    pool.run()
+    assert ingest.wait_for("d1", timeout=0)["ocr_status"] == ingest.OCR_COMPLETED
+
+
+def _abandon(doc_id: str, **extra):
+    stale = jobs._ago(ingest.OCR_STALE_SECONDS + 60)
+    _upload(doc_id, ocr_worker="dead-host:1", ocr_heartbeat_at=stale, created_at=stale, **extra)
+
+
+def test_resume_stale_takes_over_abandoned_extractions(pool, extractor):
+    _abandon("stale")
+    _upload("live")  # heartbeat is fresh: still owned by this process
+
+    assert ingest.resume_stale() == ["stale"]
+    assert ingest.resume_stale() == []
+    doc = find_by_id("documents", "stale")
+    assert (doc["ocr_worker"], doc["ocr_recoveries"]) == (jobs.WORKER_ID, 1)
+
+    pool.run()
+    assert find_by_id("documents", "stale")["ocr_status"] == ingest.OCR_COMPLETED
+    assert find_by_id("documents", "live")["ocr_status"] == ingest.OCR_PENDING
+
+
+def test_resume_stale_gives_up_after_max_recoveries(pool, extractor):
+    _abandon("poison", ocr_recoveries=ingest.OCR_MAX_RECOVERIES)
+
+    assert ingest.resume_stale() == ["poison"]
+    assert pool.queued == []
+    doc = find_by_id("documents", "poison")
+    assert doc["ocr_status"] == ingest.OCR_FAILED
+    assert "abandoned" in doc["ocr_error"]
+    assert ingest.resume_stale() == []
@@ -0,0 +1,153 @@
+"""Background jobs: cancel, retry of failed items, and takeover of jobs abandoned by a dead worker."""
+import pytest
+
+from app import ai, generation, jobs, revisions
+from app.database import find_by_id, upsert
+
+
+@pytest.fixture
+def pool(db, deferred_pool, monkeypatch):
+    pool = deferred_pool
+    monkeypatch.setattr(jobs, "store", jobs.MemoryJobStore())
+    monkeypatch.setattr(jobs, "_get_pool", lambda: pool)
+    return pool
+
+
+@pytest.fixture
+def llm(monkeypatch):
+    """Fake item generation: returns <p>name</p>, or raises for names in `fail`; counts calls."""
+    state = {"fail": set(), "calls": []}
+
+    def generate(config, raw_text, use_cache=True, on_delta=None, raise_errors=False):
+        state["calls"].append(config["name"])
+        if config["name"] in state["fail"]:
+            raise RuntimeError(f"boom {config['name']}")
+        return {"name": config["name"], "content": f"<p>{config['name']}</p>"}
+
+    monkeypatch.setattr(ai, "_generate_page_item", generate)
+    monkeypatch.setattr(ai, "_generate_section_item", generate)
+    return state
+
+
+def _new_doc() -> dict:
+    doc = generation.new_document({"id": "u1"}, "source text", [{"name": "p1"}], [{"name": "s1"}, {"name": "s2"}])
+    upsert("documents", doc)
+    return doc
+
+
+def _generate_job(doc: dict) -> dict:
+    return jobs.enqueue("generate", doc["id"], "u1", generation.pending_items(doc))
+
+
+def test_job_generates_every_item(pool, llm):
+    doc = _new_doc()
+    job = _generate_job(doc)
+    pool.run()
+
+    job = jobs.get_job(job["id"])
+    assert job["status"] == jobs.JOB_COMPLETED
+    assert job["progress"] == {"total": 3, "done": 3, "failed": 0}
+    stored = find_by_id("documents", doc["id"])
+    assert stored["generation_status"] == generation.DOC_COMPLETED
+    assert stored["version"] == 2
+    assert revisions.list_revisions(doc["id"])[0]["action"] == "generate"
+
+
+def test_cancel_before_start_cancels_items_and_document(pool, llm):
+    doc = _new_doc()
+    job = _generate_job(doc)
+    jobs.cancel(job["id"])
+    pool.run()
+
+    job = jobs.get_job(job["id"])
+    assert job["status"] == jobs.JOB_CANCELLED
+    assert {item["status"] for item in job["items"]} == {jobs.ITEM_CANCELLED}
+    assert llm["calls"] == []
+    stored = find_by_id("documents", doc["id"])
+    assert stored["generation_status"] == generation.DOC_CANCELLED
+    assert {i["generation_status"] for i in stored["pages"] + stored["sections"]} == {generation.ITEM_CANCELLED}
+    # cancelled items can be resumed like failed ones
+    assert len(generation.pending_items(stored)) == 3
+
+
+def test_cancel_of_a_finished_job_changes_nothing(pool, llm):
+    job = _generate_job(_new_doc())
+    pool.run()
+
+    assert jobs.cancel(job["id"])["cancel_requested"] is False
+    assert jobs.cancel("missing") is None
+
+
+def test_retry_failed_reruns_only_failed_items(pool, llm):
+    doc = _new_doc()
+    llm["fail"] = {"s2"}
+    job = _generate_job(doc)
+    pool.run()
+
+    job = jobs.get_job(job["id"])
+    assert job["status"] == jobs.JOB_FAILED
+    assert job["progress"] == {"total": 3, "done": 2, "failed": 1}
+    assert find_by_id("documents", doc["id"])["generation_status"] == generation.DOC_COMPLETED_WITH_ERRORS
+
+    llm["fail"], llm["calls"] = set(), []
+    jobs.retry_failed(job["id"])
+    pool.run()
+
+    job = jobs.get_job(job["id"])
+    assert llm["calls"] == ["s2"]
+    assert job["status"] == jobs.JOB_COMPLETED
+    assert job["progress"] == {"total": 3, "done": 3, "failed": 0}
+    assert find_by_id("documents", doc["id"])["generation_status"] == generation.DOC_COMPLETED
+
+
+def test_retry_failed_needs_a_finished_job_with_failures(pool, llm):
+    job = _generate_job(_new_doc())
+    with pytest.raises(ValueError):
+        jobs.retry_failed(job["id"])  # still queued
+    pool.run()
+    with pytest.raises(ValueError):
+        jobs.retry_failed(job["id"])  # nothing failed
+
+
+def _abandoned_job(doc: dict, recoveries: int = 0) -> dict:
+    stale = jobs._ago(jobs.JOB_STALE_SECONDS + 60)
+    items = generation.pending_items(doc)
+    job = {
+        "id": f"job-{recoveries}", "type": "generate", "doc_id": doc["id"], "user_id": "u1",
+        "status": jobs.JOB_RUNNING, "use_cache": True, "base_version": None, "cancel_requested": False,
+        "items": [{"kind": kind, "index": index, "name": config["name"], "config": config,
+                   "status": jobs.ITEM_RUNNING if n == 0 else jobs.ITEM_PENDING, "error": None, "attempts": 1}
+                  for n, (kind, index, config) in enumerate(items)],
+        "progress": {"total": len(items), "done": 0, "failed": 0},
+        "recoveries": recoveries, "worker": "dead-host:1", "heartbeat_at": stale, "updated_at": stale,
+    }
+    jobs.store.create(job)
+    return job
+
+
+def test_recover_stale_requeues_an_abandoned_job(pool, llm, monkeypatch):
+    monkeypatch.setattr(jobs, "store", jobs.MongoJobStore())
+    doc = _new_doc()
+    job = _abandoned_job(doc)
+
+    assert jobs.recover_stale() == [job["id"]]
+    assert jobs.recover_stale() == []  # claimed: its heartbeat is fresh now
+    claimed = jobs.get_job(job["id"])
+    assert claimed["worker"] == jobs.WORKER_ID and claimed["recoveries"] == 1
+    assert {item["status"] for item in claimed["items"]} == {jobs.ITEM_PENDING}
+
+    pool.run()
+    assert jobs.get_job(job["id"])["status"] == jobs.JOB_COMPLETED
+    assert find_by_id("documents", doc["id"])["generation_status"] == generation.DOC_COMPLETED
+
+
+def test_recover_stale_gives_up_after_max_recoveries(pool, llm, monkeypatch):
+    monkeypatch.setattr(jobs, "store", jobs.MongoJobStore())
+    job = _abandoned_job(_new_doc(), recoveries=jobs.JOB_MAX_RECOVERIES)
+
+    assert jobs.recover_stale() == [job["id"]]
+    assert pool.queued == []
+    failed = jobs.get_job(job["id"])
+    assert failed["status"] == jobs.JOB_FAILED
+    assert [item["status"] for item in failed["items"]] == [jobs.ITEM_FAILED, jobs.ITEM_PENDING, jobs.ITEM_PENDING]
+    assert failed["progress"]["failed"] == 1
@@ -0,0 +1,50 @@
+"""POST /upload-batch?merge=true: the merged corpus record built by _merge_corpus."""
+import pytest
+
+pytest.importorskip("htmldocx")
+
+from app import sources  # noqa: E402
+from app.routes import document_routes  # noqa: E402
+
+
+@pytest.fixture
+def stored(monkeypatch, tmp_path):
+    """Captures upserted records; source text goes to a disk store under tmp_path."""
+    records = []
+    monkeypatch.setattr(document_routes, "upsert", lambda collection, obj: records.append((collection, obj)) or obj)
+    monkeypatch.setattr(sources, "_store", sources.DiskSourceStore(str(tmp_path)))
+    return records
+
+
+def test_merge_corpus_concatenates_files_with_offsets(stored):
+    user = {"id": "u1", "company_id": "c1", "company_name": "Acme"}
+    members = [
+        ({"id": "d1", "filename": "a.pdf"}, {"raw_text": "alpha text"}),
+        ({"id": "d2", "filename": "empty.pdf"}, {"raw_text": "   "}),
+        ({"id": "d3", "filename": "b.pdf"}, {"raw_text": "beta text"}),
+    ]
+
+    corpus = document_routes._merge_corpus(user, members)
+
+    assert corpus["filename"] == "2 merged files"
+    assert corpus["ocr_status"] == "completed"
+    spans = corpus["raw_text_sources"]
+    assert [s["document_id"] for s in spans] == ["d1", "d3"]
+    for span, text in zip(spans, ("alpha text", "beta text")):
+        block = corpus["raw_text"][span["start"]:span["end"]]
+        assert block.startswith(f"===== {span['filename']} =====") and block.endswith(text)
+
+    (collection, record), = stored
+    assert collection == "documents"
+    assert "raw_text" not in record
+    assert record["raw_text_ref"] == sources.key_for(corpus["raw_text"])
+    assert record["raw_text_sources"] == spans
+    assert sources.load(record)["raw_text"] == corpus["raw_text"]
+
+
+def test_merge_corpus_without_text_fails(stored):
+    corpus = document_routes._merge_corpus({"id": "u1"}, [({"id": "d1", "filename": "x.pdf"}, {"raw_text": ""})])
+
+    assert corpus["ocr_status"] == "failed"
+    assert corpus["raw_text_sources"] == []
+    assert stored[0][1]["raw_text_ref"] is None
@@ -0,0 +1,44 @@
+"""GET /my-documents: keyset pagination over (created_at, id)."""
+import pytest
+
+pytest.importorskip("htmldocx")
+
+from fastapi import HTTPException  # noqa: E402
+
+from app.database import upsert  # noqa: E402
+from app.routes import document_routes  # noqa: E402
+
+USER = {"id": "u1", "role": "user", "company_id": None}
+
+
+def _list(limit, cursor=None):
+    return document_routes.list_user_documents(limit=limit, cursor=cursor, q=None, user=USER)
+
+
+def test_my_documents_cursor_walks_every_document_once(db):
+    # same created_at for some, so the id tie-break matters
+    stamps = ["2026-01-01", "2026-01-02", "2026-01-02", "2026-01-02", "2026-01-03"]
+    for i, created_at in enumerate(stamps):
+        upsert("documents", {"id": f"d{i}", "user_id": "u1", "title": f"Doc {i}", "created_at": created_at,
+                             "pages": [{"name": "p"}], "sections": []})
+    upsert("documents", {"id": "other", "user_id": "u2", "created_at": "2026-01-04"})
+
+    seen, cursor, pages = [], None, 0
+    while True:
+        page = _list(2, cursor)
+        seen += [d["id"] for d in page["documents"]]
+        pages += 1
+        if not page["has_more"]:
+            assert page["next_cursor"] is None
+            break
+        cursor = page["next_cursor"]
+
+    assert seen == ["d4", "d3", "d2", "d1", "d0"]
+    assert pages == 3
+    assert _list(10)["documents"][0]["page_count"] == 1
+
+
+def test_my_documents_rejects_a_bad_cursor(db):
+    with pytest.raises(HTTPException) as err:
+        _list(2, "not-a-cursor")
+    assert err.value.status_code == 400
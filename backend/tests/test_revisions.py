@@ -0,0 +1,81 @@
+"""Document history (app/revisions.py): deltas, checkpoints, reconstruct and diff."""
+import pytest
+
+from app import revisions
+
+
+def _doc(version: int, title: str = "T", **contents) -> dict:
+    sections = [{"name": name, "content": content} for name, content in contents.items()]
+    return {"id": "d1", "version": version, "title": title, "pages": [], "sections": sections}
+
+
+@pytest.fixture
+def history(db, monkeypatch):
+    """v1 checkpoint, then one section edit per version up to v5, with a checkpoint every 3."""
+    monkeypatch.setattr(revisions, "REVISION_CHECKPOINT_EVERY", 3)
+    revisions.checkpoint(_doc(1, a="a1", b="b1"), "generate", "u1")
+    revisions.record_change(_doc(2, a="a2", b="b1"), [("section", "a")], "save_section", "u1")
+    revisions.record_change(_doc(3, a="a2", b="b3"), [("section", "b")], "save_section", "u2")
+    revisions.record_change(_doc(4, a="a4", b="b3"), [("section", "a")], "save_section", "u1")
+    revisions.record_change(_doc(5, a="a4", b="<p>one</p><p>two</p>"), [("section", "b")], "save_section", "u2")
+
+
+def test_records_deltas_with_periodic_checkpoints(history):
+    kinds = {r["version"]: r["kind"] for r in revisions.list_revisions("d1")}
+
+    assert kinds == {1: "checkpoint", 2: "delta", 3: "checkpoint", 4: "delta", 5: "delta"}
+    assert [r["version"] for r in revisions.list_revisions("d1")] == [5, 4, 3, 2, 1]
+
+
+@pytest.mark.parametrize("version, a, b", [
+    (1, "a1", "b1"), (2, "a2", "b1"), (3, "a2", "b3"), (4, "a4", "b3"), (5, "a4", "<p>one</p><p>two</p>"),
+])
+def test_reconstruct_every_version(history, version, a, b):
+    state = revisions.reconstruct("d1", version)
+
+    assert state["version"] == version
+    assert [s["content"] for s in state["sections"]] == [a, b]
+
+
+def test_reconstruct_unknown_version(history):
+    assert revisions.reconstruct("d1", 9) is None
+    assert revisions.reconstruct("other", 1) is None
+
+
+def test_changes_since(history):
+    assert revisions.changes_since("d1", 1, 2) == {("section", "a")}
+    assert revisions.changes_since("d1", 3, 5) == {("section", "a"), ("section", "b")}
+    assert revisions.changes_since("d1", 5, 5) == set()
+    # v1 is a whole-document checkpoint, v6 was never recorded: nothing can be said
+    assert revisions.changes_since("d1", 0, 2) is None
+    assert revisions.changes_since("d1", 4, 6) is None
+
+
+def test_diff_lists_changed_items_with_a_content_diff(history):
+    out = revisions.diff(revisions.reconstruct("d1", 3), revisions.reconstruct("d1", 5))
+
+    assert (out["from_version"], out["to_version"], out["title"]) == (3, 5, None)
+    assert [(i["name"], i["change"], i["fields"]) for i in out["items"]] == [
+        ("a", "modified", ["content"]), ("b", "modified", ["content"]),
+    ]
+    b_diff = out["items"][1]["content_diff"]
+    assert "-b3" in b_diff and "+<p>one</p>" in b_diff and "+<p>two</p>" in b_diff
+
+
+def test_diff_added_removed_and_title():
+    old = {"version": 1, "title": "A", "pages": [{"name": "p", "content": "x"}], "sections": []}
+    new = {"version": 2, "title": "B", "pages": [], "sections": [{"name": "s", "content": "y"}]}
+
+    out = revisions.diff(old, new)
+
+    assert out["title"] == {"from": "A", "to": "B"}
+    assert [(i["kind"], i["name"], i["change"]) for i in out["items"]] == [
+        ("page", "p", "removed"), ("section", "s", "added"),
+    ]
+
+
+def test_ensure_baseline_only_once(db):
+    revisions.ensure_baseline("d1", _doc(4, a="x"))
+    revisions.ensure_baseline("d1", _doc(7, a="y"))
+
+    assert [(r["version"], r["action"]) for r in revisions.list_revisions("d1")] == [(4, "baseline")]
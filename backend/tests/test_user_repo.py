@@ -0,0 +1,45 @@
+"""Indexed user lookups by normalised email, and the one-off email_normalized backfill."""
+import pytest
+
+from app import database, user_repo
+from app.database import upsert
+
+
+def test_lookups_are_by_normalised_email(db):
+    upsert("users", {"id": "u1", "email": "Ann@Example.com", "password": "pw"})
+
+    assert user_repo.find_by_email("  ann@EXAMPLE.com ")["id"] == "u1"
+    assert user_repo.authenticate("ann@example.com", "pw")["id"] == "u1"
+    assert user_repo.authenticate("ann@example.com", "wrong") is None
+    assert user_repo.find_by_email("bob@example.com") is None
+    assert user_repo.email_taken("ANN@example.com")
+    assert not user_repo.email_taken("ann@example.com", exclude_id="u1")
+    assert not user_repo.email_taken("")
+
+
+def test_legacy_users_are_found_once_migrated(db):
+    db["users"].insert_one({"id": "old", "email": " Old@Example.com ", "password": "pw"})
+    db["migrations"].delete_many({})
+
+    # no fallback scan on `email`: an unmigrated record is not found
+    assert user_repo.find_by_email("old@example.com") is None
+    assert database.run_migrations()["users.email_normalized"] == "done"
+    assert user_repo.authenticate("old@example.com", "pw")["id"] == "old"
+
+
+def test_migrations_run_once(db):
+    assert set(database.run_migrations().values()) == {"skipped"}  # ensure_indexes ran them
+
+    db["migrations"].delete_many({})
+    db["users"].insert_one({"id": "a", "email": "dup@example.com"})
+    db["users"].insert_one({"id": "b", "email": "DUP@example.com"})
+    assert database.run_migrations()["users.email_normalized"] == "done"
+    # the second record clashes with the unique index and is left as it was
+    assert user_repo.find_by_email("dup@example.com")["id"] == "a"
+    assert "email_normalized" not in db["users"].find_one({"id": "b"})
+
+
+def test_save_reports_a_taken_email(db):
+    user_repo.save({"id": "u1", "email": "ann@example.com"})
+    with pytest.raises(user_repo.EmailTaken):
+        user_repo.save({"id": "u2", "email": "Ann@example.com"})
@@ -13,6 +13,8 @@ import "../styles/UploadPage.css";
 
 export default function UploadPage() {
   const [documents, setDocuments] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [rawText, setRawText] = useState(localStorage.getItem("draft_raw_text") || "");
   const [loading, setLoading] = useState(false);
   const [snack, setSnack] = useState({ open: false, message: "", severity: "error" });
@@ -25,18 +27,45 @@ export default function UploadPage() {
     fetchDocs();
   }, []);
 
-  const fetchDocs = async () => {
+  // /my-documents is paginated: without a cursor this reloads the first page,
+  // with one it appends the next page
+  const fetchDocs = async (cursor = null) => {
     try {
       const token = localStorage.getItem("token");
       const res = await api.get("/api/documents/my-documents", {
         headers: { Authorization: `Bearer ${token}` },
+        params: cursor ? { cursor } : {},
       });
-      setDocuments(res.data?.documents || []);
+      const page = res.data?.documents || [];
+      setDocuments((prev) => (cursor ? [...prev, ...page] : page));
+      setNextCursor(res.data?.has_more ? res.data.next_cursor : null);
     } catch (err) {
       console.error("Failed to load documents", err);
     }
   };
 
+  const handleLoadMore = async () => {
+    if (!nextCursor) return;
+    setLoadingMore(true);
+    try {
+      await fetchDocs(nextCursor);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
+  const waitForOcr = async (docId) => {
+    const token = localStorage.getItem("token");
+    // eslint-disable-next-line no-constant-condition
+    while (true) {
+      const res = await api.get(`/api/documents/${docId}/ocr-status`, {
+        headers: { Authorization: `Bearer ${token}` },
+      });
+      if (res.data?.ocr_status !== "pending") return res.data;
+      await new Promise((resolve) => setTimeout(resolve, 1500));
+    }
+  };
+
   const handleFileUpload = async (fileOrEvent) => {
     const file = fileOrEvent instanceof File ? fileOrEvent : fileOrEvent?.target?.files?.[0];
     if (!file) return;
@@ -51,7 +80,21 @@ export default function UploadPage() {
         headers: { Authorization: `Bearer ${token}`, "Content-Type": "multipart/form-data" },
       });
 
-      const extracted = res.data?.raw_text || res.data?.extracted_text || "";
+      let extracted = res.data?.raw_text || res.data?.extracted_text || "";
+      // OCR runs in the background: poll until the document's text is ready
+      if (res.data?.ocr_status === "pending") {
+        const status = await waitForOcr(res.data.id);
+        if (status.ocr_status === "failed") {
+          throw new Error(status.ocr_error || "Text extraction failed");
+        }
+        const docRes = await api.get(`/api/documents/${res.data.id}`, {
+          headers: { Authorization: `Bearer ${token}` },
+        });
+        extracted = docRes.data?.raw_text || "";
+      } else if (res.data?.ocr_status === "failed") {
+        throw new Error(res.data?.ocr_error || "Text extraction failed");
+      }
+
       setRawText(extracted);
       localStorage.setItem("draft_raw_text", extracted);
       await fetchDocs();
@@ -61,7 +104,7 @@ export default function UploadPage() {
       console.error("upload error", err);
       setSnack({
         open: true,
-        message: err?.response?.data?.detail || "Upload/extract failed",
+        message: err?.response?.data?.detail || err?.message || "Upload/extract failed",
         severity: "error",
       });
     } finally {
@@ -121,9 +164,24 @@ export default function UploadPage() {
     localStorage.removeItem("draft_raw_text");
   };
 
-  const handleLoadDoc = (doc) => {
-    setRawText(doc.raw_text || "");
-    localStorage.setItem("draft_raw_text", doc.raw_text || "");
+  const handleLoadDoc = async (doc) => {
+    // the list only carries summaries; fetch the full document for its text
+    try {
+      const token = localStorage.getItem("token");
+      const res = await api.get(`/api/documents/${doc.id}`, {
+        headers: { Authorization: `Bearer ${token}` },
+      });
+      const text = res.data?.raw_text || "";
+      setRawText(text);
+      localStorage.setItem("draft_raw_text", text);
+    } catch (err) {
+      console.error("Failed to load document", err);
+      setSnack({
+        open: true,
+        message: err?.response?.data?.detail || "Failed to load document",
+        severity: "error",
+      });
+    }
   };
 
   const handleNewDoc = () => {
@@ -194,6 +252,11 @@ export default function UploadPage() {
                   </IconButton>
                 </div>
               ))}
+              {nextCursor && (
+                <button className="load-more-btn" onClick={handleLoadMore} disabled={loadingMore}>
+                  {loadingMore ? <CircularProgress size={14} color="inherit" /> : "Load more"}
+                </button>
+              )}
             </div>
           </aside>
 
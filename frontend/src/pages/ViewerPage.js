@@ -172,12 +172,14 @@ function ViewerPage() {
     try {
       const res = await api.post(
         `/api/documents/${id}/save-${mode}`,
+        // expected_version: the server merges edits to other items, 409s on this one
         mode === "page"
-          ? { page_name: item.name, content: html }
-          : { section_name: item.name, content: html }
+          ? { page_name: item.name, content: html, expected_version: documentData?.version }
+          : { section_name: item.name, content: html, expected_version: documentData?.version }
       );
 
-      const updated = normalizeDocument(res.data.document);
+      // page/section responses omit raw_text: keep the copy we already have
+      const updated = normalizeDocument({ ...documentData, ...res.data.document });
       setDocumentData(updated);
       setSnack({
         open: true,
@@ -190,7 +192,7 @@ function ViewerPage() {
       console.error("save error", err);
       setSnack({
         open: true,
-        message: `Failed to save ${mode}`,
+        message: err?.response?.status === 409 ? err.response.data?.detail : `Failed to save ${mode}`,
         severity: "error",
       });
     }
@@ -211,14 +213,16 @@ function ViewerPage() {
               page_name: currentItem.name,
               user_instruction: itemPrompt,
               raw_text: documentData?.raw_text || "",
+              expected_version: documentData?.version,
             }
           : {
               section_name: currentItem.name,
               user_instruction: itemPrompt,
               raw_text: documentData?.raw_text || "",
+              expected_version: documentData?.version,
             }
       );
-      const updated = normalizeDocument(res.data.document);
+      const updated = normalizeDocument({ ...documentData, ...res.data.document });
       setDocumentData(updated);
       setSnack({
         open: true,
@@ -232,7 +236,7 @@ function ViewerPage() {
       console.error("regenerate error", err);
       setSnack({
         open: true,
-        message: `Failed to regenerate ${mode}`,
+        message: err?.response?.status === 409 ? err.response.data?.detail : `Failed to regenerate ${mode}`,
         severity: "error",
       });
     } finally {
@@ -245,6 +249,7 @@ function ViewerPage() {
     try {
       const res = await api.post(`/api/documents/${id}/regenerate-document`, {
         raw_text: documentData?.raw_text || "",
+        expected_version: documentData?.version,
       });
       const updated = normalizeDocument(res.data.document);
       setDocumentData(updated);
@@ -259,7 +264,7 @@ function ViewerPage() {
       console.error("regen doc error", err);
       setSnack({
         open: true,
-        message: "Failed to regenerate document",
+        message: err?.response?.status === 409 ? err.response.data?.detail : "Failed to regenerate document",
         severity: "error",
       });
     } finally {